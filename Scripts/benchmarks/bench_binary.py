@@ -0,0 +1,79 @@
+import argparse
+import json
+import timeit
+import uuid
+
+import env
+
+import board as b
+import common.binary as bn
+import common.messages as m
+import common.settings as s
+
+# Size and round trip cost (encode, frame, decode) of the json and binary wire formats,
+#   for the message objects of the endpoints and for the parsed dicts the relay transcodes
+# Usage: python bench_binary.py -n 500 [--fields 9]
+
+
+def sample_messages(field_count=9):
+    id = uuid.uuid4()
+    location = {'x': 3, 'y': 7}
+    fields = [{'x': x, 'y': y, 'value': {'manhattanDistance': abs(x - 3) + abs(y - 9), 'contains': 'empty',
+                                         'userGuid': uuid.uuid4() if x == y else None}}
+              for x, y in (divmod(k, 8) for k in range(field_count))]
+    board = b.Board(s.Settings())
+    board.random_select_fields()
+    board.random_select_pieces()
+    for sq in board.content:
+        sq.discovered = True
+    return [
+        m.Move(id, 'N'),
+        m.MoveData(id, 'OK', 4),
+        m.DiscoverData(id, 'OK', location, fields),
+        m.KnowledgeExchangeData(id, uuid.uuid4(), fields),
+        m.GuiMessage(board.snapshot()),
+        m.GuiDelta([[x, y, 'RP'] for x in range(4) for y in range(4)]),
+    ]
+
+
+def measure(functions, n, rounds=20):
+    """ Best time per call of each function, the functions take turns so that they run under the same load """
+    best = [float('inf')] * len(functions)
+    for _ in range(rounds):
+        for k, f in enumerate(functions):
+            best[k] = min(best[k], timeit.timeit(f, number=n) / n)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=500, help='Round trips per measurement')
+    parser.add_argument('--fields', type=int, default=9,
+                        help='Fields of DiscoverData and KnowledgeExchangeData, 9 for a discover')
+    args = parser.parse_args()
+
+    decoders = m.Message._decoders_gm.copy()
+    decoders.update(m.Message._decoders_player)
+    decoders.update(m.Message._decoders_server)
+
+    print(f'{"message":>22} {"json B":>7} {"bin B":>7} | {"json us":>8} {"bin us":>8} | {"relay json":>10} {"relay bin":>10}')
+    for msg in sample_messages(args.fields):
+        name = type(msg).__name__
+        line = msg.to_json().encode()
+        frame = bn.stuff(msg.to_binary())
+        parsed = json.loads(line)
+
+        json_trip, bin_trip = measure([
+            lambda: m.Message._json_to_msg(msg.to_json().encode(), decoders),
+            lambda: m.Message._binary_to_msg(bn.unstuff(bn.stuff(msg.to_binary())), decoders)], args.n)
+        # The relay only needs the parsed dict, and writes it back when transcoding
+        relay_json, relay_bin = measure([
+            lambda: json.dumps(json.loads(line)).encode(),
+            lambda: bn.stuff(bn.encode_dict(bn.decode_dict(bn.unstuff(frame))))], args.n)
+
+        print(f'{name:>22} {len(line):7} {len(frame):7} | {json_trip * 1e6:8.1f} {bin_trip * 1e6:8.1f} |'
+              f' {relay_json * 1e6:10.1f} {relay_bin * 1e6:10.1f}')
+
+
+if __name__ == '__main__':
+    main()
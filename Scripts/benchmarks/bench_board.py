@@ -0,0 +1,50 @@
+import argparse
+import time
+import tracemalloc
+
+import env
+
+import board as b
+import compact_board as cb
+import common.settings as s
+
+# Compares construction time and memory of Board and CompactBoard
+# Usage: python bench_board.py --width 1000 --task 960 --goal 20
+
+
+def measure(board_class, settings):
+    start = time.perf_counter()
+    board_class(settings)
+    elapsed = time.perf_counter() - start
+
+    tracemalloc.start()
+    board = board_class(settings)
+    _current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del board
+
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', type=int, default=1000)
+    parser.add_argument('--task', type=int, default=960, help='Task area height')
+    parser.add_argument('--goal', type=int, default=20, help='Goal area height')
+    args = parser.parse_args()
+
+    settings = s.Settings()
+    settings.board_width = args.width
+    settings.task_area_length = args.task
+    settings.goal_area_length = args.goal
+
+    cells = args.width * (args.task + 2 * args.goal)
+    print(f'{args.width}x{args.task + 2 * args.goal} board, {cells} cells')
+
+    for name, board_class in (('Board', b.Board), ('CompactBoard', cb.CompactBoard)):
+        elapsed, peak = measure(board_class, settings)
+        print(f'{name:>14}: {elapsed * 1000:9.1f} ms  {peak / 2 ** 20:9.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+import argparse
+import time
+
+import env
+
+import pubsub.pub as pub
+
+import common.bus as bus
+import common.messages as m
+
+# Compares the cost of publishing a gm message through pypubsub and through the per-game EventBus,
+#   with one subscriber (the server) and with none (the gui, when no gui is attached)
+# Usage: python bench_bus.py -n 200000
+
+
+def server(arg1):
+    pass
+
+
+def measure(publish, n):
+    msg = m.Message()
+    start = time.perf_counter()
+    for _ in range(n):
+        publish(msg)
+    return (time.perf_counter() - start) / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=200000, help='Messages per measurement')
+    args = parser.parse_args()
+
+    pub.subscribe(server, 'server')
+    event_bus = bus.EventBus()
+    event_bus.subscribe('server', server)
+
+    def pubsub_gui(msg):
+        gui_topic = pub.getDefaultTopicMgr().getTopic('gui', okIfNone=True)
+        if gui_topic is not None and gui_topic.hasListeners():
+            pub.sendMessage('gui', arg1=msg)
+
+    def bus_gui(msg):
+        if event_bus.has_listeners('gui'):
+            event_bus.publish('gui', msg)
+
+    cases = (
+        ('pypubsub, 1 listener', lambda msg: pub.sendMessage('server', arg1=msg)),
+        ('EventBus, 1 listener', lambda msg: event_bus.publish('server', msg)),
+        ('pypubsub, no listener', pubsub_gui),
+        ('EventBus, no listener', bus_gui),
+    )
+    for name, publish in cases:
+        print(f'{name:>22}: {measure(publish, args.n) * 1e9:8.0f} ns/msg')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,128 @@
+import argparse
+import json
+import timeit
+import uuid
+
+import env
+
+import common.messages as m
+
+# Round trip (to json and back) cost of every message type, schema codec against the old implementation:
+#   json.dumps of __dict__ followed by string replaces for the renamed fields, and decoding lambdas
+# Usage: python bench_codec.py -n 5000
+
+
+# ======== Old codec ========
+
+class LegacyMessage:
+    """ __dict__ based copy of a message, fields in the same order """
+
+    def __init__(self, msg):
+        for attr, value in msg._items():
+            setattr(self, attr, value)
+
+
+def legacy_serialize(obj):
+    if isinstance(obj, uuid.UUID):
+        serial = str(obj.hex)
+        return serial
+
+    return obj.__dict__
+
+
+# Replaces done by the to_json overrides
+legacy_renames = {
+    m.ConfirmJoiningGame: (('\"preferred_team\"', '\"preferredTeam\"'),),
+    m.GameMessage: (('\"team_size\"', '\"teamSize\"'), ('\"team_guids\"', '\"teamGuids\"')),
+    m.JoinGame: (('\"preferred_team\"', '\"preferredTeam\"'),),
+    m.Move: (('\"dir\"', '\"direction\"'),),
+    m.KnowledgeExchangeData: (('\"to\"', '\"receiverGuid\"'),),
+}
+
+
+def legacy_to_json(msg, cls):
+    j = json.dumps(msg, default=legacy_serialize)
+    j = j.replace('\"id\"', '\"userGuid\"')
+    for old, new in legacy_renames.get(cls, ()):
+        j = j.replace(old, new)
+    return j
+
+
+legacy_decoders = {
+    m.ConfirmSetUpGame: lambda j: m.ConfirmSetUpGame(j['result']),
+    m.JoinGame: lambda j: m.JoinGame(j['userGuid'], j['preferredTeam'], j['type']),
+    m.Move: lambda j: m.Move(j['userGuid'], j['direction']),
+    m.PickUp: lambda j: m.PickUp(j['userGuid']),
+    m.TestPiece: lambda j: m.TestPiece(j['userGuid']),
+    m.Discover: lambda j: m.Discover(j['location'], j['userGuid']),
+    m.PlacePiece: lambda j: m.PlacePiece(j['userGuid']),
+    m.DestroyPiece: lambda j: m.DestroyPiece(j['userGuid']),
+    m.SetUpGame: lambda j: m.SetUpGame(j.get('slots')),
+    m.GameMessage: lambda j: m.GameMessage(j['userGuid'], j['team'], j['role'], j['teamSize'], j['teamGuids'], j['location'], j['board']),
+    m.ConfirmJoiningGame: lambda j: m.ConfirmJoiningGame(j['userGuid'], j['result'], j['type']),
+    m.MoveData: lambda j: m.MoveData(j['userGuid'], j['result'], j['manhattanDistance']),
+    m.PickUpData: lambda j: m.PickUpData(j['userGuid'], j['result']),
+    m.TestData: lambda j: m.TestData(j['userGuid'], j['result'], j['test']),
+    m.DiscoverData: lambda j: m.DiscoverData(j['userGuid'], j['result'], j['location'], j['fields']),
+    m.PlaceData: lambda j: m.PlaceData(j['userGuid'], j['result'], j['consequence']),
+    m.DestroyPieceData: lambda j: m.DestroyPieceData(j['userGuid'], j['result']),
+    m.GameOver: lambda j: m.GameOver(j['result']),
+    m.AuthorizeKnowledgeExchange: lambda j: m.AuthorizeKnowledgeExchange(j['userGuid'], j['receiverGuid']),
+    m.RejectKnowledgeExchange: lambda j: m.RejectKnowledgeExchange(j['userGuid'], j['rejectDuration']),
+    m.AcceptKnowledgeExchange: lambda j: m.AcceptKnowledgeExchange(j['userGuid']),
+    m.KnowledgeExchangeData: lambda j: m.KnowledgeExchangeData(j['userGuid'], j['receiverGuid'], j['fields']),
+    m.MessageTranslationError: lambda j: m.MessageTranslationError(j['error']),
+    m.UnkownGuidError: lambda j: m.UnkownGuidError(j['error']),
+    m.GuiDelta: lambda j: m.GuiDelta(j['cells']),
+}
+
+
+# ======== Measurement ========
+
+def sample_messages():
+    id = uuid.uuid4()
+    location = {'x': 3, 'y': 7}
+    fields = [{'x': x, 'y': y, 'value': {'manhattanDistance': 2, 'contains': 'empty', 'userGuid': None}}
+              for x in range(2, 5) for y in range(6, 9)]
+    board = {'width': 10, 'tasksHeight': 10, 'goalsHeight': 3}
+    return [
+        m.ConfirmSetUpGame('OK'), m.JoinGame(id, 'red', 'player'), m.Move(id, 'N'), m.PickUp(id), m.TestPiece(id),
+        m.Discover(location, id), m.PlacePiece(id), m.DestroyPiece(id), m.SetUpGame(8),
+        m.GameMessage(id, 'red', 'leader', 4, [uuid.uuid4() for _ in range(4)], location, board),
+        m.ConfirmJoiningGame(id, 'OK', 'player'), m.MoveData(id, 'OK', 4), m.PickUpData(id, 'OK'),
+        m.TestData(id, 'OK', True), m.DiscoverData(id, 'OK', location, fields), m.PlaceData(id, 'OK', 'Correct'),
+        m.DestroyPieceData(id, 'OK'), m.GameOver('red'), m.AuthorizeKnowledgeExchange(id, uuid.uuid4()),
+        m.RejectKnowledgeExchange(id, 'single'), m.AcceptKnowledgeExchange(id),
+        m.KnowledgeExchangeData(id, uuid.uuid4(), {'fields': []}), m.MessageTranslationError('bad json'),
+        m.UnkownGuidError('unknown guid'), m.GuiDelta([[x, 0, 'N'] for x in range(10)]),
+    ]
+
+
+# Best of a few runs, the machine may be busy
+def measure(round_trip, n):
+    return min(timeit.repeat(round_trip, number=n, repeat=5)) / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=5000, help='Round trips per message type')
+    args = parser.parse_args()
+
+    print(f'{"message":>28} {"old ns":>9} {"new ns":>9} {"speedup":>8}')
+    for msg in sample_messages():
+        cls = type(msg)
+        legacy = LegacyMessage(msg)
+        decode = legacy_decoders[cls]
+        schema = cls._schema
+
+        line = legacy_to_json(legacy, cls)
+        if line != msg.to_json():
+            raise AssertionError(f'{cls.__name__} json differs:\n{line}\n{msg.to_json()}')
+
+        old = measure(lambda: decode(json.loads(legacy_to_json(legacy, cls))), args.n)
+        new = measure(lambda: schema.decode(json.loads(msg.to_json())), args.n)
+        print(f'{cls.__name__:>28} {old * 1e9:9.0f} {new * 1e9:9.0f} {old / new:7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
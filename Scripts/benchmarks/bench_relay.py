@@ -0,0 +1,52 @@
+import argparse
+import json
+import timeit
+
+import env
+
+import bench_binary as bb
+import common.binary as bn
+import common.routing as rt
+
+# Per-frame routing cost of the relay: parsing the whole json message against reading its header only
+#   (routing.header_of), for json frames and for binary frames
+# Usage: python bench_relay.py -n 20000
+
+
+routes = rt.JsonTable({cls: 'handler' for cls in rt.ROUTES.values()}, 'default')
+
+
+def parse(data):
+    return routes.handler_of(json.loads(data))
+
+
+def scan(data):
+    header = rt.header_of(data)
+    if header is None:
+        header = json.loads(data)
+    return routes.handler_of(header)
+
+
+def scan_binary(frame):
+    return routes.handler_of(rt.header_of(bn.unstuff(frame)))
+
+
+def measure(f, n):
+    return min(timeit.repeat(f, number=n, repeat=5)) / n
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=20000, help='Frames per measurement')
+    args = parser.parse_args()
+
+    print(f'{"message":>22} {"bytes":>6} | {"parse us":>9} {"header us":>10} {"binary us":>10}')
+    for msg in bb.sample_messages():
+        data = msg.to_json().encode()
+        frame = bn.stuff(msg.to_binary())
+        print(f'{type(msg).__name__:>22} {len(data):6} | {measure(lambda: parse(data), args.n) * 1e6:9.2f}'
+              f' {measure(lambda: scan(data), args.n) * 1e6:10.2f} {measure(lambda: scan_binary(frame), args.n) * 1e6:10.2f}')
+
+
+if __name__ == '__main__':
+    main()
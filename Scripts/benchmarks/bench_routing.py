@@ -0,0 +1,161 @@
+import argparse
+import json
+import time
+import uuid
+
+import env
+
+import multipledispatch as md
+
+import common.messages as m
+import common.routing as rt
+
+# Per-message dispatch cost of the routing tables against the dispatchers they replaced:
+#   multipledispatch (GmExternal), a type(msg) if-chain (Bot) and nested ifs over the json keys (server)
+# Usage: python bench_routing.py -n 200000
+
+
+def handler(msg):
+    pass
+
+
+# ======== Replaced dispatchers ========
+
+class MultipleDispatch:
+
+    @md.dispatch(m.JoinGame)
+    def send(self, msg):
+        handler(msg)
+
+    @md.dispatch(m.Move)
+    def send(self, msg):
+        handler(msg)
+
+    @md.dispatch(m.Discover)
+    def send(self, msg):
+        handler(msg)
+
+    @md.dispatch(m.TestPiece)
+    def send(self, msg):
+        handler(msg)
+
+    @md.dispatch(m.PickUp)
+    def send(self, msg):
+        handler(msg)
+
+    @md.dispatch(m.PlacePiece)
+    def send(self, msg):
+        handler(msg)
+
+    @md.dispatch(m.DestroyPiece)
+    def send(self, msg):
+        handler(msg)
+
+
+def if_chain(msg):
+    t = type(msg)
+    if t is m.ConfirmJoiningGame:
+        handler(msg)
+    elif t is m.DestroyPieceData:
+        handler(msg)
+    elif t is m.DiscoverData:
+        handler(msg)
+    elif t is m.GameMessage:
+        handler(msg)
+    elif t is m.MoveData:
+        handler(msg)
+    elif t is m.PickUpData:
+        handler(msg)
+    elif t is m.PlaceData:
+        handler(msg)
+    elif t is m.TestData:
+        handler(msg)
+    elif t is m.KnowledgeExchangeData:
+        handler(msg)
+
+
+def server_ifs(j):
+    action = j["action"]
+    if action == 'gui':
+        handler(j)
+        return
+    if action == "start":
+        handler(j)
+    elif action == "connect":
+        if "result" not in j:
+            handler(j)
+        else:
+            handler(j)
+    elif action == "end":
+        handler(j)
+    elif action == "exchange":
+        if "receiverGuid" in j:
+            handler(j)
+        elif "result" and "userGuid" in j:
+            handler(j)
+    elif action == "send":
+        if "receiverGuid" in j:
+            handler(j)
+    else:
+        if "userGuid" in j:
+            if "result" in j:
+                handler(j)
+            else:
+                handler(j)
+
+
+# ======== Routing tables ========
+
+gm_routes = rt.table({cls: handler for cls in (m.JoinGame, m.Move, m.Discover, m.TestPiece, m.PickUp, m.PlacePiece, m.DestroyPiece)})
+bot_routes = rt.table({cls: handler for cls in (m.ConfirmJoiningGame, m.DestroyPieceData, m.DiscoverData, m.GameMessage, m.MoveData,
+                                                m.PickUpData, m.PlaceData, m.TestData, m.KnowledgeExchangeData)})
+server_routes = rt.JsonTable({cls: handler for cls in rt.ROUTES.values()}, handler)
+
+
+def gm_table(msg):
+    gm_routes[msg.route](msg)
+
+
+def bot_table(msg):
+    bot_routes[msg.route](msg)
+
+
+def server_table(j):
+    server_routes.handler_of(j)(j)
+
+
+def measure(dispatch, msgs, n):
+    start = time.perf_counter()
+    for _ in range(n // len(msgs)):
+        for msg in msgs:
+            dispatch(msg)
+    return (time.perf_counter() - start) / (n // len(msgs) * len(msgs))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-n', type=int, default=200000, help='Messages per measurement')
+    args = parser.parse_args()
+
+    id = uuid.uuid4()
+    # Most of the traffic, in both directions
+    to_gm = [m.Move(id, 'N'), m.Discover({'x': 0, 'y': 0}, id), m.PickUp(id), m.TestPiece(id), m.PlacePiece(id)]
+    to_bot = [m.MoveData(id, 'OK', 3), m.DiscoverData(id, 'OK', {'x': 0, 'y': 0}, []), m.PickUpData(id, 'OK'),
+              m.TestData(id, 'OK', True), m.PlaceData(id, 'OK', 'Correct')]
+    to_server = [json.loads(msg.to_json()) for msg in to_gm + to_bot]
+
+    gm = MultipleDispatch()
+    cases = (
+        ('gm: multipledispatch', gm.send, to_gm),
+        ('gm: table', gm_table, to_gm),
+        ('bot: if chain', if_chain, to_bot),
+        ('bot: table', bot_table, to_bot),
+        ('server: ifs', server_ifs, to_server),
+        ('server: table', server_table, to_server),
+    )
+    for name, dispatch, msgs in cases:
+        print(f'{name:>22}: {measure(dispatch, msgs, args.n) * 1e9:8.0f} ns/msg')
+
+
+if __name__ == '__main__':
+    main()
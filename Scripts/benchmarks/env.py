@@ -0,0 +1,13 @@
+import sys
+import os
+
+# Used as import in the benchmark files, same as tests/env.py
+
+# append module root directory to sys.path
+sys.path.append(
+    os.path.dirname(
+        os.path.dirname(
+            os.path.abspath(__file__)
+        )
+    )
+)
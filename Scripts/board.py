@@ -4,11 +4,21 @@ import uuid
 import common.settings as s
 import common.square as sqr
 import common.piece as pc
+import distance_field as df
+import free_cells as fc
+
+
+# uuid4 drawn from a seeded random generator, so that ids are the same when a game is replayed
+def random_uuid(rng: random.Random):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
 
 class Board:
 
-    def __init__(self, settings: s.Settings):
-        self.id = uuid.uuid4()
+    # rng: random generator of the game, a new unseeded one if None
+    def __init__(self, settings: s.Settings, rng: random.Random = None):
+        self.rng = rng if rng is not None else random.Random()
+        self.id = random_uuid(self.rng)
         self.board_width = settings.board_width
         self.goal_area_height = settings.goal_area_length
         self.piece_sham_chance = settings.piece_sham_chance
@@ -18,14 +28,36 @@ class Board:
         self.board_height = settings.goal_area_length * 2 + settings.task_area_length
         self.task_area_height = settings.task_area_length
 
-        self.goal_area_blue = [sqr.Square(x, y, sqr.SquareType.BlueGoalArea) for y in range(self.goal_area_height)
-                                for x in range(self.board_width)]
+        # Distance from every square to the closest piece, kept up to date by the squares themselves
+        self.distances = df.DistanceField(self.board_width, self.board_height)
+
+        # Last snapshot taken (None until the first one) and the rows changed since
+        self._snapshot = None
+        self._dirty_rows = set()
+
+        # Free cells for new goal fields (blue side, mirrored on red), pieces and players
+        goal_size = self.goal_area_height * self.board_width
+        task_end = goal_size + self.task_area_height * self.board_width
+        self.free_goal_fields = fc.FreeCells(0, goal_size)
+        self.free_piece_cells = fc.FreeCells(goal_size, task_end)
+        self.free_player_cells = fc.FreeCells(goal_size, task_end)
+
+        self._create_squares()
+
+    # Builds one Square object per cell
+    def _create_squares(self):
+        on_change = self._square_changed
+        rng = self.rng
 
-        self.task_area = [sqr.Square(x, y, sqr.SquareType.TaskArea) 
+        self.goal_area_blue = [sqr.Square(x, y, sqr.SquareType.BlueGoalArea, on_change=on_change, id=random_uuid(rng))
+                               for y in range(self.goal_area_height)
+                               for x in range(self.board_width)]
+
+        self.task_area = [sqr.Square(x, y, sqr.SquareType.TaskArea, on_change=on_change, id=random_uuid(rng))
                           for y in range(self.goal_area_height, self.board_height - self.goal_area_height)
                           for x in range(self.board_width)]
 
-        self.goal_area_red = [sqr.Square(x, y, sqr.SquareType.RedGoalArea) 
+        self.goal_area_red = [sqr.Square(x, y, sqr.SquareType.RedGoalArea, on_change=on_change, id=random_uuid(rng))
              for y in range(self.board_height - self.goal_area_height, self.board_height)
              for x in range(self.board_width)]
 
@@ -40,36 +72,107 @@ class Board:
             return None
         return self.content[y * self.board_width + x]
 
+    # Checks if a player of the given team may step on x,y
+    def can_move(self, x, y, team):
+        sq = self.get_square(x, y)
+
+        if sq is None:
+            return False
+        elif sq.player is not None:
+            return False
+        elif (sq.type == sqr.SquareType.BlueGoalField or sq.type == sqr.SquareType.BlueGoalArea) and team == 'red':
+            return False
+        elif (sq.type == sqr.SquareType.RedGoalArea or sq.type == sqr.SquareType.RedGoalField) and team == 'blue':
+            return False
+        else:
+            return True
+
+    # Checks if x,y lies in either goal area
+    def in_goal_area(self, x, y):
+        return self.get_square(x, y).type != sqr.SquareType.TaskArea
+
+    # Returns Manhattan distance from x,y to the closest piece on the board, None if there are none
+    def piece_distance(self, x, y):
+        return self.distances.get(x, y)
+
+    # Returns an immutable snapshot of the rendered board.
+    # Only rows changed since the previous snapshot are rendered again, the rest are shared with it
+    def snapshot(self):
+        prev = self._snapshot
+        if prev is not None and not self._dirty_rows:
+            return prev
+
+        if prev is None:
+            rows = [None] * self.board_height
+            dirty = range(self.board_height)
+        else:
+            rows = list(prev.rows)
+            dirty = self._dirty_rows
+
+        w = self.board_width
+        for y in dirty:
+            rows[y] = tuple(str(self.get_square(x, y)) for x in range(w))
+
+        self._dirty_rows = set()
+        self._snapshot = BoardSnapshot(w, self.board_height, tuple(rows),
+                                       0 if prev is None else prev.version + 1)
+        return self._snapshot
+
+    # Marks x,y as changed for the next snapshot, for changes not made through the square itself
+    #   (e.g. the piece held by a player standing on it)
+    def mark_dirty(self, x, y):
+        self._dirty_rows.add(y)
+
+    # Called by a square whenever it is changed, keeps the distance field and snapshot in sync
+    def _square_changed(self, sq):
+        self._dirty_rows.add(sq.y)
+        i = sq.y * self.board_width + sq.x
+
+        if sq.piece is None:
+            self.distances.remove(sq.x, sq.y)
+            self.free_piece_cells.release(i)
+        else:
+            self.distances.add(sq.x, sq.y)
+            self.free_piece_cells.take(i)
+
+        if sq.player is None:
+            self.free_player_cells.release(i)
+        else:
+            self.free_player_cells.take(i)
+
+        if sq.type == sqr.SquareType.BlueGoalArea:
+            self.free_goal_fields.release(i)
+        else:
+            self.free_goal_fields.take(i)
+
     # Randomly selects goal areas to be fields on red side and mirrors them on blue side
     def random_select_fields(self):
-        rem = self.goal_definition
-
-        while True:
-            sq = random.choice(self.goal_area_blue)
-            if sq.type == sqr.SquareType.BlueGoalArea:
-                sq.type = sqr.SquareType.BlueGoalField
-                self.get_square(sq.x,self.board_height - sq.y - 1).type = sqr.SquareType.RedGoalField
-                rem = rem - 1
-            if rem == 0:
-                break
-
-    # Randomly adds new pieces to the board
+        if self.goal_definition > len(self.free_goal_fields):
+            raise ValueError(
+                f'Can not place {self.goal_definition} goal fields in a goal area of {len(self.free_goal_fields)} free squares')
+
+        for _ in range(self.goal_definition):
+            i = self.free_goal_fields.choice(self.rng)
+            sq = self.content[i]
+            sq.type = sqr.SquareType.BlueGoalField
+            self.get_square(sq.x, self.board_height - sq.y - 1).type = sqr.SquareType.RedGoalField
+
+    # Randomly adds new pieces to the board, as many as fit if the task area is too small
     def random_select_pieces(self):
-        rem = self.piece_count
+        for _ in range(min(self.piece_count, len(self.free_piece_cells))):
+            i = self.free_piece_cells.choice(self.rng)
+            self.content[i].piece = pc.Piece(
+                is_sham=True if self.rng.random() < self.piece_sham_chance else False)
 
-        while True:
-            sq = random.choice(self.task_area)
-            if sq.piece is None:
-                sq.piece = pc.Piece(
-                    is_sham=True if random.random() < self.piece_sham_chance else False)
-                rem = rem - 1
-                if rem == 0:
-                    break
+    # Returns a random task area square without a player, None if all are taken
+    def random_free_player_square(self):
+        i = self.free_player_cells.choice(self.rng)
+        return None if i is None else self.content[i]
 
     # Picks random square in task area and adds a new piece, will destroy old piece if present
     def new_piece(self):
-        sq = random.choice(self.task_area)
-        sq.piece = pc.Piece(is_sham=True if random.random()
+        sq = self.rng.choice(self.task_area)
+        sq.piece = pc.Piece(is_sham=True if self.rng.random()
                             < self.piece_sham_chance else False)
 
     def __str__(self):
@@ -80,3 +183,16 @@ class Board:
                 s += f'|{self.get_square(x, y)}| '
             b = b + s + "\n"
         return b
+
+
+class BoardSnapshot:
+    """ Read-only rendering of a board at some point in time, each cell holds str() of its square """
+
+    def __init__(self, board_width: int, board_height: int, rows: tuple, version: int):
+        self.board_width = board_width
+        self.board_height = board_height
+        self.rows = rows
+        self.version = version
+
+    def get_cell(self, x, y):
+        return self.rows[y][x]
@@ -19,6 +19,7 @@ from enum import Enum
 
 import common.settings as s
 import common.messages as m
+import common.routing as rt
 import common.delay as d
 import common.logger as l
 
@@ -35,25 +36,9 @@ class Bot():
 		self.sendMsg = callback
 
 	def interpret_message(self, msg: m.Message):
-		t = type(msg)
-		if t is m.ConfirmJoiningGame:
-			self.init_callback(msg)
-		elif t is m.DestroyPieceData:
-			self.destroyPieceCallback(msg)
-		elif t is m.DiscoverData:
-			self.discoverDataCallback(msg)
-		elif t is m.GameMessage:
-			self.game_start_callback(msg)
-		elif t is m.MoveData:
-			self.moveCallback(msg)
-		elif t is m.PickUpData:
-			self.pickUpCallback(msg)
-		elif t is m.PlaceData:
-			self.placePieceCallback(msg)
-		elif t is m.TestData:
-			self.testPieceCallback(msg)
-		elif t is m.KnowledgeExchangeData:
-			self.knowledgeExchangeCallback(msg)
+		handler = self._routes.get(msg.route)
+		if handler is not None:
+			handler(self, msg)
 		else:
 			print(f"unrecognized message received: {msg}")
 
@@ -237,6 +222,19 @@ class Bot():
 	def updateLoc(self, dir:str):
 		self.boardWrapper.updatePosition(dir)
 
+	# callbacks of the messages sent to the bot, by route
+	_routes = rt.table({
+		m.ConfirmJoiningGame: init_callback,
+		m.DestroyPieceData: destroyPieceCallback,
+		m.DiscoverData: discoverDataCallback,
+		m.GameMessage: game_start_callback,
+		m.MoveData: moveCallback,
+		m.PickUpData: pickUpCallback,
+		m.PlaceData: placePieceCallback,
+		m.TestData: testPieceCallback,
+		m.KnowledgeExchangeData: knowledgeExchangeCallback,
+	})
+
 
 class Team(Enum):
 	RED = "red"
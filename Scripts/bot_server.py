@@ -1,39 +1,70 @@
 
 from twisted.internet import task
 from twisted.internet.defer import Deferred
-from twisted.internet.protocol import ClientFactory
-from twisted.protocols.basic import LineReceiver
+from twisted.internet.protocol import ClientFactory, Protocol
 import argparse
+import random
+import time
 
+import common.binary as wire
+import common.framing as framing
 import common.messages as m
+import common.tracing as tr
 import bot as b
 import uuid
 
 
-class BotServer(LineReceiver):
+class BotServer(Protocol):
 
 	def __init__(self):
 		self.bot = None
-		self.id = uuid.uuid4()
-		self.delimiter = b'\x17'
+		# A bot started again with the guid it had continues in its game
+		self.id = uuid.UUID(guid) if guid is not None else uuid.uuid4()
+		self.frames = framing.FrameDecoder(max_frame, length_prefixed)
+		# Binary frames are asked for when joining, and sent once the server answers in binary
+		self.binary = False
+		# trace id -> time the traced request was sent, until its result comes back (see common/tracing.py)
+		self.traces = {}
 
 	def connectionMade(self):
 		global team
 		msg = m.JoinGame(id=self.id, preferred_team=team, type='player')
+		if binary:
+			msg.encoding = 'binary'
 		self.bot = b.Bot(id = self.id, teamPref = team, callback = self.pass_to_server)
 		self.pass_to_server(msg)
 
 	def write_msg(self, msg: m.Message):
-		self.transport.write(msg.to_json().encode() + self.delimiter)
+		if self.binary:
+			self.transport.write(framing.encode(wire.stuff(msg.to_binary()), length_prefixed))
+		else:
+			self.transport.write(framing.encode(msg.to_json().encode(), length_prefixed))
 
 	def pass_to_server(self, arg1):
 		print(f'> bot server: sending msg to server: {arg1}')
+		if tracer is not None and random.random() < trace_sample:
+			arg1.traceId = tr.new_id()
+			self.traces[arg1.traceId] = time.perf_counter()
 		self.write_msg(arg1)
 
+	def dataReceived(self, data):
+		try:
+			lines = self.frames.feed(data)
+		except ValueError as err:
+			print(f'> bot server: {err}, closing the connection')
+			self.severConnection()
+			return
+		for line in lines:
+			self.lineReceived(line)
+
 	def lineReceived(self, line):
 		print(f'> bot server: received line \"{line}\"')
-		# Translate json to msg
-		msg, err = m.Message.from_json_player(line)
+		# Translate json (or binary) to msg
+		if wire.is_binary(line):
+			self.binary = True
+			msg, err = m.Message.from_binary_player(wire.unstuff(line))
+		else:
+			msg, err = m.Message.from_json_player(line)
 
 		# If the message could not be translated
 		if err is not None:
@@ -41,6 +72,10 @@ class BotServer(LineReceiver):
 			self.write_msg(m.MessageTranslationError(err))
 			return
 
+		if msg.traceId in self.traces:
+			start = self.traces.pop(msg.traceId)
+			tracer.span(msg.traceId, 'round trip', start, time.perf_counter(), self.id.hex[:8], action=msg.action)
+
 		# only pass messages directly addressed to the bot
 		if type(msg) is not m.GameOver:
 			if msg.id is None or msg.id != self.id.hex:
@@ -60,8 +95,9 @@ class BotServer(LineReceiver):
 		print('> bot server: Closing connection')
 		self.transport.loseConnection()
 
-	def rawDataReceived(self, data):  # not important, just needs to be implemented
-		pass
+	def connectionLost(self, reason):
+		if tracer is not None:
+			tracer.close()
 
 
 class EchoClientFactory(ClientFactory):  # no need to change anything there
@@ -80,19 +116,38 @@ class EchoClientFactory(ClientFactory):  # no need to change anything there
 
 
 team = None
+binary = False
+guid = None
+max_frame = framing.MAX_LENGTH
+length_prefixed = False
+tracer = None
+trace_sample = 1.0
 
 
 def main():
-	global team
+	global team, binary, guid, max_frame, length_prefixed, tracer, trace_sample
 	parser = argparse.ArgumentParser()
 	parser.add_argument('-a', '--address', help='IPv4 or address or IPv6 address or host name', default='localhost')
 	parser.add_argument('-p', '--port', help='Server port number', type=int, default=9997)
 	parser.add_argument('-t', '--team', help="Preferred team", type=str, default="red")
+	parser.add_argument('--binary', help="Ask the server for the compact binary wire format instead of json", action='store_true')
+	parser.add_argument('--guid', help="Guid to join with, to continue the game of a bot that lost its connection", type=str)
+	parser.add_argument('--max-frame', help="Largest frame taken from the server, in bytes", type=int, default=framing.MAX_LENGTH)
+	parser.add_argument('--length-prefixed', help="Prefix frames with their length instead of delimiting them", action='store_true')
+	parser.add_argument('--trace', help="Trace requests, the spans are written to this directory (see trace.py)", type=str)
+	parser.add_argument('--trace-sample', help="Fraction of the requests traced", type=float, default=1.0)
 
 	args = parser.parse_args()
 	port = args.port
 	address = args.address
 	team = args.team
+	guid = args.guid
+	binary = args.binary
+	max_frame = args.max_frame
+	length_prefixed = args.length_prefixed
+	trace_sample = args.trace_sample
+	if args.trace is not None:
+		tracer = tr.Tracer(args.trace, 'bot')
 
 	def run(reactor):
 		factory = EchoClientFactory()
@@ -0,0 +1,601 @@
+import itertools
+import operator
+import struct
+import uuid
+
+import common.codec as c
+
+# Compact binary wire format, an alternative to json negotiated per connection (json stays the default).
+# A binary frame is: version byte, message code (one byte per message class), envelope flags and values,
+#   the fields of the message in schema order, and a dict of extra keys (or null).
+# Values are tagged: small ints and common strings (symbols: results, teams, board cells, field names)
+#   take one byte, guids 16 bytes, lists of symbols or small ints one byte per item. Lists of same shaped
+#   dicts (DiscoverData fields) or lists (gui cells) are written column by column, with the keys once,
+#   so that their columns pack into the one byte per item lists and decode without per value work.
+# Json frames always start with '{', binary frames with the version byte, so a receiver can tell them apart.
+# Binary frames are byte stuffed, so they never contain the \x17 frame delimiter.
+
+VERSION = 0x01
+
+# Value tags
+_NULL = 0x00
+_FALSE = 0x01
+_TRUE = 0x02
+_UINT = 0x03    # varint
+_NINT = 0x04    # varint of -v - 1
+_FLOAT = 0x05   # 8 bytes
+_STR = 0x06     # varint length, utf-8
+_GUID = 0x07    # 16 bytes, a 32 character hex string in json
+_LIST = 0x08    # varint count, values
+_DICT = 0x09    # varint count, key and value pairs
+_SYMS = 0x0A    # varint count, one symbol byte each
+_TABLE = 0x0B   # list of dicts with the same keys: varint rows, varint key count, keys, then one list per key
+_ROWS = 0x0C    # list of lists with the same length: varint rows, varint length, then one list per column
+_BYTES = 0x0D   # list of ints in [0, 256): varint count, one byte each
+_FIXINT = 0x20  # 0x20 + v for 0 <= v < 64
+_SYMBOL = 0x60  # 0x60 + index in SYMBOLS
+
+# Strings sent as a single byte. Append only, the index is part of the format
+SYMBOLS = (
+    # results and values
+    'OK', 'denied', 'red', 'blue', 'player', 'leader', 'member', 'N', 'S', 'E', 'W',
+    'true', 'false', 'null', 'correct', 'meaningless', 'permanent', 'single', 'binary', 'json',
+    'empty', 'piece', 'sham', 'won', 'lost',
+    # board cells, as sent to the gui
+    '', 'P', 'R', 'B', 'RP', 'RS', 'BP', 'BS', 'R|P', 'R|S', 'B|P', 'B|S', 'YG', 'G',
+    # keys of nested values
+    'x', 'y', 'value', 'manhattanDistance', 'contains', 'userGuid', 'width', 'tasksHeight', 'goalsHeight',
+    'fields', 'location',
+)
+assert len(SYMBOLS) <= 0x100 - _SYMBOL
+
+_symbol_codes = {s: _SYMBOL + i for i, s in enumerate(SYMBOLS)}
+# byte -> symbol, for decoding symbol lists
+_symbol_of = [None] * _SYMBOL + list(SYMBOLS) + [None] * (0x100 - _SYMBOL - len(SYMBOLS))
+
+_float = struct.Struct('<d')
+
+# Item types of the lists packed by _put_list
+_STR_ITEMS = {str}
+_INT_ITEMS = {int}
+_DICT_ITEMS = {dict}
+_ROW_ITEMS = {list, tuple}
+_NONE_ITEMS = {type(None)}
+
+# Symbol columns of the grids and their encoding, both ways, and the keys of the tables, up to _MAX_COLUMNS of
+#   each (see _put_columns and _table_head)
+_MAX_COLUMNS = 0x1000
+_packed_columns = {}
+_column_symbols = {}
+_table_heads = {}
+
+
+# ======== Framing ========
+
+def is_binary(frame):
+    return len(frame) > 0 and frame[0] == VERSION
+
+
+def stuff(payload: bytes):
+    """ Escapes the frame delimiter (and the escape byte) """
+    return payload.replace(b'\x1b', b'\x1b\x01').replace(b'\x17', b'\x1b\x02')
+
+
+def unstuff(frame: bytes):
+    return frame.replace(b'\x1b\x02', b'\x17').replace(b'\x1b\x01', b'\x1b')
+
+
+# ======== Values ========
+
+def _put_varint(out, v):
+    while v >= 0x80:
+        out.append((v & 0x7F) | 0x80)
+        v >>= 7
+    out.append(v)
+
+
+def _put_str(out, v):
+    code = _symbol_codes.get(v)
+    if code is not None:
+        out.append(code)
+        return
+    if len(v) == 32:
+        try:
+            packed = bytes.fromhex(v)
+        except ValueError:
+            packed = None
+        # Only lower case hex round trips to the same string
+        if packed is not None and packed.hex() == v:
+            out.append(_GUID)
+            out += packed
+            return
+    data = v.encode()
+    out.append(_STR)
+    _put_varint(out, len(data))
+    out += data
+
+
+def _put_list(out, v):
+    n = len(v)
+    if n > 0:
+        # Shapes are checked with C level passes (map, set) rather than item by item
+        types = set(map(type, v))
+        if types == _STR_ITEMS:
+            try:
+                codes = bytes(_lookup(_symbol_codes, v))
+            except KeyError:
+                codes = None
+            if codes is not None:
+                out.append(_SYMS)
+                _put_varint(out, n)
+                out += codes
+                return
+        elif types == _INT_ITEMS:
+            try:
+                data = bytes(v)
+            except ValueError:
+                data = None
+            if data is not None:
+                out.append(_BYTES)
+                _put_varint(out, n)
+                out += data
+                return
+        elif types == _DICT_ITEMS:
+            keys = tuple(v[0])
+            # Rows with as many keys as the first one and all of its keys have the same keys
+            columns = None
+            if keys and len(set(map(len, v))) == 1:
+                head = _table_heads.get(keys)
+                if head is None:
+                    head = _table_head(keys)
+                try:
+                    columns = head[1](v)
+                except KeyError:
+                    pass
+            if columns is not None:
+                out.append(_TABLE)
+                _put_varint(out, n)
+                out += head[0]
+                for column in columns:
+                    _put_list(out, column)
+                return
+        elif types == _NONE_ITEMS:
+            # Optional values missing from all the rows of a table (e.g. the guids of discovered fields)
+            out.append(_LIST)
+            _put_varint(out, n)
+            out += bytes(n)
+            return
+        elif types <= _ROW_ITEMS:
+            width = len(v[0])
+            if width and len(set(map(len, v))) == 1:
+                out.append(_ROWS)
+                _put_varint(out, n)
+                _put_varint(out, width)
+                _put_columns(out, v)
+                return
+    out.append(_LIST)
+    _put_varint(out, n)
+    writers = _writers
+    for x in v:
+        writers.get(type(x), _put_default)(out, x)
+
+
+def _put_columns(out, rows):
+    # Columns of symbols (gui boards) change little from frame to frame, their encoding is kept
+    packed = _packed_columns
+    for column in zip(*rows):
+        data = None
+        if type(column[0]) is str:
+            try:
+                data = packed.get(column)
+            except TypeError:
+                pass
+        if data is not None:
+            out += data
+            continue
+        start = len(out)
+        _put_list(out, column)
+        if out[start] == _SYMS:
+            if len(packed) >= _MAX_COLUMNS:
+                packed.clear()
+            packed[column] = bytes(out[start:])
+
+
+def _table_head(keys):
+    """ The encoding of the keys of a table, with their count, and the function giving the values of each key
+        in the rows, kept for the next tables with the same keys """
+    head = bytearray()
+    _put_varint(head, len(keys))
+    for k in keys:
+        put(head, k)
+    getter = operator.itemgetter(*keys)
+    if len(keys) == 1:
+        columns = lambda rows: (tuple(map(getter, rows)),)
+    else:
+        columns = lambda rows: zip(*map(getter, rows))
+    if len(_table_heads) >= _MAX_COLUMNS:
+        _table_heads.clear()
+    _table_heads[keys] = bytes(head), columns
+    return _table_heads[keys]
+
+
+def _lookup(table, keys):
+    """ The items of table (dict or list) at the given keys, as a tuple """
+    keys = tuple(keys)
+    if len(keys) == 1:
+        return table[keys[0]],
+    return operator.itemgetter(*keys)(table)
+
+
+def _put_int(out, v):
+    if 0 <= v < 0x40:
+        out.append(_FIXINT + v)
+    elif v >= 0:
+        out.append(_UINT)
+        _put_varint(out, v)
+    else:
+        out.append(_NINT)
+        _put_varint(out, -v - 1)
+
+
+def _put_dict(out, v):
+    out.append(_DICT)
+    _put_varint(out, len(v))
+    writers = _writers
+    for k, x in v.items():
+        writers.get(type(k), _put_default)(out, k)
+        writers.get(type(x), _put_default)(out, x)
+
+
+def _put_float(out, v):
+    out.append(_FLOAT)
+    out += _float.pack(v)
+
+
+def _put_uuid(out, v):
+    out.append(_GUID)
+    out += v.bytes
+
+
+def _put_default(out, v):
+    # Same as the json encoder
+    put(out, c._default(v))
+
+
+# type -> writer, looked up once per value instead of testing the types in turn
+_writers = {
+    str: _put_str,
+    int: _put_int,
+    type(None): lambda out, v: out.append(_NULL),
+    bool: lambda out, v: out.append(_TRUE if v else _FALSE),
+    list: _put_list,
+    tuple: _put_list,
+    dict: _put_dict,
+    float: _put_float,
+    uuid.UUID: _put_uuid,
+}
+
+
+def put(out: bytearray, v):
+    """ Appends the encoding of a json-like value, uuids are sent as guids """
+    _writers.get(type(v), _put_default)(out, v)
+
+
+def _get_varint(data, i):
+    b = data[i]
+    if b < 0x80:
+        return b, i + 1
+    v = 0
+    shift = 0
+    while b >= 0x80:
+        v |= (b & 0x7F) << shift
+        shift += 7
+        i += 1
+        b = data[i]
+    return v | (b << shift), i + 1
+
+
+def get(data: bytes, i: int):
+    """ Decodes the value at i, returns (value, index after it) """
+    b = data[i]
+    if b >= _SYMBOL:
+        return _symbol_of[b], i + 1
+    if b >= _FIXINT:
+        return b - _FIXINT, i + 1
+    return _readers[b](data, i + 1)
+
+
+def _get_list(data, i):
+    n, i = _get_varint(data, i)
+    if data[i:i + n] == bytes(n):
+        return [None] * n, i + n
+    v = []
+    append = v.append
+    for _ in range(n):
+        x, i = get(data, i)
+        append(x)
+    return v, i
+
+
+def _get_dict(data, i):
+    n, i = _get_varint(data, i)
+    v = {}
+    for _ in range(n):
+        k, i = get(data, i)
+        v[k], i = get(data, i)
+    return v, i
+
+
+def _get_syms(data, i):
+    n, i = _get_varint(data, i)
+    return list(_lookup(_symbol_of, data[i:i + n])) if n else [], i + n
+
+
+def _get_bytes(data, i):
+    n, i = _get_varint(data, i)
+    return list(data[i:i + n]), i + n
+
+
+def _get_table(data, i):
+    n, i = _get_varint(data, i)
+    width, i = _get_varint(data, i)
+    # Keys that are symbols, as the keys of the messages are, are looked up at once
+    head = data[i:i + width]
+    if width and min(head) >= _SYMBOL:
+        keys = _lookup(_symbol_of, head)
+        i += width
+    else:
+        keys = []
+        for _ in range(width):
+            k, i = get(data, i)
+            keys.append(k)
+    # The rows are built from the columns, packed columns are zipped without making lists of them
+    columns = []
+    for _ in range(width):
+        tag = data[i]
+        if 0 < n < 0x80 and data[i + 1] == n and tag in _packed_tags:
+            i += 2
+            column = data[i:i + n]
+            if tag == _BYTES:
+                columns.append(column)
+            elif tag == _SYMS:
+                columns.append(_lookup(_symbol_of, column))
+            elif column == bytes(n):
+                columns.append((None,) * n)
+            else:
+                column, i = _get_list(data, i - 1)
+                columns.append(column)
+                continue
+            i += n
+        else:
+            column, i = get(data, i)
+            columns.append(column)
+    if len(set(keys)) == width <= _MAX_ROW_WIDTH:
+        return _row_builder(width)(zip(*columns), *keys), i
+    return list(map(dict, map(zip, itertools.repeat(keys, n), zip(*columns)))), i
+
+
+# Rows of at most this many keys are built by a function generated for their width, a dict display of the keys
+#   is cheaper than dict(zip()). The keys are arguments of the function, only the width is in its code
+_MAX_ROW_WIDTH = 16
+_row_builders = {}
+
+
+def _row_builder(width):
+    builder = _row_builders.get(width)
+    if builder is None:
+        keys = ', '.join(f'k{x}' for x in range(width))
+        values = ''.join(f'v{x}, ' for x in range(width))
+        items = ', '.join(f'k{x}: v{x}' for x in range(width))
+        namespace = {}
+        exec(f'def rows(cells, {keys}):\n    return [{{{items}}} for {values}in cells]', namespace)
+        builder = _row_builders[width] = namespace['rows']
+    return builder
+
+
+def _get_rows(data, i):
+    n, i = _get_varint(data, i)
+    width, i = _get_varint(data, i)
+    # Grids of symbols: columns of n < 0x80 symbols take n + 2 bytes each, and are kept once decoded
+    step = n + 2
+    end = i + width * step
+    if 0 < n < 0x80 and data[i:end:step] == _syms_tag * width and data[i + 1:end:step] == bytes((n,)) * width:
+        symbols = _column_symbols
+        columns = []
+        for x in range(i + 2, end, step):
+            codes = data[x:x + n]
+            column = symbols.get(codes)
+            if column is None:
+                if len(symbols) >= _MAX_COLUMNS:
+                    symbols.clear()
+                column = symbols[codes] = _lookup(_symbol_of, codes)
+            columns.append(column)
+        return list(map(list, zip(*columns))), end
+    columns = []
+    for _ in range(width):
+        column, i = get(data, i)
+        columns.append(column)
+    return list(map(list, zip(*columns))), i
+
+
+def _get_str(data, i):
+    n, i = _get_varint(data, i)
+    return data[i:i + n].decode(), i + n
+
+
+def _get_uint(data, i):
+    return _get_varint(data, i)
+
+
+def _get_nint(data, i):
+    v, i = _get_varint(data, i)
+    return -v - 1, i
+
+
+def _get_unknown(data, i):
+    raise ValueError(f'unknown value tag {data[i - 1]} at {i - 1}')
+
+
+_syms_tag = bytes((_SYMS,))
+# Tags of the table columns read by _get_table itself: one byte per value, or lists of nulls
+_packed_tags = {_BYTES, _SYMS, _LIST}
+
+# tag -> reader, for the tags below _FIXINT
+_readers = [_get_unknown] * _FIXINT
+_readers[_NULL] = lambda data, i: (None, i)
+_readers[_FALSE] = lambda data, i: (False, i)
+_readers[_TRUE] = lambda data, i: (True, i)
+_readers[_UINT] = _get_uint
+_readers[_NINT] = _get_nint
+_readers[_FLOAT] = lambda data, i: (_float.unpack_from(data, i)[0], i + 8)
+_readers[_STR] = _get_str
+_readers[_GUID] = lambda data, i: (data[i:i + 16].hex(), i + 16)
+_readers[_LIST] = _get_list
+_readers[_DICT] = _get_dict
+_readers[_SYMS] = _get_syms
+_readers[_TABLE] = _get_table
+_readers[_ROWS] = _get_rows
+_readers[_BYTES] = _get_bytes
+
+
+# ======== Messages ========
+
+# code -> Schema, and route -> Schema
+_schemas = [None] * 0x100
+_by_route = {}
+# code -> encoders and decoders of the message objects and of their parsed json dicts, generated by register
+_encoders = [None] * 0x100
+_decoders = [None] * 0x100
+_dict_encoders = [None] * 0x100
+_dict_decoders = [None] * 0x100
+
+
+def register(schema, code: int):
+    """ Gives a message class its binary code, codes are part of the format """
+    if _schemas[code] is not None:
+        raise ValueError(f'{schema.cls.__name__} and {_schemas[code].cls.__name__} share the binary code {code}')
+    schema.code = code
+    _schemas[code] = schema
+    _by_route[schema.cls.route] = schema
+    _encoders[code], _decoders[code], _dict_encoders[code], _dict_decoders[code] = _compile(schema)
+
+
+def _compile(schema):
+    """ Generates the encoders and decoders of a message class, as codec.Schema does for json: the fields are
+        read and written one after the other, by name, and only the values go through put and get """
+    namespace = {'_cls': schema.cls, '_new': object.__new__, '_head': bytes((VERSION, schema.code)),
+                 '_writer': _writers.get, '_put_default': _put_default, '_put': put, '_get': get,
+                 '_known': schema.known_keys}
+    flags = ' | '.join(f'(e{bit} is not None) << {bit}' for bit in range(len(schema.envelope))) or '0'
+    envelope = [f'    out.append({flags})']
+    envelope += [f'    if e{bit} is not None: _put(out, e{bit})' for bit in range(len(schema.envelope))]
+
+    # Encoders: the envelope flags, the set envelope values, the fields, and the extra keys (null for objects)
+    lines = ['    out = bytearray(_head)']
+    lines += [f'    e{bit} = msg.{f}' for bit, f in enumerate(schema.envelope)]
+    lines += envelope
+    for f in schema.fields:
+        lines += [f'    v = msg.{f}', '    _writer(type(v), _put_default)(out, v)']
+    lines += [f'    out.append({_NULL})', '    return bytes(out)']
+    exec('def encode(msg):\n' + '\n'.join(lines), namespace)
+
+    lines = ['    out = bytearray(_head)']
+    lines += [f'    e{bit} = j.get({k!r})' for bit, k in enumerate(schema.envelope_keys)]
+    lines += envelope
+    for k in schema.keys:
+        lines += [f'    v = j.get({k!r})', '    _writer(type(v), _put_default)(out, v)']
+    lines += ['    if _known.issuperset(j):',
+              f'        out.append({_NULL})',
+              '    else:',
+              '        _put(out, {k: v for k, v in j.items() if k not in _known})',
+              '    return bytes(out)']
+    exec('def encode_dict(j):\n' + '\n'.join(lines), namespace)
+
+    # Decoders, the extra keys are only read into dicts
+    lines = ['    msg = _new(_cls)', '    flags = data[2]', '    i = 3']
+    for bit, f in enumerate(schema.envelope):
+        lines += [f'    if flags & {1 << bit}:', f'        msg.{f}, i = _get(data, i)',
+                  '    else:', f'        msg.{f} = None']
+    lines += [f'    msg.{f}, i = _get(data, i)' for f in schema.fields]
+    lines.append('    return msg')
+    exec('def decode(data):\n' + '\n'.join(lines), namespace)
+
+    lines = [f'    j = {{"action": {schema.cls.action!r}}}', '    flags = data[2]', '    i = 3']
+    for bit, k in enumerate(schema.envelope_keys):
+        lines += [f'    if flags & {1 << bit}:', '        v, i = _get(data, i)',
+                  f'        if v is not None: j[{k!r}] = v']
+    lines += [f'    j[{k!r}], i = _get(data, i)' for k in schema.keys]
+    lines += ['    extras, i = _get(data, i)', '    if extras: j.update(extras)', '    return j']
+    exec('def decode_dict(data):\n' + '\n'.join(lines), namespace)
+
+    return namespace['encode'], namespace['decode'], namespace['encode_dict'], namespace['decode_dict']
+
+
+def encode(msg):
+    """ Encodes a message object, not stuffed """
+    return _encoders[msg._schema.code](msg)
+
+
+def encode_dict(j: dict):
+    """ Encodes a parsed json message, keys that are not part of the message schema are kept as extras """
+    return _dict_encoders[_by_route[c.route_of(j)].code](j)
+
+
+def _schema_of(data):
+    if data[0] != VERSION:
+        raise ValueError(f'unknown binary format version {data[0]}')
+    schema = _schemas[data[1]]
+    if schema is None:
+        raise ValueError(f'unknown message code {data[1]}')
+    return schema
+
+
+def _read(data, count):
+    """ Decodes the envelope and the first count fields """
+    schema = _schema_of(data)
+    flags = data[2]
+    i = 3
+    envelope = []
+    for bit in range(len(schema.envelope)):
+        if flags & (1 << bit):
+            v, i = get(data, i)
+        else:
+            v = None
+        envelope.append(v)
+    values = []
+    for _ in range(count):
+        v, i = get(data, i)
+        values.append(v)
+    return schema, envelope, values
+
+
+def decode(data: bytes):
+    """ Decodes an unstuffed frame into a message object """
+    return _decoders[_schema_of(data).code](data)
+
+
+def decode_dict(data: bytes):
+    """ Decodes an unstuffed frame into the dict json.loads would give for the same message """
+    return _dict_decoders[_schema_of(data).code](data)
+
+
+# (message code, keys) -> number of leading fields holding the keys
+_head_counts = {}
+
+
+def decode_head(data: bytes, keys: frozenset):
+    """ Decodes the envelope and the leading fields up to the last of the given keys the message has,
+        the fields after it are in the dict with None values (they are there, but not decoded) """
+    schema = _schema_of(data)
+    count = _head_counts.get((schema.code, keys))
+    if count is None:
+        count = max((n + 1 for n, k in enumerate(schema.keys) if k in keys), default=0)
+        _head_counts[schema.code, keys] = count
+    _schema, envelope, values = _read(data, count)
+    j = {'action': schema.cls.action}
+    for k, v in zip(schema.envelope_keys, envelope):
+        if v is not None:
+            j[k] = v
+    j.update(zip(schema.keys, values))
+    j.update(dict.fromkeys(schema.keys[count:]))
+    return j
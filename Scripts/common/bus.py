@@ -0,0 +1,34 @@
+# Per-game event bus, every GM owns one.
+# Topics are plain strings, publishing calls the subscribed callables directly in subscription order.
+# Unlike pypubsub there is no global registry (games in the same process never see each other's messages),
+#   no listener signature checks and callbacks are held by strong references.
+
+
+class EventBus:
+    """ Fans out published arguments to the callables subscribed to a topic """
+
+    def __init__(self):
+        # topic -> tuple of callbacks, replaced (never mutated) on subscribe so publishing needs no copy
+        self.listeners = {}
+
+    def subscribe(self, topic, callback):
+        callbacks = self.listeners.get(topic, ())
+        if callback not in callbacks:
+            self.listeners[topic] = callbacks + (callback,)
+
+    def unsubscribe(self, topic, callback):
+        callbacks = tuple(c for c in self.listeners.get(topic, ()) if c != callback)
+        if callbacks:
+            self.listeners[topic] = callbacks
+        else:
+            self.listeners.pop(topic, None)
+
+    def has_listeners(self, topic):
+        return topic in self.listeners
+
+    def publish(self, topic, *args):
+        callbacks = self.listeners.get(topic)
+        if callbacks is None:
+            return
+        for callback in callbacks:
+            callback(*args)
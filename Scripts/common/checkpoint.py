@@ -0,0 +1,231 @@
+import os
+import re
+import threading
+import zlib
+
+import common.binary as b
+import common.piece as pc
+import common.square as sqr
+
+# Checkpoints of a running game, to resume it in a new gm process (gm_server.py --resume) if the old one dies.
+# A checkpoint holds what the gm can't rebuild from its seed: the cells of the board, the players, the state of
+#   the random generator and the knowledge exchange registers of GmExternal. The board is rebuilt from the seed
+#   (same square ids) and only the cells that differ from the checkpoint are changed.
+# Only a copy of the state is taken on the gm's thread (snapshot): the arrays of a CompactBoard are copied whole,
+#   the squares of a Board (small boards only) are packed right away. The writer thread packs the cells (one byte
+#   each), encodes the rest with the value encoding of common/binary.py, compresses it and writes it: to a temporary
+#   file which then replaces the checkpoint, so a crash while writing leaves the previous checkpoint whole.
+# The packed cells follow the encoded state as they are, its "cells" holds their number. A restore only changes the
+#   cells that differ from the board rebuilt from the seed, found by comparing the packed cells of both.
+# The state of a game moved to another gm while it runs (GmExternal.freeze) is a checkpoint with the actions that
+#   were waiting for their delay and the time left until the next new piece, the adopting gm continues them.
+
+MAGIC = b'GMCK'
+VERSION = 2
+
+# Cell byte: square type in the low 3 bits, then the piece (none, piece, sham) and the discovered flag
+_PIECE = 1 << 3
+_SHAM = 2 << 3
+_DISCOVERED = 1 << 5
+
+_type_of_code = {t.value: t for t in sqr.SquareType}
+
+# Discovered flag of a cell from the discovered array of a CompactBoard (0 or 1)
+_discovered_flag = bytes([0, _DISCOVERED]) + bytes(254)
+
+_changed = re.compile(b'[^\x00]')
+
+
+def _cell(square):
+    code = square.type.value
+    piece = square.piece
+    if piece is not None:
+        code |= _SHAM if piece.is_sham else _PIECE
+    if square.discovered:
+        code |= _DISCOVERED
+    return code
+
+
+def _piece_code(piece):
+    if piece is None:
+        return 0
+    return 2 if piece.is_sham else 1
+
+
+# Copy of the cells of a board, packed by _pack_cells: (types, discovered, {index: is sham}) of a CompactBoard,
+#   the packed cells of a Board
+def _copy_cells(board):
+    types = getattr(board, 'types', None)
+    if types is not None:
+        return bytes(types), bytes(board.discovered), {i: p.is_sham for i, p in board.pieces.items()}
+    return bytes(_cell(square) for square in board.content)
+
+
+def _pack_cells(cells):
+    if type(cells) is bytes:
+        return cells
+    types, discovered, pieces = cells
+    # Types and flags share no bits, or'ed as big integers rather than cell by cell
+    packed = int.from_bytes(types, 'little') | int.from_bytes(discovered.translate(_discovered_flag), 'little')
+    packed = bytearray(packed.to_bytes(len(types), 'little'))
+    for i, is_sham in pieces.items():
+        packed[i] |= _SHAM if is_sham else _PIECE
+    return bytes(packed)
+
+
+# pending: [[seconds left, message json], ...] of the actions waiting for their delay, piece_in: seconds left until
+#   the next new piece (None if the pieces are not started), only given for a frozen game
+def snapshot(external, game_id=None, time=None, pending=None, piece_in=None):
+    """ Returns a copy of the state of a GmExternal's game, to be called on the gm's thread and packed by pack """
+    gm = external.gm
+    version, rng_state, gauss = gm.rng.getstate()
+    settings = {k: v for k, v in vars(gm.settings).items() if k != 'file_path'}
+    state = {
+        'game': game_id,
+        'time': time,
+        'seed': gm.seed,
+        'settings': settings,
+        'over': gm.game_over,
+        'rng': [version, list(rng_state), gauss],
+        # In joining order, the order of the teams
+        'players': [[p.id, p.team, p.x, p.y, p.is_leader, _piece_code(p.piece)] for p in gm.players.values()],
+        'exchanges': [dict(r) for r in external.exchange_storage],
+        'disabled': list(external.disabled_exchanges),
+        'cells': _copy_cells(gm.board),
+    }
+    if pending is not None:
+        state['pending'] = pending
+        state['piece_in'] = piece_in
+    return state
+
+
+def pack(state):
+    """ Returns the checkpoint of a snapshot """
+    state = dict(state)
+    cells = _pack_cells(state['cells'])
+    state['cells'] = len(cells)
+    out = bytearray()
+    b.put(out, state)
+    out += cells
+    return MAGIC + bytes((VERSION,)) + zlib.compress(bytes(out))
+
+
+def capture(external, game_id=None, time=None, pending=None, piece_in=None):
+    """ Returns the checkpoint of a GmExternal's game, to be called on the gm's thread """
+    return pack(snapshot(external, game_id, time, pending, piece_in))
+
+
+def load(path):
+    """ Reads a checkpoint, returns its state """
+    with open(path, 'rb') as checkpoint_file:
+        data = checkpoint_file.read()
+    try:
+        return loads(data)
+    except ValueError as e:
+        raise ValueError(f'{path}: {e}')
+
+
+def loads(data: bytes):
+    """ Returns the state of a checkpoint given as returned by capture """
+    if data[:len(MAGIC) + 1] != MAGIC + bytes((VERSION,)):
+        raise ValueError(f'not a version {VERSION} checkpoint')
+    try:
+        data = zlib.decompress(data[len(MAGIC) + 1:])
+    except zlib.error as e:
+        raise ValueError(f'corrupt checkpoint: {e}')
+    state, i = b.get(data, 0)
+    state['cells'] = data[i:i + state['cells']]
+    return state
+
+
+def restore(external, state):
+    """ Brings a GmExternal created with the seed and settings of a checkpoint to its state """
+    gm = external.gm
+    board = gm.board
+
+    cells = state['cells']
+    current = _pack_cells(_copy_cells(board))
+    changed = (int.from_bytes(current, 'little') ^ int.from_bytes(cells, 'little')).to_bytes(len(cells), 'little')
+    width = board.board_width
+    for match in _changed.finditer(changed):
+        i = match.start()
+        code = cells[i]
+        square = board.get_square(i % width, i // width)
+        square.type = _type_of_code[code & 0x07]
+        piece = code & (_PIECE | _SHAM)
+        square.piece = None if not piece else pc.Piece(is_sham=piece == _SHAM)
+        square.discovered = bool(code & _DISCOVERED)
+
+    for id, team, x, y, is_leader, piece in state['players']:
+        player = gm.add_player(id, team, x, y)
+        player.is_leader = is_leader
+        if piece:
+            player.piece = pc.Piece(is_sham=piece == 2)
+            board.mark_dirty(x, y)
+
+    version, rng_state, gauss = state['rng']
+    gm.rng.setstate((version, tuple(rng_state), gauss))
+    gm.game_over = state['over']
+    external.exchange_storage = state['exchanges']
+    external.disabled_exchanges = state['disabled']
+
+
+class Writer:
+    """ Writes checkpoints of one game on its own thread, only the latest one is kept if it falls behind """
+
+    def __init__(self, path):
+        self.path = path
+        self.condition = threading.Condition()
+        # Snapshot waiting to be written
+        self.pending = None
+        self.closed = False
+        # Remove the checkpoint once closed, for games that are over
+        self.remove = False
+        self.written = 0
+        self.thread = threading.Thread(target=self._run, daemon=True, name='checkpoint writer')
+        self.thread.start()
+
+    # state: as returned by snapshot, packed by the writer's thread
+    def submit(self, state):
+        with self.condition:
+            self.pending = state
+            self.condition.notify()
+
+    # Stops the writer once the pending checkpoint is written, or removes the checkpoint
+    def close(self, remove=False):
+        with self.condition:
+            self.closed = True
+            self.remove = remove
+            if remove:
+                self.pending = None
+            self.condition.notify()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while self.pending is None and not self.closed:
+                    self.condition.wait()
+                data, self.pending = self.pending, None
+                closed = self.closed
+
+            if data is not None:
+                try:
+                    self._write(pack(data))
+                    self.written += 1
+                except OSError as e:
+                    print(f'> checkpoint: Failed to write \"{self.path}\": {e}')
+            if closed:
+                if self.remove:
+                    try:
+                        os.remove(self.path)
+                    except OSError:
+                        pass
+                return
+
+    def _write(self, data):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as checkpoint_file:
+            checkpoint_file.write(data)
+            checkpoint_file.flush()
+            os.fsync(checkpoint_file.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,85 @@
+import heapq
+import itertools
+
+# Clocks used by GmExternal to schedule gm actions.
+# LoopClock runs them in real time on an asyncio event loop, VirtualClock runs them in simulated time:
+#   instead of waiting it jumps straight to the next scheduled action, keeping their order.
+
+
+class LoopClock:
+    """ Real time clock on top of an asyncio event loop """
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def time(self):
+        return self.loop.time()
+
+    # Safe to call from other threads
+    def call_soon(self, callback, *args):
+        return self.loop.call_soon_threadsafe(callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        return self.loop.call_later(delay, callback, *args)
+
+    def stop(self):
+        self.loop.stop()
+
+
+class VirtualHandle:
+    """ Callback scheduled on a VirtualClock, ordered by time and then by scheduling order """
+
+    def __init__(self, when, seq, callback, args):
+        self.when = when
+        self.seq = seq
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+    def __lt__(self, other):
+        return (self.when, self.seq) < (other.when, other.seq)
+
+
+class VirtualClock:
+    """ Discrete event clock, time only moves forward when run() reaches the next callback """
+
+    def __init__(self):
+        self.now = 0.0
+        self._queue = []
+        self._seq = itertools.count()
+        self._stopped = False
+
+    def time(self):
+        return self.now
+
+    def call_soon(self, callback, *args):
+        return self.call_later(0, callback, *args)
+
+    def call_later(self, delay, callback, *args):
+        handle = VirtualHandle(self.now + delay, next(self._seq), callback, args)
+        heapq.heappush(self._queue, handle)
+        return handle
+
+    def pending(self):
+        return sum(1 for h in self._queue if not h.cancelled)
+
+    # Runs callbacks in order until stop() is called, nothing is left, or the time would pass until
+    def run(self, until=None):
+        self._stopped = False
+        queue = self._queue
+        while queue and not self._stopped:
+            handle = queue[0]
+            if until is not None and handle.when > until:
+                self.now = until
+                return
+            heapq.heappop(queue)
+            if handle.cancelled:
+                continue
+            self.now = handle.when
+            handle.callback(*handle.args)
+
+    def stop(self):
+        self._stopped = True
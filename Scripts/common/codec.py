@@ -0,0 +1,126 @@
+import json
+import uuid
+
+# Json codec of the message classes, built once per class from its schema.
+# A message class declares its fields with __slots__, in wire order, the wire name of a field is its
+#   attribute name unless renamed (id -> userGuid, ...). The output is the same as json.dumps of the old
+#   __dict__ based messages, byte for byte: the action first, then the fields, ", " and ": " separators,
+#   uuids as their hex string. Envelope fields (game id, ...) come right after the action, and only when set.
+
+
+def _default(obj):
+    if isinstance(obj, uuid.UUID):
+        return obj.hex
+    return obj.__dict__
+
+
+_quote = json.encoder.encode_basestring_ascii
+
+# Encoder of nested values (lists, dicts), created once instead of on every json.dumps call
+if json.encoder.c_make_encoder is not None:
+    _c_encoder = json.encoder.c_make_encoder(None, _default, _quote, None, ': ', ', ', False, False, True)
+
+    def _dumps(v):
+        return ''.join(_c_encoder(v, 0))
+else:
+    _dumps = json.JSONEncoder(default=_default).encode
+
+
+# Json of a single field value, the common types are written directly
+def _value(v):
+    t = type(v)
+    if t is str:
+        return _quote(v)
+    if v is None:
+        return 'null'
+    if t is uuid.UUID:
+        return '"' + v.hex + '"'
+    if t is int:
+        return int.__repr__(v)
+    return _dumps(v)
+
+
+def _key(name):
+    return _quote(name) + ': '
+
+
+# Variant of a parsed json message, for the actions shared by several messages that are not just
+#   a request and its response (told apart by the result field)
+VARIANT_RULES = {
+    'start':    lambda j: 'game' if 'teamGuids' in j else ('confirm' if 'result' in j else 'setup'),
+    'exchange': lambda j: 'authorize' if 'receiverGuid' in j else ('reject' if 'rejectDuration' in j else 'accept'),
+    'gui':      lambda j: 'delta' if 'cells' in j else 'keyframe',
+}
+
+
+def route_of(parsed_json: dict):
+    """ Returns the route of a parsed json message """
+    action = parsed_json.get('action')
+    rule = VARIANT_RULES.get(action)
+    if rule is not None:
+        return action, rule(parsed_json)
+    return action, 'response' if 'result' in parsed_json else 'request'
+
+
+class Schema:
+    """ Encoder and decoder of one message class, generated from its fields """
+
+    __slots__ = ('cls', 'encode', 'decode', 'envelope', 'fields', 'envelope_keys', 'keys', 'known_keys', 'code')
+
+    def __init__(self, cls, envelope: tuple, fields: tuple, wire_names: dict, defaults: dict):
+        self.cls = cls
+        # Attribute names and their wire names, used by the other formats (see common/binary.py)
+        self.envelope = envelope
+        self.fields = fields
+        self.envelope_keys = tuple(wire_names.get(f, f) for f in envelope)
+        self.keys = tuple(wire_names.get(f, f) for f in fields)
+        self.known_keys = frozenset(('action',) + self.envelope_keys + self.keys)
+        # Binary message code, given when registered with the binary format
+        self.code = None
+        namespace = {'_cls': cls, '_new': object.__new__, '_value': _value, '_defaults': defaults}
+
+        # Encoder: the keys are constants, only the values are converted, envelope fields are skipped when not set
+        if cls.action is None:
+            # Only the base class, which has no fields of its own
+            lines = ['    items = []']
+            for f in envelope:
+                lines.append(f'    if msg.{f} is not None: items.append({_key(wire_names.get(f, f))!r} + _value(msg.{f}))')
+            lines.append("    return '{' + ', '.join(items) + '}'")
+        else:
+            lines = []
+            head = '{' + _key('action') + _quote(cls.action)
+            for f in envelope:
+                lines.append(f'    {f} = msg.{f}')
+                lines.append(f"    {f} = '' if {f} is None else {', ' + _key(wire_names.get(f, f))!r} + _value({f})")
+            parts = [repr(head)] + list(envelope)
+            for f in fields:
+                parts += [repr(', ' + _key(wire_names.get(f, f))), f'_value(msg.{f})']
+            parts.append("'}'")
+            lines.append('    return ' + ' + '.join(parts))
+        exec('def encode(msg):\n' + '\n'.join(lines), namespace)
+
+        # Decoder: builds the message without calling __init__, fields with a default may be missing from the json
+        lines = ['    msg = _new(_cls)']
+        for f in fields:
+            name = wire_names.get(f, f)
+            if f in defaults:
+                lines.append(f'    msg.{f} = j.get({name!r}, _defaults[{f!r}])')
+            else:
+                lines.append(f'    msg.{f} = j[{name!r}]')
+        for f in envelope:
+            lines.append(f'    msg.{f} = j.get({wire_names.get(f, f)!r})')
+        lines.append('    return msg')
+        exec('def decode(j):\n' + '\n'.join(lines), namespace)
+
+        self.encode = namespace['encode']
+        # Raises KeyError if a required field is missing
+        self.decode = namespace['decode']
+
+
+def fields_of(cls):
+    """ Returns the slots of a class and its bases, base class slots first """
+    fields = []
+    for klass in reversed(cls.__mro__):
+        slots = klass.__dict__.get('__slots__', ())
+        fields.extend((slots,) if isinstance(slots, str) else slots)
+    return tuple(fields)
@@ -0,0 +1,242 @@
+import struct
+
+# Framing of the byte stream of a connection, shared by the server and all clients.
+# Frames are either terminated by the \x17 delimiter (the default, binary frames are byte stuffed so they
+#   never contain it), or prefixed with their length (4 bytes, big endian), which needs no stuffing or scan.
+# Clients pick the framing of their connection (--length-prefixed), the server tells which from the first byte
+#   it receives (is_length_prefixed) and answers in the same framing.
+# Received bytes are appended to one growable buffer and frames are cut out of it through a memoryview, so
+#   each frame is copied once. A read only scans the bytes it added and the consumed part of the buffer is
+#   dropped once it is most of it, so a frame arriving in many reads is not copied or rescanned on every read.
+# Frames sent in a burst (a game start to every player, the game over fan-out) are batched by FrameWriter into
+#   a single transport write per reactor iteration, instead of one write and TCP segment per frame.
+
+DELIMITER = b'\x17'
+
+# Default limit on the size of a frame, a peer sending a larger one is disconnected
+MAX_LENGTH = 1 << 20
+
+_length = struct.Struct('>I')
+
+# Consumed bytes kept at the start of the buffer before it is compacted
+_COMPACT_AFTER = 1 << 16
+
+
+def encode(payload: bytes, length_prefixed=False):
+    """ Returns the bytes to write for one frame """
+    if length_prefixed:
+        return _length.pack(len(payload)) + payload
+    return payload + DELIMITER
+
+
+def is_length_prefixed(data):
+    """ Whether the first bytes received on a connection start a length prefixed frame. The prefix of a frame
+        shorter than 16 MB starts with a zero byte, delimited frames (json, binary or a gui handshake) never do """
+    return len(data) > 0 and data[0] == 0
+
+
+class FrameDecoder:
+    """ Cuts the bytes received on a connection into frames, however the stream is split into reads """
+
+    def __init__(self, max_length=MAX_LENGTH, length_prefixed=False):
+        self.max_length = max_length
+        self.length_prefixed = length_prefixed
+        self.buffer = bytearray()
+        # Start of the first frame not returned yet
+        self.start = 0
+        # Where the next delimiter scan starts, the bytes before it have no delimiter
+        self.scanned = 0
+
+    def feed(self, data) -> list:
+        """ Adds received bytes, returns the frames they complete, without delimiter or length prefix.
+            Empty frames are skipped. Raises ValueError if a frame is longer than max_length """
+        buffer = self.buffer
+        buffer += data
+        frames = []
+        view = memoryview(buffer)
+        try:
+            if self.length_prefixed:
+                self._cut_prefixed(view, frames)
+            else:
+                self._cut_delimited(view, frames)
+        finally:
+            # The buffer can't be resized while a view of it exists
+            view.release()
+
+        if self.start == len(buffer):
+            buffer.clear()
+            self.start = self.scanned = 0
+        elif self.start > _COMPACT_AFTER and self.start * 2 > len(buffer):
+            del buffer[:self.start]
+            self.scanned -= self.start
+            self.start = 0
+        return frames
+
+    def pending(self):
+        """ Number of received bytes not returned in a frame yet """
+        return len(self.buffer) - self.start
+
+    def _cut_delimited(self, view, frames):
+        buffer = self.buffer
+        start = self.start
+        end = buffer.find(DELIMITER, self.scanned)
+        while end >= 0:
+            if end - start > self.max_length:
+                raise ValueError(f'frame of {end - start} bytes, the limit is {self.max_length}')
+            if end > start:
+                frames.append(bytes(view[start:end]))
+            start = end + 1
+            end = buffer.find(DELIMITER, start)
+        self.start = start
+        self.scanned = len(buffer)
+        if len(buffer) - start > self.max_length:
+            raise ValueError(f'unterminated frame of over {self.max_length} bytes')
+
+    def _cut_prefixed(self, view, frames):
+        buffer = self.buffer
+        start = self.start
+        while len(buffer) - start >= _length.size:
+            length, = _length.unpack_from(buffer, start)
+            if length > self.max_length:
+                raise ValueError(f'frame of {length} bytes, the limit is {self.max_length}')
+            end = start + _length.size + length
+            if end > len(buffer):
+                break
+            if length > 0:
+                frames.append(bytes(view[start + _length.size:end]))
+            start = end
+        self.start = start
+
+
+class WriteStats:
+    """ Counts the frames written and the transport writes they took """
+
+    def __init__(self):
+        self.frames = 0
+        self.writes = 0
+        self.bytes = 0
+
+    def saved(self):
+        """ Writes (syscalls, in the common case) saved by batching """
+        return self.frames - self.writes
+
+    def __str__(self):
+        return f'{self.frames} frames in {self.writes} writes ({self.saved()} saved), {self.bytes} bytes'
+
+
+class FrameWriter:
+    """ Send queue of a connection. Frames are batched into one write per reactor iteration, or as soon as
+        max_pending bytes are waiting. The writer is the producer of its transport: while the transport's
+        buffer is full the frames wait here, and the owner is told when the queue goes over its high
+        watermark (on_high), when it is back under its low one (on_low) and when the transport takes
+        frames again (on_resume) """
+
+    def __init__(self, transport, call_later, max_pending=1 << 16, stats=None,
+                 high_watermark=1 << 20, low_watermark=1 << 18, length_prefixed=False):
+        self.transport = transport
+        # Whether frames are prefixed with their length instead of followed by the delimiter, may be set until
+        #   the first write
+        self.length_prefixed = length_prefixed
+        # call_later(delay, callback), the reactor's
+        self.call_later = call_later
+        self.max_pending = max_pending
+        self.stats = stats if stats is not None else WriteStats()
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        # Called without arguments, set by the owner
+        self.on_high = None
+        self.on_low = None
+        self.on_resume = None
+
+        # Frames and their delimiters (or length prefixes and frames), not handed to the transport yet
+        self.pending = []
+        self.pending_bytes = 0
+        self.flush_call = None
+        # Deepest the queue has been, in bytes
+        self.max_depth = 0
+        # Whether the transport paused us, its buffer is full
+        self.paused = False
+        # Whether the queue went over the high watermark and is not back under the low one yet
+        self.congested = False
+        transport.registerProducer(self, True)
+
+    def depth(self):
+        """ Bytes waiting in the queue """
+        return self.pending_bytes
+
+    def write(self, payload: bytes):
+        if self.length_prefixed:
+            self.pending.append(_length.pack(len(payload)))
+            self.pending.append(payload)
+            self.pending_bytes += _length.size + len(payload)
+        else:
+            self.pending.append(payload)
+            self.pending.append(DELIMITER)
+            self.pending_bytes += len(payload) + 1
+        if self.pending_bytes > self.max_depth:
+            self.max_depth = self.pending_bytes
+        if self.paused:
+            if not self.congested and self.pending_bytes > self.high_watermark:
+                self.congested = True
+                if self.on_high is not None:
+                    self.on_high()
+        elif self.pending_bytes >= self.max_pending:
+            self.flush()
+        elif self.flush_call is None:
+            self.flush_call = self.call_later(0, self.flush)
+
+    def flush(self):
+        """ Hands the queued frames to the transport, at most max_pending bytes per write, until it pauses us """
+        self._cancel_flush()
+        pending = self.pending
+        start = 0
+        while start < len(pending) and not self.paused:
+            end = start
+            size = 0
+            while end < len(pending):
+                frame_size = len(pending[end]) + len(pending[end + 1])
+                if size > 0 and size + frame_size > self.max_pending:
+                    break
+                size += frame_size
+                end += 2
+            self.stats.frames += (end - start) // 2
+            self.stats.writes += 1
+            self.stats.bytes += size
+            self.pending_bytes -= size
+            # May pause us right away, when this fills the transport's buffer
+            self.transport.writeSequence(pending[start:end])
+            start = end
+        del pending[:start]
+        self._check_low()
+
+    def discard(self):
+        """ Drops the frames not written yet, for connections that are gone """
+        self._cancel_flush()
+        self.pending = []
+        self.pending_bytes = 0
+
+    # ======== Push producer, called by the transport ========
+
+    def pauseProducing(self):
+        self.paused = True
+
+    def resumeProducing(self):
+        self.paused = False
+        self.flush()
+        if self.on_resume is not None:
+            self.on_resume()
+
+    def stopProducing(self):
+        self.discard()
+
+    def _check_low(self):
+        if self.congested and not self.paused and self.pending_bytes <= self.low_watermark:
+            self.congested = False
+            if self.on_low is not None:
+                self.on_low()
+
+    def _cancel_flush(self):
+        if self.flush_call is not None:
+            if self.flush_call.active():
+                self.flush_call.cancel()
+            self.flush_call = None
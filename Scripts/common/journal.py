@@ -0,0 +1,57 @@
+import json
+import threading
+
+# Append-only journal of what a game received, enough to play it again (see replay.py): with the seed of the gm
+#   and the same messages at the same times a game plays out the same.
+# One json object per line, a header {"seed", "settings"} followed by the events in the order they happened:
+#   {"t": time, "msg": message}  a message sent to the gm, timed when it arrived (before its action delay)
+#   {"t": time, "piece": true}   a new piece added by the gm's timer
+#   {"t": time, "end": result, "sent": count}  the game is over, with the number of messages the gm sent
+# Times are the ones of the gm's clock, virtual or real.
+
+
+class Journal:
+    """ Writes the journal of one game, events may be recorded from several threads """
+
+    def __init__(self, path, seed, settings):
+        self.path = path
+        self.file = open(path, 'w')
+        self.lock = threading.Lock()
+        # Messages sent by the gm
+        self.sent_count = 0
+
+        header = {'seed': seed, 'settings': {k: v for k, v in vars(settings).items() if k != 'file_path'}}
+        self._write(json.dumps(header))
+
+    def message(self, t, msg):
+        # Message json is written as is, not parsed and dumped again
+        self._write(f'{{"t": {t!r}, "msg": {msg.to_json()}}}')
+
+    def piece(self, t):
+        self._write(f'{{"t": {t!r}, "piece": true}}')
+
+    # Subscribed to the messages the gm sends
+    def sent(self, msg):
+        self.sent_count += 1
+
+    def end(self, t, result):
+        self._write(json.dumps({'t': t, 'end': result, 'sent': self.sent_count}))
+        self.close()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+    def _write(self, line):
+        with self.lock:
+            if not self.file.closed:
+                self.file.write(line + '\n')
+
+
+def read(path):
+    """ Returns the header and the events of a journal, messages are left as json objects """
+    with open(path) as journal_file:
+        header = json.loads(journal_file.readline())
+        events = [json.loads(line) for line in journal_file if line.strip()]
+    return header, events
@@ -1,30 +1,56 @@
 import time
-import datetime
 import csv
 import os.path as path
 import os
+import queue
+import threading
 
 # Logs game messages from the gm (as descrived in the documentation)
+# Rows are streamed to the log file while the game runs, by one writer thread shared by all the games of the
+#   process, so a long game doesn't keep its log in memory and a crash only loses the last rows.
+# Rows wait for the writer in a bounded queue, when it is full (the disk can't keep up) rows are dropped
+#   and counted instead of growing the memory or blocking the game.
+# A log file over max_bytes is continued in a new file, <game id>_<start time>.<part>.csv, with the same columns.
+
+# Rows waiting for the writer thread, of all games
+MAX_QUEUED = 1 << 14
+
+# Rows written between flushes of a log file, at most
+BATCH = 512
+
 
 class Logger:
     log_dir = 'logs'
     columns = ['Type', 'Timestamp', 'Game ID', 'Player GUID', 'Colour', 'Role']
 
-    def __init__(self, game_id):
-        self.game_id = game_id
+    # Second and its formatted timestamp, formatting is only done once per second
+    _ts_cache = (None, '')
 
-        self._log = []
-        self._log.append(Logger.columns)
+    def __init__(self, game_id, directory=None, max_bytes=1 << 23):
+        self.game_id = game_id
+        self.max_bytes = max_bytes
+        # Rows dropped because the writer queue was full
+        self.dropped = 0
 
-        current_dir = path.dirname(__file__)
-        file_path = path.join(
-            current_dir, f"{Logger.log_dir}\\{game_id}_{time.time()}.csv")
+        if directory is None:
+            directory = path.join(path.dirname(__file__), Logger.log_dir)
+        self.name = path.join(directory, f"{game_id}_{time.time()}")
+        self.log_path = self.name + '.csv'
 
-        self.log_path = file_path
+        # Only used by the writer thread
+        self._file = None
+        self._csv = None
+        self._part = 0
+        self._closed = threading.Event()
 
     @staticmethod
     def get_ts():
-        return datetime.datetime.fromtimestamp(time.time()).strftime('%Y-%m-%d %H:%M:%S')
+        now = int(time.time())
+        second, text = Logger._ts_cache
+        if second != now:
+            text = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(now))
+            Logger._ts_cache = (now, text)
+        return text
 
     def log(self, msg, player):
 
@@ -43,17 +69,99 @@ class Logger:
         color = player_team
         role = player_role
 
-        self._log.append(
-            [msg_type, timestamp, game_id, player_id, color, role])
+        try:
+            _writer().queue.put_nowait((self, [msg_type, timestamp, game_id, player_id, color, role]))
+        except queue.Full:
+            self.dropped += 1
         # print('logger: ', msg_type, timestamp, game_id, player_id, color, role)
 
-    def save_log(self):
+    # Writes the rows still queued and closes the log, waits at most timeout seconds for it
+    def save_log(self, timeout=5.0):
         print(f'> logger: Saving log to \"{self.log_path}\"')
+        if self.dropped:
+            print(f'> logger: {self.dropped} rows dropped, the log writer could not keep up')
+        # The close marker itself is never dropped
+        _writer().queue.put((self, None))
+        self._closed.wait(timeout)
+
+    # ======== Called by the writer thread ========
+
+    def _write(self, row):
+        if self._closed.is_set():
+            # Logged after the game was saved
+            return
+        if self._file is None:
+            os.makedirs(path.dirname(self.log_path), exist_ok=True)
+            self._file = open(self.log_path, 'w', newline='')
+            self._csv = csv.writer(self._file)
+            self._csv.writerow(Logger.columns)
+        self._csv.writerow(row)
+
+    def _flush(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        if self._file.tell() > self.max_bytes:
+            self._file.close()
+            self._file = None
+            self._part += 1
+            self.log_path = f'{self.name}.{self._part}.csv'
+
+    def _close(self):
+        try:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        finally:
+            self._closed.set()
+
+
+class _Writer(threading.Thread):
+    """ Writes the queued rows of all loggers to their files, flushing each file once per batch """
+
+    def __init__(self):
+        super().__init__(daemon=True, name='log writer')
+        self.queue = queue.Queue(MAX_QUEUED)
+
+    def run(self):
+        while True:
+            # Blocks for the first row, then takes what is already queued
+            batch = [self.queue.get()]
+            try:
+                while len(batch) < BATCH:
+                    batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                pass
+
+            loggers = set()
+            for logger, row in batch:
+                try:
+                    if row is None:
+                        logger._close()
+                        loggers.discard(logger)
+                    else:
+                        logger._write(row)
+                        loggers.add(logger)
+                except OSError as e:
+                    print(f'> logger: Failed to write \"{logger.log_path}\": {e}')
+            for logger in loggers:
+                try:
+                    logger._flush()
+                except OSError as e:
+                    print(f'> logger: Failed to write \"{logger.log_path}\": {e}')
+
+
+_writer_thread = None
+_writer_lock = threading.Lock()
 
-        dir_path = path.join(path.dirname(__file__), Logger.log_dir)
-        if not os.path.isdir(dir_path):
-            os.mkdir(dir_path)
 
-        with open(self.log_path, 'w+') as log_file:
-            wr = csv.writer(log_file)
-            wr.writerows(self._log)
\ No newline at end of file
+# The writer thread, started with the first row
+def _writer():
+    global _writer_thread
+    if _writer_thread is None:
+        with _writer_lock:
+            if _writer_thread is None:
+                writer = _Writer()
+                writer.start()
+                _writer_thread = writer
+    return _writer_thread
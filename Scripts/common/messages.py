@@ -2,115 +2,138 @@ import uuid
 import json
 import collections
 
+import common.codec as c
+import common.binary as b
+
 # Contains all types of messages and their conversions to and from json format
+# Every message class declares its fields with __slots__, in the order they are sent,
+#   the json encoders and decoders are built from them once (see common/codec.py)
+
+# Wire names of the fields that are named differently in python
+_wire_names = {
+    'id': 'userGuid',
+    'dir': 'direction',
+    'preferred_team': 'preferredTeam',
+    'team_size': 'teamSize',
+    'team_guids': 'teamGuids',
+    'to': 'receiverGuid',
+}
+
 
 class Message:
+    # Routing key of a message class is (action, variant), see common/routing.py
+    # Messages with the same action are told apart by their variant (e.g. a request and its response)
+    action = None
+    variant = None
+    route = (None, None)
+
+    # Envelope: fields about the connection or set by whoever routes the message rather than by its sender,
+    #   only sent when set. encoding is the wire format a client asks for when joining or setting up a game,
+    #   traceId the trace of a request and of the messages it causes (see common/tracing.py)
+    _envelope = ('gameId', 'encoding', 'traceId')
+    __slots__ = _envelope
+
+    # Fields that may be missing from received json, with their value in that case
+    _defaults = {}
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.route = (cls.action, cls.variant)
+        cls._schema = Message._schema_of(cls)
+
     def __init__(self):
-        pass
+        self.gameId = None
+        self.encoding = None
+        self.traceId = None
 
     def __str__(self):
         ret = ""
-        for attr, value in self.__dict__.items():
+        for attr, value in self._items():
             ret += f'>    {attr}: {value}\n'
         return ret
 
     # For debugging
     def print(self):
-        for attr, value in self.__dict__.items():
+        for attr, value in self._items():
             print(f'>    {attr}: {value}')
 
     def to_json(self):
         """ Converts message to json """
+        return self._schema.encode(self)
 
-        def serialize(obj):
-            if isinstance(obj, uuid.UUID):
-                serial = str(obj.hex)
-                return serial
-
-            return obj.__dict__
-
-        j = json.dumps(self, default=serialize)
-        j = j.replace('\"id\"', '\"userGuid\"')
-
-        return j
+    def to_binary(self):
+        """ Converts message to the binary format, not yet byte stuffed (see common/binary.py) """
+        return b.encode(self)
 
     @staticmethod
     def from_json_gm(json_data):
         """ Converts messages sent to gm from json to corresponding message class """
-        return Message._json_to_msg(json_data, Message._conv_dict_gm)
+        return Message._json_to_msg(json_data, Message._decoders_gm)
     
     @staticmethod
     def from_json_player(json_data):
         """ Converts messages sent to player from json to corresponding message class """
-        return Message._json_to_msg(json_data, Message._conv_dict_player)
+        return Message._json_to_msg(json_data, Message._decoders_player)
     
     @staticmethod
     def from_json_server(json_data):
         """ Converts messages sent to server from json to corresponding message class """
-        return Message._json_to_msg(json_data, Message._conv_dict_server)
+        return Message._json_to_msg(json_data, Message._decoders_server)
 
+    @staticmethod
+    def from_binary_gm(data):
+        """ Binary counterpart of from_json_gm, data is an unstuffed frame """
+        return Message._binary_to_msg(data, Message._decoders_gm)
+
+    @staticmethod
+    def from_binary_player(data):
+        return Message._binary_to_msg(data, Message._decoders_player)
+
+    @staticmethod
+    def from_binary_server(data):
+        return Message._binary_to_msg(data, Message._decoders_server)
 
     # ======== Internals ========
-    
-    
-    # Holds the action to Message conversion, given j is loaded json data
-    _conv_dict_gm = {
-        'start':   lambda j: ConfirmSetUpGame(j['result']),
-        'connect': lambda j: JoinGame(j['userGuid'], j['preferredTeam'], j['type']),
-        'move':    lambda j: Move(j['userGuid'], j['direction']),
-        'pickup':  lambda j: PickUp(j['userGuid']),
-        'test':    lambda j: TestPiece(j['userGuid']),
-        'state':   lambda j: Discover(j['location'], j['userGuid']),
-        'place':   lambda j: PlacePiece(j['userGuid']),
-        'destroy': lambda j: DestroyPiece(j['userGuid']),
-        'exchange': lambda j: Message._handleExchange(j),
-        'error-translation': lambda j: MessageTranslationError(j['error']),
-        'error-guid': lambda j: UnkownGuidError(j['error'])
-    }
-
-    _conv_dict_server = {
-        'start':   lambda j: SetUpGame(),
-        'error-translation': lambda j: MessageTranslationError(j['error']),
-        'error-guid': lambda j: UnkownGuidError(j['error']),
-        'gui': lambda j: GuiMessage(j['board'])
-    }
-
-    _conv_dict_player = {
-        'start':   lambda j: GameMessage(j['userGuid'], j['team'], j['role'], j['teamSize'], j['teamGuids'], j['location'], j['board']),
-        'connect': lambda j: ConfirmJoiningGame(j['userGuid'], j['result'], j['type']),
-        'move':    lambda j: MoveData(j['userGuid'], j['result'], j['manhattanDistance']),
-        'pickup':  lambda j: PickUpData(j['userGuid'], j['result']),
-        'test':    lambda j: TestData(j['userGuid'], j['result'], j['test']),
-        'state':   lambda j: DiscoverData(j['userGuid'], j['result'], j['location'], j['fields']),
-        'place':   lambda j: PlaceData(j['userGuid'], j['result'], j['consequence']),
-        'destroy': lambda j: DestroyPieceData(j['userGuid'], j['result']),
-        'end':     lambda j: GameOver(j['result']),
-        'exchange':lambda j: Message._handleExchange(j),
-        'error-translation': lambda j: MessageTranslationError(j['error']),
-        'error-guid': lambda j: UnkownGuidError(j['error'])
-    }
 
     @staticmethod
-    def _json_to_msg(json_data, conv_dict):
+    def _schema_of(cls):
+        fields = tuple(f for f in c.fields_of(cls) if f not in Message._envelope)
+        return c.Schema(cls, Message._envelope, fields, _wire_names, cls._defaults)
+
+    def _items(self):
+        if self.action is not None:
+            yield 'action', self.action
+        for attr in c.fields_of(type(self)):
+            value = getattr(self, attr, None)
+            # Unset envelope fields are not part of the message
+            if value is not None or attr not in Message._envelope:
+                yield attr, value
+
+    @staticmethod
+    def _decoders(*classes):
+        """ Holds the route to Message conversion, for the messages one side of the connection receives """
+        return {cls.route: cls._schema.decode for cls in classes}
+
+    @staticmethod
+    def _json_to_msg(json_data, decoders):
         """ Converts given json into a Message class if possible, returns (msg, error) """
         j = json.loads(json_data)
         try:
-            msg = conv_dict[j['action']](j)
+            msg = decoders[c.route_of(j)](j)
             return msg, None
         except Exception as err:
             return None, f'Could not parse json msg: {json_data}\nError: {err}'
 
     @staticmethod
-    def _handleExchange(j):
-        """ Handles json to message conversion for Knowledge exchange classes """
-        if 'receiverGuid' in j:
-            return AuthorizeKnowledgeExchange(j['userGuid'], j['receiverGuid'])
-        elif 'rejectDuration' in j:
-            return RejectKnowledgeExchange(j['userGuid'], j['rejectDuration'])
-        elif 'fields' in j:
-            return KnowledgeExchangeData(j['userGuid'], j['receiverGuid'], j['fields'])
-        else:
-            return AcceptKnowledgeExchange(j['userGuid'])
+    def _binary_to_msg(data, decoders):
+        """ Converts a binary frame into a Message class if possible, returns (msg, error) """
+        try:
+            msg = b.decode(data)
+            if msg.route not in decoders:
+                raise KeyError(msg.route)
+            return msg, None
+        except Exception as err:
+            return None, f'Could not parse binary msg: {bytes(data)}\nError: {err}'
 
 
 # ===== Messages from GM =====
@@ -118,44 +141,53 @@ class Message:
 #       Game setup
 
 class SetUpGame(Message):
-    """ Sent by gm to server on game start """
+    """ Sent by gm to server on game start, slots is the number of players the game takes """
 
-    def __init__(self):
+    action = 'start'
+    variant = 'setup'
+    __slots__ = ('slots',)
+    _defaults = {'slots': None}
+
+    def __init__(self, slots: int = None):
         super().__init__()
-        self.action = 'start'
+        self.slots = slots
 
 
 class ConfirmSetUpGame(Message):
     """ Sent by server to gm on game start """
 
+    action = 'start'
+    variant = 'confirm'
+    __slots__ = ('result',)
+
     def __init__(self, result: str):
         super().__init__()
-        self.action = 'start'
         self.result = result
 
 
 class ConfirmJoiningGame(Message):
     """ Sent by gm to player to confirm whether the player joined the game """
 
+    action = 'connect'
+    variant = 'response'
+    __slots__ = ('result', 'type', 'id')
+
     def __init__(self, id: uuid.uuid4, response: str, type: str):
         super().__init__()
-        self.action = 'connect'
         self.result = response
         self.type = type
         self.id = id
-    
-    def to_json(self):
-        j = super(ConfirmJoiningGame, self).to_json()
-        j = j.replace('\"preferred_team\"', '\"preferredTeam\"')
-        return j
 
 
 class GameMessage(Message):
     """ Sent by gm to player on game start, contains starting game info """
 
+    action = 'start'
+    variant = 'game'
+    __slots__ = ('team', 'role', 'id', 'team_size', 'team_guids', 'location', 'board')
+
     def __init__(self, id: uuid.uuid4, team: str, role: str, team_size: int, team_guids: list, location: dict, board: dict):
         super().__init__()
-        self.action = 'start'
         self.team = team
         self.role = role
         self.id = id
@@ -163,12 +195,6 @@ class GameMessage(Message):
         self.team_guids = team_guids
         self.location = location
         self.board = board
-    
-    def to_json(self):
-        j = super(GameMessage, self).to_json()
-        j = j.replace('\"team_size\"', '\"teamSize\"')
-        j = j.replace('\"team_guids\"', '\"teamGuids\"')
-        return j
 
 
 #       Player action responses
@@ -176,9 +202,12 @@ class GameMessage(Message):
 class MoveData(Message):
     """ Sent by gm to player on as response to move message """
 
+    action = 'move'
+    variant = 'response'
+    __slots__ = ('result', 'id', 'manhattanDistance')
+
     def __init__(self, id: uuid.uuid4, result: str, manhattanDistance: int = None):
         super().__init__()
-        self.action = 'move'
         self.result = result
         self.id = id
         self.manhattanDistance = manhattanDistance
@@ -187,9 +216,12 @@ class MoveData(Message):
 class PickUpData(Message):
     """ Sent by gm to player as response to pick up message """
 
+    action = 'pickup'
+    variant = 'response'
+    __slots__ = ('result', 'id')
+
     def __init__(self, id: uuid.uuid4, result: str):
         super().__init__()
-        self.action = 'pickup'
         self.result = result
         self.id = id
 
@@ -197,9 +229,12 @@ class PickUpData(Message):
 class TestData(Message):
     """ Sent by gm to player as response to test message """
 
+    action = 'test'
+    variant = 'response'
+    __slots__ = ('id', 'result', 'test')
+
     def __init__(self, id: uuid.uuid4, result: str, test: str):
         super().__init__()
-        self.action = 'test'
         self.id = id
         self.result = result
         self.test = test
@@ -208,9 +243,12 @@ class TestData(Message):
 class DiscoverData(Message):
     """ Sent by gm to player as response to discover up message """
 
+    action = 'state'
+    variant = 'response'
+    __slots__ = ('result', 'id', 'location', 'fields')
+
     def __init__(self, id: uuid.uuid4, result: str, location: dict = None, fields=None):
         super().__init__()
-        self.action = 'state'
         self.result = result
         self.id = id
         self.location = location
@@ -220,9 +258,12 @@ class DiscoverData(Message):
 class PlaceData(Message):
     """ Sent by gm to player as response to place message """
 
+    action = 'place'
+    variant = 'response'
+    __slots__ = ('id', 'result', 'consequence')
+
     def __init__(self, id: uuid.uuid4, result: str, consequence: str):
         super().__init__()
-        self.action = 'place'
         self.id = id
         self.result = result
         self.consequence = consequence
@@ -231,9 +272,12 @@ class PlaceData(Message):
 class DestroyPieceData(Message):
     """ Sent by gm to player as response to destroy message """
 
+    action = 'destroy'
+    variant = 'response'
+    __slots__ = ('id', 'result')
+
     def __init__(self, id: uuid.uuid4, result: str):
         super().__init__()
-        self.action = 'destroy'
         self.id = id
         self.result = result
 
@@ -242,9 +286,12 @@ class DestroyPieceData(Message):
 class GameOver(Message):
     """ Sent by gm to all players when the game has ended """
 
+    action = 'end'
+    variant = 'response'
+    __slots__ = ('result',)
+
     def __init__(self, result: str):
         super().__init__()
-        self.action = 'end'
         self.result = result
 
 
@@ -256,19 +303,16 @@ class GameOver(Message):
 class JoinGame(Message):
     """ Sent by player to gm in order to join a game """
 
+    action = 'connect'
+    variant = 'request'
+    __slots__ = ('id', 'preferred_team', 'type')
+
     def __init__(self, id: uuid.uuid4, preferred_team: str, type: str):
         super().__init__()
-        self.action = 'connect'
         self.id = id
         self.preferred_team = preferred_team
         self.type = type
 
-    def to_json(self):
-        j = super(JoinGame, self).to_json()
-        j = j.replace('\"preferred_team\"', '\"preferredTeam\"')
-        return j
-
-
 
 #       Player actions
 
@@ -276,42 +320,49 @@ class JoinGame(Message):
 class Move(Message):
     """ Sent by player to gm to move in a direction """
 
+    action = 'move'
+    variant = 'request'
+    __slots__ = ('dir', 'id')
+
     def __init__(self, id: uuid.uuid4, direction: str):
         super().__init__()
-        self.action = 'move'
         self.dir = direction
         self.id = id
-    
-    def to_json(self):
-        j = super(Move, self).to_json()
-        j = j.replace('\"dir\"', '\"direction\"')
-        return j
 
 
 class PickUp(Message):
     """ Sent by player to gm to pick up a piece """
 
+    action = 'pickup'
+    variant = 'request'
+    __slots__ = ('id',)
+
     def __init__(self, id: uuid.uuid4):
         super().__init__()
-        self.action = 'pickup'
         self.id = id
 
 
 class TestPiece(Message):
     """ Sent by player to gm to test whether a piece is a sham """
 
+    action = 'test'
+    variant = 'request'
+    __slots__ = ('id',)
+
     def __init__(self, id: uuid.uuid4):
         super().__init__()
-        self.action = 'test'
         self.id = id
 
 
 class Discover(Message):
     """ Sent by player to gm to discover the contents of a section of the board """
 
+    action = 'state'
+    variant = 'request'
+    __slots__ = ('location', 'id')
+
     def __init__(self, location: dict, id: uuid.uuid4):
         super().__init__()
-        self.action = 'state'
         self.location = location
         self.id = id
 
@@ -319,18 +370,24 @@ class Discover(Message):
 class PlacePiece(Message):
     """ Sent by player to gm  to place a piece on the board """
 
+    action = 'place'
+    variant = 'request'
+    __slots__ = ('id',)
+
     def __init__(self, id: uuid.uuid4):
         super().__init__()
-        self.action = 'place'
         self.id = id
 
 
 class DestroyPiece(Message):
     """ Sent by player to gm to destroy the piece the player is holding """
 
+    action = 'destroy'
+    variant = 'request'
+    __slots__ = ('id',)
+
     def __init__(self, id: uuid.uuid4):
         super().__init__()
-        self.action = 'destroy'
         self.id = id
 
 #       Knowledge Exchange
@@ -341,18 +398,25 @@ class DestroyPiece(Message):
 
 class AuthorizeKnowledgeExchange(Message):
 
+    action = 'exchange'
+    variant = 'authorize'
+    __slots__ = ('userGuid', 'receiverGuid')
+
     def __init__(self, userGuid: uuid.uuid4, receiverGuid: uuid.uuid4):
         super().__init__()
-        self.action = 'exchange'
         self.userGuid = userGuid
         self.receiverGuid = receiverGuid
 
 
 class RejectKnowledgeExchange(Message):
 
+    action = 'exchange'
+    variant = 'reject'
+    __slots__ = ('result', 'id', 'rejectDuration')
+    _defaults = {'result': 'denied'}
+
     def __init__(self, id: uuid.uuid4, rejectDuration: str):
         super().__init__()
-        self.action = 'exchange'
         self.result = 'denied'
         self.id = id
         self.rejectDuration = rejectDuration
@@ -360,43 +424,52 @@ class RejectKnowledgeExchange(Message):
 
 class AcceptKnowledgeExchange(Message):
 
+    action = 'exchange'
+    variant = 'accept'
+    __slots__ = ('result', 'id')
+    _defaults = {'result': 'OK'}
+
     def __init__(self, id: uuid.uuid4):
         super().__init__()
-        self.action = 'exchange'
         self.result = 'OK'
         self.id = id
 
 
 class KnowledgeExchangeData(Message):
 
+    action = 'send'
+    variant = 'request'
+    __slots__ = ('id', 'to', 'fields')
+
     def __init__(self, id: uuid.uuid4, to: uuid.uuid4, fields: dict):
         super().__init__()
-        self.action = 'send'
         self.id = id
         self.to = to
         self.fields = fields
 
-    def to_json(self):
-        j = super(KnowledgeExchangeData, self).to_json()
-        j = j.replace('\"to\"', '\"receiverGuid\"')
-        return j
-
-
 
 # ===== Errors =====
 
 class MessageTranslationError(Message):
     """ Send this in case a received message could not be parsed from json """
+
+    action = 'error-translation'
+    variant = 'request'
+    __slots__ = ('error',)
+
     def __init__(self, error: str):
         super().__init__()
-        self.action = 'error-translation'
         self.error = error
 
 class UnkownGuidError(Message):
     """ Send this in case a received message has an unknown guid """
+
+    action = 'error-guid'
+    variant = 'request'
+    __slots__ = ('error',)
+
     def __init__(self, error: str):
         super().__init__()
-        self.action = 'error-guid'
         self.error = error
 
 
@@ -404,14 +477,21 @@ class UnkownGuidError(Message):
 
 
 class GuiMessage(Message):
-    """ Sent by gm to server to be passed on to gui, contains current board """
+    """ Sent by gm to server to be passed on to gui, contains current board (keyframe) """
+
+    action = 'gui'
+    variant = 'keyframe'
+    __slots__ = ('board',)
 
     def __init__(self, board):
         super().__init__()
-        self.action = 'gui'
         self.board = self.serialize_board(board)
 
     def serialize_board(self, board):
+        # Board snapshots are already rendered
+        if hasattr(board, 'rows'):
+            return [list(row) for row in board.rows]
+
         rows = board.board_height
         cols = board.board_width
         cells = []
@@ -423,4 +503,112 @@ class GuiMessage(Message):
                 cell = content
                 row.append(cell)
             cells.append(row)
-        return cells
\ No newline at end of file
+        return cells
+
+
+class GuiDelta(Message):
+    """ Sent by gm to server to be passed on to gui, contains [x, y, cell] for cells changed since the last frame """
+
+    action = 'gui'
+    variant = 'delta'
+    __slots__ = ('cells',)
+
+    def __init__(self, cells: list):
+        super().__init__()
+        self.cells = cells
+
+
+# ===== Migration =====
+
+class MigrateGame(Message):
+    """ Sent by gm to server to have a game moved to another gm, and by server to the gm of the game to freeze it """
+
+    action = 'migrate'
+    variant = 'request'
+    __slots__ = ()
+
+
+class GameState(Message):
+    """ Sent by gm to server with the state of the frozen game (see common/checkpoint.py, base64) """
+
+    action = 'migrate'
+    variant = 'response'
+    __slots__ = ('result', 'state')
+
+    def __init__(self, result: str, state: str = None):
+        super().__init__()
+        self.result = result
+        self.state = state
+
+
+class AdoptGame(Message):
+    """ Sent by server to a standby gm to continue a frozen game from its state """
+
+    action = 'adopt'
+    variant = 'request'
+    __slots__ = ('state',)
+
+    def __init__(self, state: str):
+        super().__init__()
+        self.state = state
+
+
+class ConfirmAdoptGame(Message):
+    """ Sent by gm to server once it runs the adopted game, and by server to the gm that froze the game once another
+        gm runs it (OK, the frozen state is dropped) or none could (denied, the state is kept to resume the game) """
+
+    action = 'adopt'
+    variant = 'response'
+    __slots__ = ('result',)
+
+    def __init__(self, result: str):
+        super().__init__()
+        self.result = result
+
+
+class CancelMigration(Message):
+    """ Sent by server to the gm of a game it did not freeze in time, the gm keeps the game unless it froze it """
+
+    action = 'unfreeze'
+    variant = 'request'
+    __slots__ = ()
+
+
+class Standby(Message):
+    """ Sent by gm to server to offer room for capacity games moved from other gms """
+
+    action = 'standby'
+    variant = 'request'
+    __slots__ = ('capacity',)
+
+    def __init__(self, capacity: int):
+        super().__init__()
+        self.capacity = capacity
+
+
+Message._schema = Message._schema_of(Message)
+
+Message._decoders_gm = Message._decoders(
+    ConfirmSetUpGame, JoinGame, Move, PickUp, TestPiece, Discover, PlacePiece, DestroyPiece,
+    AuthorizeKnowledgeExchange, RejectKnowledgeExchange, AcceptKnowledgeExchange, KnowledgeExchangeData,
+    MessageTranslationError, UnkownGuidError, MigrateGame, AdoptGame, ConfirmAdoptGame, CancelMigration)
+
+Message._decoders_server = Message._decoders(
+    SetUpGame, MessageTranslationError, UnkownGuidError, GuiMessage, GuiDelta,
+    MigrateGame, GameState, ConfirmAdoptGame, Standby)
+
+Message._decoders_player = Message._decoders(
+    GameMessage, ConfirmJoiningGame, MoveData, PickUpData, TestData, DiscoverData, PlaceData, DestroyPieceData, GameOver,
+    AuthorizeKnowledgeExchange, RejectKnowledgeExchange, AcceptKnowledgeExchange, KnowledgeExchangeData,
+    MessageTranslationError, UnkownGuidError)
+
+# Binary codes of the messages, the position in this list is part of the binary format: append only
+_binary_codes = (
+    SetUpGame, ConfirmSetUpGame, ConfirmJoiningGame, GameMessage, MoveData, PickUpData, TestData, DiscoverData,
+    PlaceData, DestroyPieceData, GameOver, JoinGame, Move, PickUp, TestPiece, Discover, PlacePiece, DestroyPiece,
+    AuthorizeKnowledgeExchange, RejectKnowledgeExchange, AcceptKnowledgeExchange, KnowledgeExchangeData,
+    MessageTranslationError, UnkownGuidError, GuiMessage, GuiDelta,
+    MigrateGame, GameState, AdoptGame, ConfirmAdoptGame, Standby, CancelMigration,
+)
+for code, cls in enumerate(_binary_codes, 1):
+    b.register(cls._schema, code)
@@ -0,0 +1,179 @@
+import collections
+
+# Latency metrics of a game (see GmExternal), cheap enough to be always on.
+# Histogram keeps its counts in log-linear buckets, like an HDR histogram: values are whole microseconds, exact
+#   below 128 us and within 1/64 above, so a record is a few integer operations and an increment, and quantiles
+#   are read from the counts at any time without keeping the samples.
+# Per message type, three stages are timed:
+#   queue  from the message arriving (send_message) to the gm's thread taking it
+#   drift  how late an action ran after its delay (Delay.*), on the gm's clock
+#   run    the time the gm's handler (move_player, discover, ...) ran
+# With the lag of the gm's event loop, the actions waiting for their delay and the messages per second.
+# render() writes them in the Prometheus text format (gm_server.py --metrics-port), summary() is the stats dump.
+# Metrics are recorded on the gm's thread and read from another one: a reading may miss the latest records.
+
+SUB_BITS = 7
+_SUB = 1 << SUB_BITS
+_HALF = _SUB >> 1
+
+QUANTILES = (0.5, 0.9, 0.99, 0.999)
+
+STAGES = ('queue', 'drift', 'run')
+
+# Seconds of messages the rates are computed over
+RATE_WINDOW = 10.0
+
+
+def _index(us):
+    if us < _SUB:
+        return us if us > 0 else 0
+    shift = us.bit_length() - SUB_BITS
+    return _SUB + (shift - 1) * _HALF + (us >> shift) - _HALF
+
+
+# Middle of a bucket, in microseconds
+def _value(index):
+    if index < _SUB:
+        return index
+    shift, top = divmod(index - _SUB, _HALF)
+    shift += 1
+    return ((top + _HALF) << shift) + (1 << (shift - 1))
+
+
+class Histogram:
+    """ Durations in seconds, counted in log-linear microsecond buckets """
+
+    __slots__ = ('counts', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.counts = []
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        index = _index(int(seconds * 1e6))
+        counts = self.counts
+        if index >= len(counts):
+            counts.extend([0] * (index + 1 - len(counts)))
+        counts[index] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def quantile(self, q):
+        """ Value under which a fraction q of the durations are, in seconds """
+        if self.count == 0:
+            return 0.0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(_value(index) / 1e6, self.max)
+        return self.max
+
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+
+class ActionStats:
+    """ Histograms of one message type, by stage """
+
+    __slots__ = STAGES
+
+    def __init__(self):
+        self.queue = Histogram()
+        self.drift = Histogram()
+        self.run = Histogram()
+
+
+class Metrics:
+    """ Metrics of one game """
+
+    def __init__(self):
+        # Message class -> ActionStats
+        self.actions = {}
+        self.loop_lag = Histogram()
+        # Messages sent to the gm, and by the gm
+        self.received = 0
+        self.sent = 0
+        # (time, received, sent) of the last RATE_WINDOW seconds, sampled by tick()
+        self.samples = collections.deque()
+
+    def action(self, cls):
+        stats = self.actions.get(cls)
+        if stats is None:
+            stats = self.actions[cls] = ActionStats()
+        return stats
+
+    # Subscribed to the messages the gm sends
+    def sent_message(self, msg):
+        self.sent += 1
+
+    # Samples the counters, for the rates
+    def tick(self, now):
+        samples = self.samples
+        samples.append((now, self.received, self.sent))
+        while now - samples[0][0] > RATE_WINDOW:
+            samples.popleft()
+
+    def rates(self):
+        """ Messages received and sent per second, over the last RATE_WINDOW seconds """
+        if len(self.samples) < 2:
+            return 0.0, 0.0
+        (t0, received0, sent0), (t1, received1, sent1) = self.samples[0], self.samples[-1]
+        return (received1 - received0) / (t1 - t0), (sent1 - sent0) / (t1 - t0)
+
+    def render(self, pending, labels=''):
+        """ Metrics in the Prometheus text format, labels (e.g. 'game="..."') are added to every sample """
+        sep = ',' if labels else ''
+        lines = ['# TYPE gm_action_seconds summary']
+        # Copied at once, the gm's thread may add a message type meanwhile
+        for cls, stats in sorted(list(self.actions.items()), key=lambda item: item[0].__name__):
+            for stage in STAGES:
+                histogram = getattr(stats, stage)
+                if histogram.count == 0:
+                    continue
+                key = f'{labels}{sep}action="{cls.__name__}",stage="{stage}"'
+                lines += _summary('gm_action_seconds', key, histogram)
+        lines.append('# TYPE gm_loop_lag_seconds summary')
+        lines += _summary('gm_loop_lag_seconds', labels, self.loop_lag)
+
+        received, sent = self.rates()
+        lines += [
+            '# TYPE gm_pending_actions gauge',
+            f'gm_pending_actions{{{labels}}} {pending}',
+            '# TYPE gm_messages_total counter',
+            f'gm_messages_total{{{labels}{sep}direction="in"}} {self.received}',
+            f'gm_messages_total{{{labels}{sep}direction="out"}} {self.sent}',
+            '# TYPE gm_messages_per_second gauge',
+            f'gm_messages_per_second{{{labels}{sep}direction="in"}} {received:.1f}',
+            f'gm_messages_per_second{{{labels}{sep}direction="out"}} {sent:.1f}',
+        ]
+        return '\n'.join(lines) + '\n'
+
+    def summary(self, pending):
+        """ Stats dump, one line per message type then one for the game, times in ms """
+        lines = []
+        for cls, stats in sorted(list(self.actions.items()), key=lambda item: item[0].__name__):
+            parts = [f'{stage} {_ms(getattr(stats, stage))}' for stage in STAGES if getattr(stats, stage).count]
+            lines.append(f'{cls.__name__}: {stats.run.count}, ' + ', '.join(parts))
+        received, sent = self.rates()
+        lines.append(f'loop lag {_ms(self.loop_lag)}, {pending} pending, '
+                     f'{received:.0f} in/s, {sent:.0f} out/s ({self.received} in, {self.sent} out)')
+        return lines
+
+
+def _summary(name, labels, histogram):
+    sep = ',' if labels else ''
+    lines = [f'{name}{{{labels}{sep}quantile="{q}"}} {histogram.quantile(q):.6f}' for q in QUANTILES]
+    lines.append(f'{name}_sum{{{labels}}} {histogram.total:.6f}')
+    lines.append(f'{name}_count{{{labels}}} {histogram.count}')
+    return lines
+
+
+# p50/p99/max of a histogram, in ms
+def _ms(histogram):
+    return f'{histogram.quantile(0.5) * 1e3:.2f}/{histogram.quantile(0.99) * 1e3:.2f}/{histogram.max * 1e3:.2f}'
@@ -0,0 +1,139 @@
+import json
+import re
+
+import common.binary as b
+import common.messages as m
+import common.codec as c
+
+# Message routing shared by the gm, the bots and the server.
+# Every message class has a route, (action, variant). The same key is computed for json received by the
+#   server (route_of), so every component dispatches with a single dict lookup into a table built once,
+#   instead of matching on types or on the keys present in the message.
+# The server only needs a few keys of the messages it forwards, header_of reads them from the start of the
+#   frame without parsing the rest (see the relay in server/server.py).
+
+
+def _message_classes(cls=m.Message):
+    for sub in cls.__subclasses__():
+        yield sub
+        yield from _message_classes(sub)
+
+
+def _build_routes():
+    routes = {}
+    for cls in _message_classes():
+        if cls.route in routes:
+            raise ValueError(f'{cls.__name__} and {routes[cls.route].__name__} share the route {cls.route}')
+        routes[cls.route] = cls
+    return routes
+
+
+# (action, variant) -> message class
+ROUTES = _build_routes()
+
+
+# Route of parsed json, (action, variant), computed by the codec which also decodes by route
+route_of = c.route_of
+
+
+def table(handlers: dict):
+    """ Builds a routing table from {message class: handler} """
+    return {cls.route: handler for cls, handler in handlers.items()}
+
+
+class JsonTable:
+    """ Routing table for parsed json, handler_of(j) is table(handlers).get(route_of(j), default)
+        without building the route: the variant rule is picked by action first """
+
+    __slots__ = ('actions', 'default')
+
+    def __init__(self, handlers: dict, default):
+        routes = table(handlers)
+        self.default = default
+        # action -> (request handler, response handler), indexed by whether the json has a result,
+        #   or a function of the parsed json returning the handler for the actions with variant rules
+        self.actions = {}
+        for action in {action for action, _ in ROUTES}:
+            rule = c.VARIANT_RULES.get(action)
+            if rule is None:
+                self.actions[action] = (routes.get((action, 'request'), default), routes.get((action, 'response'), default))
+            else:
+                variants = {variant: handler for (a, variant), handler in routes.items() if a == action}
+                self.actions[action] = lambda j, rule=rule, variants=variants: variants.get(rule(j), default)
+
+    def handler_of(self, parsed_json: dict):
+        entry = self.actions.get(parsed_json.get('action'))
+        if entry is None:
+            return self.default
+        if type(entry) is tuple:
+            return entry['result' in parsed_json]
+        return entry(parsed_json)
+
+
+# ======== Frame headers ========
+
+# Keys the server routes by, besides the action and the envelope fields (gameId, ...)
+ROUTING_KEYS = frozenset(('userGuid', 'receiverGuid', 'result', 'rejectDuration'))
+# Keys whose presence picks the variant of a message (see codec.VARIANT_RULES), their values are not needed
+VARIANT_KEYS = frozenset(('teamGuids', 'cells'))
+
+# "key": value pairs of flat json, strings without escapes
+_pair = re.compile(rb'"([^"\\]*)"\s*:\s*("[^"\\]*"|[^,}\s]*)')
+_constants = {b'null': None, b'true': True, b'false': False}
+
+# (action, keys read before the first nested value) -> whether they hold all the keys routing needs, as bytes
+_covered = {}
+
+
+def _scalar(v: bytes):
+    if v[:1] == b'"':
+        return v[1:-1].decode()
+    if v in _constants:
+        return _constants[v]
+    try:
+        return int(v)
+    except ValueError:
+        return float(v)
+
+
+def _covers(action: str, keys: frozenset):
+    """ Whether every message with this action and these keys has all its routing keys among them,
+        the keys after the first nested value are not read """
+    candidates = [cls for cls in ROUTES.values()
+                  if cls.action == action and keys <= set(cls._schema.keys + cls._schema.envelope_keys)]
+    return len(candidates) > 0 and all((ROUTING_KEYS | VARIANT_KEYS).intersection(cls._schema.keys) <= keys
+                                       for cls in candidates)
+
+
+def header_of(data: bytes):
+    """ Returns the action, envelope and routing keys of a frame (json or unstuffed binary), without parsing
+        the whole message. Keys holding nested values map to None. Returns None if the frame has to be parsed """
+    if b.is_binary(data):
+        return b.decode_head(data, ROUTING_KEYS)
+
+    # Json: flat messages are parsed whole, that is as cheap as scanning them
+    end = len(data)
+    for bracket in (data.find(b'{', 1), data.find(b'[')):
+        if 0 < bracket < end:
+            end = bracket
+    if end == len(data):
+        # Decoded here, json.loads would detect the encoding of bytes first
+        return json.loads(data.decode())
+
+    # Otherwise the top level pairs before the first nested value, the codec writes routing keys before nested ones
+    if data.find(b'\\', 0, end) >= 0:
+        return None
+    pairs = _pair.findall(data, 0, end)
+    # The last key read holds the nested value
+    if not pairs or pairs[0][0] != b'action' or pairs[-1][1] != b'':
+        return None
+    shape = tuple(k for k, _ in pairs)
+    action = pairs[0][1]
+    covered = _covered.get((action, shape))
+    if covered is None:
+        covered = _covers(action[1:-1].decode(), frozenset(k.decode() for k in shape[1:]))
+        if len(_covered) < 1024:
+            _covered[action, shape] = covered
+    if not covered:
+        return None
+    return {k.decode(): _scalar(v) if v else None for k, v in pairs}
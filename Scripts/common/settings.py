@@ -23,6 +23,13 @@ class Settings:
         self.player_count_per_team = data["player_count_per_team"]
         self.goal_definition = data["goal_definition"]
         self.game_name = data["game_name"]
+        # Array backed board, for very large boards, off unless the file asks for it
+        self.compact_board = data.get("compact_board", False)
+
+    # Overrides the settings read from the file, e.g. with the ones a game was recorded with
+    def update(self, values: dict):
+        for attr, value in values.items():
+            setattr(self, attr, value)
 
     def print(self):
         for attr, value in self.__dict__.items():
@@ -13,14 +13,57 @@ class SquareType(enum.Enum):
 
 class Square:
 
-    def __init__(self, x: int, y: int, type: SquareType, piece = None, player = None):
-        self.id = u.uuid4()
+    def __init__(self, x: int, y: int, type: SquareType, piece = None, player = None, on_change = None, id = None):
+        self.id = id if id is not None else u.uuid4()
         self.x = x
         self.y = y
-        self.piece = piece
-        self.player = player
-        self.type = type
-        self.discovered = False
+        self._piece = piece
+        self._player = player
+        self._type = type
+        self._discovered = False
+
+        # Called with the square whenever its piece, player, type or discovered flag is set
+        self.on_change = on_change
+
+    @property
+    def piece(self):
+        return self._piece
+
+    @piece.setter
+    def piece(self, piece):
+        self._piece = piece
+        if self.on_change is not None:
+            self.on_change(self)
+
+    @property
+    def player(self):
+        return self._player
+
+    @player.setter
+    def player(self, player):
+        self._player = player
+        if self.on_change is not None:
+            self.on_change(self)
+
+    @property
+    def type(self):
+        return self._type
+
+    @type.setter
+    def type(self, type):
+        self._type = type
+        if self.on_change is not None:
+            self.on_change(self)
+
+    @property
+    def discovered(self):
+        return self._discovered
+
+    @discovered.setter
+    def discovered(self, discovered):
+        self._discovered = discovered
+        if self.on_change is not None:
+            self.on_change(self)
 
     def get_type_msg(self):
         if self.player is not None:
@@ -0,0 +1,136 @@
+import collections
+import json
+import os
+import threading
+import time
+
+import common.metrics as mt
+
+# End-to-end tracing of the requests of the players, off unless asked for (--trace <dir> of bot_server.py, server.py
+#   and gm_server.py). A bot sets the traceId envelope field of the requests it samples, the relay forwards it as is
+#   and the gm copies it onto the messages it sends while handling the request, so the result comes back with it.
+# Every hop writes spans of what it did with a traced message to its own file in the trace directory, one json
+#   object per line: {"trace", "name", "ts", "dur", "proc", "pid", "thread", "game", "args"}, ts and dur in
+#   microseconds of the wall clock, so the spans of processes on the same host line up. The spans:
+#   bot    round trip       from the request being written to its result being read
+#   relay  relay request    routing the request to the gm, and relay response routing its result back
+#   gm     gm receive       decoding the request on the reactor thread and queueing it for the gm's thread
+#          gm queue         waiting for the gm's thread
+#          gm delay         the delay of the action (Delay.*), "late" is how much longer it waited
+#          gm run           the handler of the gm
+#          gm send          encoding the result and handing it back to the reactor thread, until it is written
+# The time between two spans of a request is spent in sockets and in the event loops of the processes.
+# trace.py merges the files into a Chrome trace event file per game (chrome://tracing, Perfetto) and prints the
+#   quantiles of every hop and of the gaps between them.
+
+# Spans written to the file at once
+BATCH = 256
+
+
+def new_id():
+    """ Returns a random trace id """
+    return os.urandom(8).hex()
+
+
+class Tracer:
+    """ Writes the spans of one process, spans may be recorded from several threads """
+
+    def __init__(self, directory, process):
+        os.makedirs(directory, exist_ok=True)
+        self.process = process
+        self.pid = os.getpid()
+        self.path = os.path.join(directory, f'{process}-{self.pid}.jsonl')
+        self.file = open(self.path, 'w')
+        self.lock = threading.Lock()
+        self.lines = []
+        # Spans are given perf_counter times, turned into wall clock microseconds
+        self.offset = time.time() - time.perf_counter()
+
+    def span(self, trace, name, start, end, thread='main', game=None, **args):
+        """ Records a span of a traced message, start and end are perf_counter times """
+        line = json.dumps({
+            'trace': trace, 'name': name, 'ts': round((start + self.offset) * 1e6, 1),
+            'dur': round((end - start) * 1e6, 1), 'proc': self.process, 'pid': self.pid, 'thread': thread,
+            'game': game, 'args': args})
+        with self.lock:
+            self.lines.append(line)
+            if len(self.lines) >= BATCH:
+                self._flush()
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self._flush()
+                self.file.close()
+
+    def _flush(self):
+        if not self.file.closed:
+            self.file.write(''.join(line + '\n' for line in self.lines))
+        self.lines = []
+
+
+def read(paths):
+    """ Returns the spans of the given trace files, by game: game id -> spans ordered by time. The game of a span
+        is the one of its trace, the bots do not know which game they play in """
+    spans = []
+    for path in paths:
+        with open(path) as trace_file:
+            spans += [json.loads(line) for line in trace_file if line.strip()]
+    game_of_trace = {span['trace']: span['game'] for span in spans if span['game'] is not None}
+    games = collections.defaultdict(list)
+    for span in sorted(spans, key=lambda span: span['ts']):
+        games[game_of_trace.get(span['trace'])].append(span)
+    return games
+
+
+def chrome_trace(spans):
+    """ Returns the Chrome trace event json of the spans of a game: a complete event per span, a process per
+        traced process and a thread per thread of it, and the spans of each request linked by a flow """
+    pids = {}
+    tids = {}
+    events = []
+    # The round trip of the bot encloses the whole request, the flow goes through the spans of the other hops
+    by_trace = collections.defaultdict(list)
+    for span in spans:
+        key = (span['proc'], span['pid'])
+        if key not in pids:
+            pids[key] = len(pids) + 1
+            events.append({'ph': 'M', 'name': 'process_name', 'pid': pids[key], 'tid': 0,
+                           'args': {'name': f'{span["proc"]} {span["pid"]}'}})
+        pid = pids[key]
+        thread = key + (span['thread'],)
+        if thread not in tids:
+            tids[thread] = len(tids) + 1
+            events.append({'ph': 'M', 'name': 'thread_name', 'pid': pid, 'tid': tids[thread],
+                           'args': {'name': span['thread']}})
+        event = {'ph': 'X', 'name': span['name'], 'cat': span['proc'], 'ts': span['ts'], 'dur': span['dur'],
+                 'pid': pid, 'tid': tids[thread], 'args': dict(span['args'], trace=span['trace'])}
+        events.append(event)
+        if span['name'] != 'round trip':
+            by_trace[span['trace']].append(event)
+
+    for trace, hops in by_trace.items():
+        for i, event in enumerate(hops):
+            phase = 's' if i == 0 else 'f' if i == len(hops) - 1 else 't'
+            flow = {'ph': phase, 'name': 'request', 'cat': 'trace', 'id': trace, 'ts': event['ts'],
+                    'pid': event['pid'], 'tid': event['tid']}
+            if phase == 'f':
+                flow['bp'] = 'e'
+            events.append(flow)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def hop_stats(spans):
+    """ Durations of the hops of the requests, and of the gaps between two successive hops of a request
+        (sockets and event loops), as name -> Histogram in seconds """
+    stats = collections.defaultdict(mt.Histogram)
+    by_trace = collections.defaultdict(list)
+    for span in spans:
+        stats[span['name']].record(span['dur'] / 1e6)
+        if span['name'] != 'round trip':
+            by_trace[span['trace']].append(span)
+    for hops in by_trace.values():
+        for before, after in zip(hops, hops[1:]):
+            gap = after['ts'] - (before['ts'] + before['dur'])
+            stats[f'{before["name"]} -> {after["name"]}'].record(max(0.0, gap) / 1e6)
+    return stats
@@ -0,0 +1,162 @@
+import array
+import uuid
+
+import common.square as sqr
+import board as b
+
+# Struct-of-arrays version of the Board, for very large boards.
+# Types and discovered flags are kept in flat typed arrays, pieces and players (few compared to the
+#   number of cells) in dicts keyed by the flat index. Squares are only created on demand as light views,
+#   so building a board costs a couple of array allocations instead of one object and uuid per cell.
+
+# Goal area masks, per cell
+_TASK = 0
+_BLUE = 1
+_RED = 2
+
+_side_of = {
+    sqr.SquareType.TaskArea: _TASK,
+    sqr.SquareType.BlueGoalArea: _BLUE,
+    sqr.SquareType.BlueGoalField: _BLUE,
+    sqr.SquareType.RedGoalArea: _RED,
+    sqr.SquareType.RedGoalField: _RED,
+}
+
+# Side a team is not allowed to enter
+_blocked_for = {'red': _BLUE, 'blue': _RED}
+
+_type_of_code = {t.value: t for t in sqr.SquareType}
+
+
+class CompactBoard(b.Board):
+
+    # Fills the flat arrays, the three areas are stored one after the other (blue, task, red)
+    def _create_squares(self):
+        w = self.board_width
+        goal_size = self.goal_area_height * w
+        task_size = self.task_area_height * w
+
+        self.types = array.array('B', [sqr.SquareType.BlueGoalArea.value]) * goal_size \
+            + array.array('B', [sqr.SquareType.TaskArea.value]) * task_size \
+            + array.array('B', [sqr.SquareType.RedGoalArea.value]) * goal_size
+        self.sides = bytearray([_BLUE]) * goal_size + bytearray([_TASK]) * task_size + bytearray([_RED]) * goal_size
+        self.discovered = bytearray(len(self.types))
+
+        self.pieces = {}
+        self.players = {}
+
+        self.goal_area_blue = SquareRange(self, 0, goal_size)
+        self.task_area = SquareRange(self, goal_size, goal_size + task_size)
+        self.goal_area_red = SquareRange(self, goal_size + task_size, len(self.types))
+        self.content = SquareRange(self, 0, len(self.types))
+
+    def get_square(self, x, y):
+        if x >= self.board_width or x < 0:
+            return None
+        if y >= self.board_height or y < 0:
+            return None
+        return CompactSquare(self, y * self.board_width + x)
+
+    def can_move(self, x, y, team):
+        if x >= self.board_width or x < 0 or y >= self.board_height or y < 0:
+            return False
+        i = y * self.board_width + x
+        if i in self.players:
+            return False
+        return self.sides[i] != _blocked_for.get(team)
+
+    def in_goal_area(self, x, y):
+        return self.sides[y * self.board_width + x] != _TASK
+
+
+class SquareRange:
+    """ Sequence of squares with flat indices in [start, stop), stands in for the area lists of Board """
+
+    def __init__(self, board: CompactBoard, start: int, stop: int):
+        self.board = board
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, k):
+        n = self.stop - self.start
+        if k < 0:
+            k += n
+        if k < 0 or k >= n:
+            raise IndexError('square index out of range')
+        return CompactSquare(self.board, self.start + k)
+
+    def __iter__(self):
+        board = self.board
+        for i in range(self.start, self.stop):
+            yield CompactSquare(board, i)
+
+
+class CompactSquare:
+    """ View of a single cell of a CompactBoard, behaves like common.square.Square """
+
+    __slots__ = ('board', 'i', 'x', 'y')
+
+    def __init__(self, board: CompactBoard, i: int):
+        self.board = board
+        self.i = i
+        self.y, self.x = divmod(i, board.board_width)
+
+    @property
+    def id(self):
+        return uuid.uuid5(self.board.id, str(self.i))
+
+    @property
+    def type(self):
+        return _type_of_code[self.board.types[self.i]]
+
+    @type.setter
+    def type(self, type: sqr.SquareType):
+        self.board.types[self.i] = type.value
+        self.board.sides[self.i] = _side_of[type]
+        self.board._square_changed(self)
+
+    @property
+    def piece(self):
+        return self.board.pieces.get(self.i)
+
+    @piece.setter
+    def piece(self, piece):
+        if piece is None:
+            self.board.pieces.pop(self.i, None)
+        else:
+            self.board.pieces[self.i] = piece
+        self.board._square_changed(self)
+
+    @property
+    def player(self):
+        return self.board.players.get(self.i)
+
+    @player.setter
+    def player(self, player):
+        if player is None:
+            self.board.players.pop(self.i, None)
+        else:
+            self.board.players[self.i] = player
+        self.board._square_changed(self)
+
+    @property
+    def discovered(self):
+        return self.board.discovered[self.i] == 1
+
+    @discovered.setter
+    def discovered(self, discovered: bool):
+        self.board.discovered[self.i] = 1 if discovered else 0
+        self.board._square_changed(self)
+
+    def __eq__(self, other):
+        return isinstance(other, CompactSquare) and other.board is self.board and other.i == self.i
+
+    def __hash__(self):
+        return hash((id(self.board), self.i))
+
+    get_type_msg = sqr.Square.get_type_msg
+    discover = sqr.Square.discover
+    __str__ = sqr.Square.__str__
@@ -0,0 +1,105 @@
+import array
+import collections
+
+# Nearest-piece distance field of the board.
+# For every square it holds the Manhattan distance to the closest piece lying on the board,
+#   so looking it up is O(1). Adding or removing a piece only touches the squares whose distance changes.
+
+
+# Stored for squares with no piece in reach (the board has no pieces)
+INF = 2 ** 31 - 1
+
+
+class DistanceField:
+
+    def __init__(self, width: int, height: int):
+        self.width = width
+        self.height = height
+
+        # Flat, row-major (index = y * width + x), same as Board.content
+        self.dist = array.array('i', [INF]) * (width * height)
+        self.pieces = set()
+
+    # Returns distance from x,y to the closest piece, None if there are no pieces
+    def get(self, x, y):
+        d = self.dist[y * self.width + x]
+        return None if d == INF else d
+
+    # Registers a piece at x,y
+    def add(self, x, y):
+        i = y * self.width + x
+        if i in self.pieces:
+            return
+        self.pieces.add(i)
+
+        # Flood outwards from the new piece, only through squares that are now closer to it
+        dist = self.dist
+        dist[i] = 0
+        queue = collections.deque([i])
+        while queue:
+            j = queue.popleft()
+            d = dist[j] + 1
+            for n in self._neighbours(j):
+                if d < dist[n]:
+                    dist[n] = d
+                    queue.append(n)
+
+    # Unregisters the piece at x,y
+    def remove(self, x, y):
+        i = y * self.width + x
+        if i not in self.pieces:
+            return
+        self.pieces.remove(i)
+
+        dist = self.dist
+        w = self.width
+
+        # Clear every square whose distance came from the removed piece,
+        #   those form a connected region around it
+        region = [i]
+        dist[i] = INF
+        k = 0
+        while k < len(region):
+            j = region[k]
+            k += 1
+            for n in self._neighbours(j):
+                if dist[n] == abs(n % w - x) + abs(n // w - y):
+                    dist[n] = INF
+                    region.append(n)
+
+        # Refill the region from its border, smallest distances first
+        buckets = collections.defaultdict(list)
+        for j in region:
+            best = min(dist[n] for n in self._neighbours(j)) + 1
+            if best < dist[j]:
+                dist[j] = best
+                buckets[best].append(j)
+
+        if not buckets:
+            return
+
+        d = min(buckets)
+        last = max(buckets)
+        while d <= last:
+            for j in buckets.pop(d, ()):
+                if dist[j] != d:
+                    continue
+                for n in self._neighbours(j):
+                    if d + 1 < dist[n]:
+                        dist[n] = d + 1
+                        buckets[d + 1].append(n)
+                        last = max(last, d + 1)
+            d += 1
+
+    # Flat indices of the squares next to square i
+    def _neighbours(self, i):
+        w = self.width
+        x = i % w
+        if x > 0:
+            yield i - 1
+        if x < w - 1:
+            yield i + 1
+        if i >= w:
+            yield i - w
+        if i + w < len(self.dist):
+            yield i + w
@@ -1,20 +1,28 @@
 import asyncio
-import multipledispatch as md
+import itertools
 import threading
 import random as rand
 import time
 import uuid
-import pubsub as ps
 
 import common.settings as s
 import common.messages as m
 import common.delay as d
+import common.clock as c
+import common.routing as rt
 import common.logger as l
+import common.journal as j
+import common.checkpoint as ck
+import common.metrics as mt
 
 import gm as g
 
 # Abstraction class on top of GM, handles concurrency, logging, knowledge exchange and communication with the outside world
 
+# Seconds between two measures of the lag of the gm's own event loop
+LAG_INTERVAL = 0.5
+
+
 # Additional function used to start the event loop
 def start_worker(loop):
     asyncio.set_event_loop(loop)
@@ -23,37 +31,117 @@ def start_worker(loop):
 
 class GmExternal:
 
-    # Initializes the class and sets up the necessary pub/sub communication
-
-    def __init__(self, server_callback, gui_callback):
-        # Subscribe callbacks to the relavant topics
-        ps.pub.subscribe(server_callback, 'server')
-        ps.pub.subscribe(gui_callback, 'gui')
-
+    # Initializes the class and subscribes to the events of its gm
+
+    # seed: of the gm's random generator, picked by the gm if None
+    # journal: path of the journal to record the game in (see common/journal.py), None to not record it
+    # checkpoint: path to write checkpoints of the game to every checkpoint_interval seconds (see common/checkpoint.py),
+    #   game_id is the id the server knows the game by, kept in the checkpoints
+    # resume: checkpoint (as loaded by checkpoint.load) to continue the game from, its seed and settings are used,
+    #   or the state of a game frozen by another gm (see freeze) whose pending actions are continued
+    # tracer: common.tracing.Tracer the stages of traced messages are recorded with, None to not trace
+    # log_dir: directory of the game's log, common/logs by default
+    def __init__(self, server_callback, gui_callback=None, clock=None, seed=None, journal=None, settings=None,
+                 checkpoint=None, checkpoint_interval=5.0, game_id=None, resume=None, tracer=None, log_dir=None):
         # Init settings
-        settings = s.Settings()
-
-        # Init gm
-        self.gm = g.GM(settings)
+        if settings is None:
+            settings = s.Settings()
+        if resume is not None:
+            settings.update(resume['settings'])
+            seed = resume['seed']
+
+        # Init gm, its event bus is not shared with other gms in the same process
+        self.gm = g.GM(settings, seed)
         self.wait_time = settings.new_piece_freq
 
-        # Init logger
-        self.logger = l.Logger(settings.game_name)
+        # Trace of the message being handled, copied onto the messages the gm sends meanwhile, before they are sent
+        self.tracer = tracer
+        self.trace = None
+        if tracer is not None:
+            self.gm.bus.subscribe('server', self._tag_trace)
 
-        # Sets up executing gm tasks in separate thread asynchronously
-        self.worker_loop = asyncio.new_event_loop()
-        self.worker = threading.Thread(
-            target=start_worker, args=(self.worker_loop,))
-        self.worker.daemon = True
-        self.worker.start()
+        # Subscribe callbacks to the relavant topics, gui is optional (board snapshots are skipped without it)
+        self.gm.bus.subscribe('server', server_callback)
+        if gui_callback is not None:
+            self.gm.bus.subscribe('gui', gui_callback)
+
+        # Init logger
+        self.logger = l.Logger(settings.game_name, log_dir)
+
+        self.journal = None
+        if journal is not None:
+            self.journal = j.Journal(journal, self.gm.seed, settings)
+            self.gm.bus.subscribe('server', self.journal.sent)
+
+        # Sets up executing gm tasks in separate thread asynchronously,
+        #   unless given a clock (shared event loop, or virtual time) which is then run by its owner
+        if clock is None:
+            self.worker_loop = asyncio.new_event_loop()
+            self.worker = threading.Thread(
+                target=start_worker, args=(self.worker_loop,))
+            self.worker.daemon = True
+            self.worker.start()
+            self.clock = c.LoopClock(self.worker_loop)
+        else:
+            self.worker = None
+            self.clock = clock
 
         # Storages for handling knowledge exchange requests
         self.exchange_storage = []
         self.disabled_exchanges = []
 
+        # Actions waiting for their delay, key -> (due time, message, clock handle), in scheduling order
+        self.pending = {}
+        self._action_keys = itertools.count()
+        # Timer of the next new piece, and its due time
+        self.piece_call = None
+        self.piece_due = None
+        self.checkpoint_call = None
+        # Set once the game is handed to another gm, nothing is played here anymore
+        self.frozen = False
+
+        # Latencies of the actions and message counts (see common/metrics.py)
+        self.metrics = mt.Metrics()
+        self.gm.bus.subscribe('server', self.metrics.sent_message)
+        self.lag_call = None
+        if self.worker is not None:
+            self.clock.call_soon(self._probe_lag, self.clock.time())
+
+        # Handlers of the messages sent to the gm: (delay, handler), handlers with no delay are called right away
+        self.routes = rt.table({
+            m.JoinGame:                   (0, self.gm.join_game),
+            m.Move:                       (d.Delay.MOVE, self.gm.move_player),
+            m.Discover:                   (d.Delay.DISCOVER, self.gm.discover),
+            m.TestPiece:                  (d.Delay.TEST, self.gm.test_piece),
+            m.PickUp:                     (d.Delay.PICKUP, self.gm.player_pick_up),
+            m.PlacePiece:                 (d.Delay.PLACE, self.gm.place_piece),
+            m.DestroyPiece:               (d.Delay.DESTROY, self.gm.destroy_piece),
+            # Knowledge exchange
+            m.AuthorizeKnowledgeExchange: (None, self.register_exchange),
+            m.KnowledgeExchangeData:      (None, self.store_knowledge_data),
+            m.RejectKnowledgeExchange:    (None, self.reject_exchange),
+            m.AcceptKnowledgeExchange:    (d.Delay.KNOWLEDGE, self.pass_exchange_data),
+        })
+
         # Subscribe to relevant messages
-        ps.pub.subscribe(self.end_game, 'end_internal')
-        ps.pub.subscribe(self.start_pieces, 'start-pieces')
+        self.gm.bus.subscribe('end_internal', self.end_game)
+        self.gm.bus.subscribe('start-pieces', self.start_pieces)
+
+        if resume is not None:
+            ck.restore(self, resume)
+            if 'pending' in resume:
+                # Moved from another gm while running, its players go on without joining again
+                self.clock.call_soon(self._adopt, resume['pending'], resume['piece_in'])
+            elif self.gm.started():
+                # The timer of the new pieces is started again, the players are told to continue when they join again
+                self.clock.call_soon(self.start_pieces)
+
+        self.game_id = game_id
+        self.checkpoint_interval = checkpoint_interval
+        self.checkpoints = None
+        if checkpoint is not None:
+            self.checkpoints = ck.Writer(checkpoint)
+            self.clock.call_soon(self._checkpoint)
 
     # Knowledge exchange functions
 
@@ -93,7 +181,7 @@ class GmExternal:
 
     # Pass directly to server without passing to internal gm
     def relay_exchange(self, msg):
-        ps.pub.sendMessage('server', arg1=msg)
+        self.gm.bus.publish('server', msg)
 
     def store_knowledge_data(self, msg: m.KnowledgeExchangeData):
         # Find correct register
@@ -119,6 +207,10 @@ class GmExternal:
                     "to": r['to']
                 })
 
+    def reject_exchange(self, msg: m.RejectKnowledgeExchange):
+        self.deregister_exchange(msg)
+        self.relay_exchange(msg)
+
     def pass_exchange_data(self, msg: m.AcceptKnowledgeExchange):
 
         # Locate which exchange to pass
@@ -139,17 +231,107 @@ class GmExternal:
                 self.exchange_storage.remove(r)
                 return
 
-    # Starts adding pieces based on the frequency in settings
-    def start_pieces(self):
-        self.worker_loop.call_later(self.wait_time, self._start_pieces)
+    # Starts adding pieces based on the frequency in settings, the first one after delay if given
+    def start_pieces(self, delay=None):
+        if delay is None:
+            delay = self.wait_time
+        self.piece_due = self.clock.time() + delay
+        self.piece_call = self.clock.call_later(delay, self._start_pieces)
 
     def _start_pieces(self):
+        # The clock may outlive the game when shared with other games
+        if self.gm.game_over or self.frozen:
+            return
+        if self.journal is not None:
+            self.journal.piece(self.clock.time())
         self.gm.add_new_piece()
         self.start_pieces()
 
-    # Stops worker thread and saves log
+    # Captures the state of the game, it is written by the checkpoint writer's thread
+    def _checkpoint(self):
+        if self.gm.game_over:
+            return
+        self.checkpoints.submit(ck.snapshot(self, self.game_id, self.clock.time()))
+        self.checkpoint_call = self.clock.call_later(self.checkpoint_interval, self._checkpoint)
+
+    # Stops the game between two actions and returns its state, for another gm to continue it (resume=state).
+    # Actions waiting for their delay are not run here but kept in the state with the time they have left.
+    #   To be called on the gm's thread, after the messages received so far
+    def freeze(self):
+        now = self.clock.time()
+        self.frozen = True
+        pending = []
+        for due, msg, handle in self.pending.values():
+            handle.cancel()
+            pending.append([max(0.0, due - now), msg.to_json()])
+        self.pending = {}
+
+        piece_in = None
+        if self.piece_call is not None:
+            self.piece_call.cancel()
+            piece_in = max(0.0, self.piece_due - now)
+        if self.checkpoint_call is not None:
+            self.checkpoint_call.cancel()
+        if self.lag_call is not None:
+            self.lag_call.cancel()
+
+        state = ck.snapshot(self, self.game_id, now, pending, piece_in)
+        # The frozen state is the last checkpoint, until the game runs elsewhere (see end_freeze)
+        if self.checkpoints is not None:
+            self.checkpoints.submit(state)
+        if self.journal is not None:
+            self.journal.close()
+        # The log is saved once the state is handed over, waiting for the log writer would lengthen the pause
+        self.clock.call_soon(self._close_frozen)
+        return ck.pack(state)
+
+    # Called once the frozen game runs on another gm (adopted), its checkpoint here would fork the game if resumed,
+    #   or once no gm could take it, the checkpoint is kept to resume the game from
+    def end_freeze(self, adopted):
+        if self.checkpoints is not None:
+            self.checkpoints.close(remove=adopted)
+            self.checkpoints.thread.join()
+
+    def _close_frozen(self):
+        self.logger.save_log()
+        if self.worker is not None:
+            self.clock.stop()
+
+    # Continues the actions and the new pieces of a game frozen by another gm
+    def _adopt(self, pending, piece_in):
+        if piece_in is not None:
+            self.start_pieces(piece_in)
+        for delay, line in pending:
+            msg, err = m.Message.from_json_gm(line)
+            if err is not None:
+                print(f'> gm: Could not continue action \n \"{err}\"')
+                continue
+            self._schedule(delay, self.routes[msg.route][1], msg)
+
+    # Measures how late the event loop runs a timer, and samples the message counts
+    def _probe_lag(self, expected):
+        now = self.clock.time()
+        self.metrics.loop_lag.record(now - expected)
+        self.metrics.tick(now)
+        if not self.gm.game_over and not self.frozen:
+            self.lag_call = self.clock.call_later(LAG_INTERVAL, self._probe_lag, now + LAG_INTERVAL)
+
+    # Metrics of the game in the Prometheus text format, and as a stats dump
+    def metrics_text(self, labels=''):
+        return self.metrics.render(len(self.pending), labels)
+
+    def metrics_summary(self):
+        return self.metrics.summary(len(self.pending))
+
+    # Stops worker thread (if it is our own) and saves log
     def end_game(self, msg):
-        self.worker_loop.stop()
+        if self.journal is not None:
+            self.journal.end(self.clock.time(), msg)
+        if self.checkpoints is not None:
+            # A game that is over has nothing to resume
+            self.checkpoints.close(remove=True)
+        if self.worker is not None:
+            self.clock.stop()
         self.logger.save_log()
 
     # Wrapper for _send_message(), calls the _send_message() function in worker thread and logs message
@@ -157,58 +339,72 @@ class GmExternal:
         # Log message
         player = self.gm.get_player(msg.id)
         self.logger.log(msg, player)
+        if self.journal is not None:
+            self.journal.message(self.clock.time(), msg)
 
         # Add sending message to the worker thread's event loop
-        self.worker_loop.call_soon_threadsafe(self._send_message, msg)
-
-    # This is python's closest equivalent to method overloading :(
-
-    @md.dispatch(m.JoinGame)
-    def _send_message(self, msg):
-        self.worker_loop.call_later(0, self.gm.join_game, msg)
-
-    @md.dispatch(m.Move)
-    def _send_message(self, msg):
-        self.worker_loop.call_later(d.Delay.MOVE, self.gm.move_player, msg)
-
-    @md.dispatch(m.Discover)
-    def _send_message(self, msg):
-        self.worker_loop.call_later(d.Delay.DISCOVER, self.gm.discover, msg)
-
-    @md.dispatch(m.TestPiece)
-    def _send_message(self, msg):
-        self.worker_loop.call_later(d.Delay.TEST, self.gm.test_piece, msg)
-
-    @md.dispatch(m.PickUp)
-    def _send_message(self, msg):
-        self.worker_loop.call_later(
-            d.Delay.PICKUP, self.gm.player_pick_up, msg)
-
-    @md.dispatch(m.PlacePiece)
-    def _send_message(self, msg):
-        self.worker_loop.call_later(d.Delay.PLACE, self.gm.place_piece, msg)
-
-    @md.dispatch(m.DestroyPiece)
-    def _send_message(self, msg):
-        self.worker_loop.call_later(
-            d.Delay.DESTROY, self.gm.destroy_piece, msg)
-
-    # Knowledge exchange
-
-    @md.dispatch(m.AuthorizeKnowledgeExchange)
-    def _send_message(self, msg):
-        self.register_exchange(msg)
-
-    @md.dispatch(m.KnowledgeExchangeData)
-    def _send_message(self, msg):
-        self.store_knowledge_data(msg)
-
-    @md.dispatch(m.RejectKnowledgeExchange)
-    def _send_message(self, msg):
-        self.deregister_exchange(msg)
-        self.relay_exchange(msg)
-
-    @md.dispatch(m.AcceptKnowledgeExchange)
-    def _send_message(self, msg):
-        self.worker_loop.call_later(
-            d.Delay.KNOWLEDGE, self.pass_exchange_data, msg)
+        self.metrics.received += 1
+        self.clock.call_soon(self._send_message, msg, time.perf_counter())
+
+    # Passes the message to its handler, looked up by route, received is when send_message got it
+    def _send_message(self, msg, received=None):
+        stats = self.metrics.action(type(msg))
+        if received is not None:
+            stats.queue.record(time.perf_counter() - received)
+        if self.frozen:
+            print(f'> gm: game moved to another gm, dropped {type(msg).__name__}')
+            return
+        route = self.routes.get(msg.route)
+        if route is None:
+            print(f'> gm: no handler for message {type(msg).__name__}')
+            return
+        delay, handler = route
+        if self.tracer is not None and msg.traceId is not None:
+            self._trace_queue(msg, received)
+        if delay is None:
+            start = time.perf_counter()
+            self.trace = msg.traceId
+            handler(msg)
+            self.trace = None
+            end = time.perf_counter()
+            stats.run.record(end - start)
+            if self.tracer is not None and msg.traceId is not None:
+                self._trace_run(msg, start, end)
+        else:
+            self._schedule(delay, handler, msg)
+
+    # Runs an action after its delay, kept in pending until then so a frozen game can hand it over
+    def _schedule(self, delay, handler, msg):
+        key = next(self._action_keys)
+        handle = self.clock.call_later(delay, self._run_action, key, handler, msg)
+        self.pending[key] = (self.clock.time() + delay, msg, handle)
+
+    def _run_action(self, key, handler, msg):
+        due = self.pending.pop(key)[0]
+        stats = self.metrics.action(type(msg))
+        late = self.clock.time() - due
+        stats.drift.record(late)
+        start = time.perf_counter()
+        self.trace = msg.traceId
+        handler(msg)
+        self.trace = None
+        end = time.perf_counter()
+        stats.run.record(end - start)
+        if self.tracer is not None and msg.traceId is not None:
+            delay = self.routes[msg.route][0]
+            self.tracer.span(msg.traceId, 'gm delay', start - late - delay, start, 'gm', self.game_id,
+                             delay=delay, late=round(late, 6))
+            self._trace_run(msg, start, end)
+
+    # Spans of a traced message (see common/tracing.py), on the gm's thread
+    def _trace_queue(self, msg, received):
+        if received is not None:
+            self.tracer.span(msg.traceId, 'gm queue', received, time.perf_counter(), 'gm', self.game_id)
+
+    def _trace_run(self, msg, start, end):
+        self.tracer.span(msg.traceId, 'gm run', start, end, 'gm', self.game_id, action=type(msg).__name__)
+
+    # Subscribed to the messages the gm sends, before they are sent
+    def _tag_trace(self, msg):
+        if self.trace is not None and msg.traceId is None:
+            msg.traceId = self.trace
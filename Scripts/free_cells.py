@@ -0,0 +1,75 @@
+import random
+
+# Allocator of free cells within a range of flat board indices (e.g. the task area).
+# Only the taken cells are stored while the range is mostly free, a random free cell is then found
+#   in a couple of tries on average. Once more than half of the range is taken, an explicit list of the
+#   free cells is kept instead (swap-remove), so picking one stays O(1) however full the range gets.
+
+
+class FreeCells:
+
+    def __init__(self, start: int, stop: int):
+        self.start = start
+        self.stop = stop
+        self.size = stop - start
+
+        self.taken = set()
+
+        # Explicit free list and index of each cell in it, only kept while the range is crowded
+        self._free = None
+        self._free_pos = None
+
+    def __len__(self):
+        return self.size - len(self.taken)
+
+    def __contains__(self, i):
+        return self.start <= i < self.stop and i not in self.taken
+
+    # Marks cell i as taken, ignores cells outside of the range
+    def take(self, i):
+        if not self.start <= i < self.stop or i in self.taken:
+            return
+        self.taken.add(i)
+
+        if self._free is not None:
+            self._swap_remove(i)
+        elif len(self.taken) * 2 > self.size:
+            self._build_free_list()
+
+    # Marks cell i as free again, ignores cells outside of the range
+    def release(self, i):
+        if i not in self.taken:
+            return
+        self.taken.remove(i)
+
+        if self._free is not None:
+            if len(self.taken) * 4 < self.size:
+                self._free = None
+                self._free_pos = None
+            else:
+                self._free_pos[i] = len(self._free)
+                self._free.append(i)
+
+    # Returns a uniformly chosen free cell, None if there are none left
+    def choice(self, rng=random):
+        if len(self.taken) == self.size:
+            return None
+
+        if self._free is not None:
+            return self._free[rng.randrange(len(self._free))]
+
+        while True:
+            i = self.start + rng.randrange(self.size)
+            if i not in self.taken:
+                return i
+
+    def _build_free_list(self):
+        self._free = [i for i in range(self.start, self.stop) if i not in self.taken]
+        self._free_pos = {c: k for k, c in enumerate(self._free)}
+
+    def _swap_remove(self, i):
+        k = self._free_pos.pop(i)
+        last = self._free.pop()
+        if last != i:
+            self._free[k] = last
+            self._free_pos[last] = k
@@ -1,12 +1,11 @@
 import random as rand
-import pubsub.pub as pub
 import uuid
-import math
-import copy
 import time
 
 import common.settings as s
+import common.bus as bus
 import board as b
+import compact_board as cb
 import common.player as p
 import common.messages as m
 import common.square as sqr
@@ -18,9 +17,21 @@ import common.square as sqr
 
 class GM:
 
-    def __init__(self, settings: s.Settings):
-        self.id = uuid.uuid4()
-        self.board = b.Board(settings)
+    # Games with the same seed (and the same messages, see common/journal.py) play out the same,
+    #   a seed is picked if none is given
+    def __init__(self, settings: s.Settings, seed: int = None):
+        self.seed = seed if seed is not None else rand.getrandbits(64)
+        # All the randomness of the game is drawn from this generator
+        self.rng = rand.Random(self.seed)
+        self.id = b.random_uuid(self.rng)
+
+        # Events of this game only ('server', 'gui', 'start-pieces', 'end_internal'),
+        #   so that several games can run in one process
+        self.bus = bus.EventBus()
+        if settings.compact_board:
+            self.board = cb.CompactBoard(settings, self.rng)
+        else:
+            self.board = b.Board(settings, self.rng)
 
         # Select random goal areas to be goal fields
         self.board.random_select_fields()
@@ -34,14 +45,15 @@ class GM:
         self.blue_team = []
         self.players = {}
 
-    # shorthand of the full pub sending function
+    # shorthand of the bus publishing function
     # server refers to the external class communicating with gm (does not need to be an actual server)
     def send(self, msg: m.Message):
         # Send message to server
-        pub.sendMessage(topicName='server', arg1=msg)
+        self.bus.publish('server', msg)
 
-        # Send current board for visualization
-        pub.sendMessage('gui', arg1=copy.deepcopy(self.board) )
+        # Send current board for visualization, snapshots are only taken if someone is listening
+        if self.bus.has_listeners('gui'):
+            self.bus.publish('gui', self.board.snapshot())
 
     # Pick up action
     def player_pick_up(self, msg):
@@ -91,6 +103,14 @@ class GM:
 
         team_count = self.settings.player_count_per_team
 
+        # A player joining again, after its connection or the gm was lost, continues where it was
+        player = self.get_player(id)
+        if player is not None:
+            self.send(m.ConfirmJoiningGame(response='OK', type='player', id=id))
+            if self.started():
+                self.send_game_message(player)
+            return
+
         # Check if any spots are available
         if len(self.players) == team_count * 2:
             msg = m.ConfirmJoiningGame(response='denied', type='player', id=id)
@@ -106,37 +126,21 @@ class GM:
         else:
             team = 'blue' if blue_count < team_count else 'red'
 
-        player = p.GmPlayer(id=msg.id, team=team)
-
-        # Add to corresponding team
-        if team == 'red':
-            self.red_team.append(player)
-        else:
-            self.blue_team.append(player)
-
-        # Add to player dictionary
-        self.players[player.id] = player
-
         # Locate spot for player on task area
-        sq = rand.choice(self.board.task_area)
-        available = len(self.board.task_area) - len(self.players)
-        while available > 0:
-            if sq.player is None:
-                break
-            sq = rand.choice(self.board.task_area)
-            available -= 1
+        sq = self.board.random_free_player_square()
+        if sq is None:
+            msg = m.ConfirmJoiningGame(response='denied', type='player', id=id)
+            self.send(msg)
+            return
 
-        # Place player on square
-        player.x = sq.x
-        player.y = sq.y
-        sq.player = player
+        player = self.add_player(msg.id, team, sq.x, sq.y)
 
         # Send confirmation message
         msg = m.ConfirmJoiningGame(response='OK', type='player', id=player.id)
         self.send(msg)
 
         # Check if game is full
-        if len(self.red_team) == len(self.blue_team) and len(self.red_team) == team_count:
+        if self.started():
             # First to join are set as leaders
             self.red_team[0].is_leader = True
             self.blue_team[0].is_leader = True
@@ -144,25 +148,52 @@ class GM:
             # Send game start messages
             self.send_game_messages()
 
+    # Adds a player to its team and places it on the board at x,y
+    def add_player(self, id, team, x, y):
+        player = p.GmPlayer(id=id, team=team)
+
+        # Add to corresponding team
+        if team == 'red':
+            self.red_team.append(player)
+        else:
+            self.blue_team.append(player)
+
+        # Add to player dictionary
+        self.players[player.id] = player
+
+        # Place player on square
+        player.x = x
+        player.y = y
+        self.board.get_square(x, y).player = player
+        return player
+
+    # Whether both teams are full, the game starts then
+    def started(self):
+        team_count = self.settings.player_count_per_team
+        return len(self.red_team) == len(self.blue_team) and len(self.red_team) == team_count
+
     # Sends game start msg and info to each player
     def send_game_messages(self):
 
         for plr in self.red_team + self.blue_team:
-            role = 'member' if not plr.is_leader else 'leader'
-            location = {"x": plr.x, "y": plr.y}
-            board = {
-                "width": self.board.board_width,
-                "tasksHeight": self.board.task_area_height,
-                "goalsHeight": self.board.goal_area_height
-            }
-            team = self.red_team if plr.team == 'red' else self.blue_team
-            team_guids = [p.id for p in team]
-            msg = m.GameMessage(
-                id = plr.id, team = plr.team, role = role, team_size = self.settings.player_count_per_team, team_guids = team_guids, location = location, board = board)
-            self.send(msg)
+            self.send_game_message(plr)
 
         # Start adding pieces
-        pub.sendMessage(topicName='start-pieces')
+        self.bus.publish('start-pieces')
+
+    def send_game_message(self, plr):
+        role = 'member' if not plr.is_leader else 'leader'
+        location = {"x": plr.x, "y": plr.y}
+        board = {
+            "width": self.board.board_width,
+            "tasksHeight": self.board.task_area_height,
+            "goalsHeight": self.board.goal_area_height
+        }
+        team = self.red_team if plr.team == 'red' else self.blue_team
+        team_guids = [p.id for p in team]
+        msg = m.GameMessage(
+            id = plr.id, team = plr.team, role = role, team_size = self.settings.player_count_per_team, team_guids = team_guids, location = location, board = board)
+        self.send(msg)
 
     # Return player based on given id, None if not found
     def get_player(self, player_id: uuid.uuid4()):
@@ -211,48 +242,15 @@ class GM:
             return 0
 
         # If in the goal area send null (None in python)
-        if self._in_goal_area(square.type):
-            return None
-
-        closest = math.inf
-        x1 = square.x
-        y1 = square.y
-        for sq in self.board.content:
-            if sq.piece is not None:
-                d = self._dist(x1, sq.x, y1, sq.y)
-                closest = d if d < closest else closest
-
-        # Can happen if the board has no pieces
-        if closest == math.inf:
+        if self.board.in_goal_area(square.x, square.y):
             return None
-        return closest
-
-    # Helper function, hides away a long if statement
-    def _in_goal_area(self, sq_type: sqr.SquareType):
-        a = sq_type == sqr.SquareType.RedGoalArea
-        b = sq_type == sqr.SquareType.RedGoalField
-        c = sq_type == sqr.SquareType.BlueGoalArea
-        d = sq_type == sqr.SquareType.BlueGoalField
-        return a or b or c or d
 
-    # Calculates Manhattan distance between two points
-    def _dist(self, x1, x2, y1, y2):
-        return abs(x1 - x2) + abs(y1 - y2)
+        # Looked up in the board's distance field instead of scanning the whole board
+        return self.board.piece_distance(square.x, square.y)
 
     # Checks if a move is allowed
     def can_move(self, x: int, y: int, team: str) -> bool:
-        sq = self.board.get_square(x, y)
-
-        if sq is None:
-            return False
-        elif sq.player is not None:
-            return False
-        elif (sq.type == sqr.SquareType.BlueGoalField or sq.type == sqr.SquareType.BlueGoalArea) and team == 'red':
-            return False
-        elif (sq.type == sqr.SquareType.RedGoalArea or sq.type == sqr.SquareType.RedGoalField) and team == 'blue':
-            return False
-        else:
-            return True
+        return self.board.can_move(x, y, team)
 
     def discover(self, msg):
         player = self.get_player(msg.id)
@@ -395,6 +393,8 @@ class GM:
         # Holding a piecce
         else:
             pl.piece = None
+            # The square looks different without the held piece
+            self.board.mark_dirty(pl.x, pl.y)
             msg = m.DestroyPieceData(id=pl.id, result="OK")
             self.send(msg)
             return
@@ -412,4 +412,4 @@ class GM:
 
         # Stop game
         self.game_over = True
-        pub.sendMessage('end_internal', msg=winning_team)
+        self.bus.publish('end_internal', winning_team)
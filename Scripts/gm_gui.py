@@ -2,7 +2,12 @@ import tkinter as tk
 import json
 from twisted.internet import tksupport, reactor
 from twisted.internet.protocol import Protocol, ClientFactory
-from sys import stdout
+from sys import stdout, argv
+
+import common.binary as b
+import common.framing as framing
+# Registers the binary codes of the messages
+import common.messages
 
 # Colors for the gui
 colors = {
@@ -31,9 +36,33 @@ tksupport.install(root)
 
 buttons = []
 
+# Width of the board, known after the first keyframe
+width = None
+
 
+# Dispatches a gui frame, either a whole board (keyframe) or only the changed cells (delta)
 def show(msg):
-    board = msg['board']
+    # Spectators also get the game over
+    if msg.get('action') != 'gui':
+        return
+    if 'cells' in msg:
+        show_delta(msg['cells'])
+    else:
+        show_board(msg['board'])
+
+
+def show_delta(cells):
+    # Can't apply changes before having seen the board
+    if width is None:
+        return
+
+    for x, y, t in cells:
+        buttons[y * width + x].config(text=t, bg=colors[t])
+
+
+def show_board(board):
+    global width
+    width = len(board[0]) if board else 0
 
     r = 0
     i = 0
@@ -55,16 +84,25 @@ def show(msg):
                 
 
 class Echo(Protocol):
+    def __init__(self):
+        self.frames = framing.FrameDecoder(max_frame, length_prefixed)
+
     def connectionMade(self):
         # Send game start message to server
         print('Sending connection message to server')
-        self.transport.write(b'gui')
+        handshake = ['gui'] + (['binary'] if binary else []) + ([game] if game else [])
+        self.transport.write(framing.encode(' '.join(handshake).encode(), length_prefixed))
 
     def dataReceived(self, data):
         # print("Got data.")
-        for d in data.split(b'\x17'):
-            if d != b'':
-                show( json.loads(d) )
+        try:
+            frames = self.frames.feed(data)
+        except ValueError as err:
+            print(f'{err}, closing the connection (see --max-frame)')
+            self.transport.loseConnection()
+            return
+        for d in frames:
+            show( b.decode_dict(b.unstuff(d)) if b.is_binary(d) else json.loads(d) )
 
 
 class EchoClientFactory(ClientFactory):
@@ -86,6 +124,14 @@ class EchoClientFactory(ClientFactory):
 
 host = 'localhost'
 port = 9997
+# Ask the server for binary gui frames, smaller than json for whole boards
+binary = '--binary' in argv[1:]
+# Game to watch, every game if not given
+game = next((a for a in argv[1:] if not a.startswith('--')), None)
+# Largest frame taken from the server, in bytes (--max-frame=<bytes>), keyframes of large boards may need more
+max_frame = next((int(a.partition('=')[2]) for a in argv[1:] if a.startswith('--max-frame=')), framing.MAX_LENGTH)
+# Frames prefixed with their length instead of delimited (--length-prefixed)
+length_prefixed = '--length-prefixed' in argv[1:]
 
 reactor.connectTCP(host, port, EchoClientFactory())
 reactor.run()
\ No newline at end of file
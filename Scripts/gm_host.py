@@ -0,0 +1,381 @@
+from twisted.internet import task, reactor
+from twisted.internet.defer import Deferred
+from twisted.internet.protocol import ClientFactory, Protocol
+import argparse
+import asyncio
+import base64
+import json
+import multiprocessing
+import threading
+
+import external as ext
+import common.checkpoint as ck
+import common.messages as m
+import common.settings as s
+import common.clock as c
+import common.framing as framing
+import common.routing as rt
+
+# Hosts many games over a single connection to the server.
+# The games run in a pool of worker processes, each of them holding many GmExternal instances on one
+#   shared event loop. The host process only routes lines between the server and the workers,
+#   and places every new game on the worker with the fewest running games.
+# Running games can be moved between hosts (see migrate_game in server/server.py): a host with room for games
+#   of others (--adopt) runs them next to its own, a host being drained (--drain-after) hands all of its games over.
+
+
+# ======== Worker process ========
+
+def worker_main(inbox, outbox):
+    """ Runs the games placed on this worker, inbox gets ('new', game_id), ('msg', game_id, line),
+        ('freeze', game_id), ('adopt', game_id, state) and ('drop', game_id) """
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    clock = c.LoopClock(loop)
+    games = {}
+
+    def server_callback(game_id):
+        # Tags the messages of a game with its id, so the server knows which game they are about
+        def callback(arg1):
+            arg1.gameId = game_id
+            outbox.put(('msg', game_id, arg1.to_json()))
+            if type(arg1) is m.GameOver:
+                games.pop(game_id, None)
+                outbox.put(('done', game_id))
+        return callback
+
+    def dispatch(item):
+        if item[0] == 'new':
+            game_id = item[1]
+            games[game_id] = ext.GmExternal(server_callback(game_id), clock=clock)
+        elif item[0] == 'msg':
+            _, game_id, line = item
+            game = games.get(game_id)
+            if game is None:
+                return
+            msg, err = m.Message.from_json_gm(line)
+            if err is not None:
+                print(f'> gm host worker: Could not translate line \n \"{err}\"')
+                return
+            game.send_message(msg)
+        elif item[0] == 'freeze':
+            game = games.pop(item[1], None)
+            if game is not None:
+                outbox.put(('state', item[1], game.freeze()))
+        elif item[0] == 'drop':
+            # Stopped, the game goes on elsewhere
+            game = games.pop(item[1], None)
+            if game is not None:
+                game.freeze()
+        elif item[0] == 'adopt':
+            _, game_id, state = item
+            try:
+                state = ck.loads(base64.b64decode(state))
+            except ValueError as err:
+                print(f'> gm host worker: Could not adopt game {game_id}: {err}')
+                outbox.put(('denied', game_id))
+                return
+            games[game_id] = ext.GmExternal(server_callback(game_id), clock=clock, game_id=game_id, resume=state)
+            outbox.put(('adopted', game_id, [player[0] for player in state['players']]))
+        elif item[0] == 'stop':
+            loop.stop()
+
+    def read_inbox():
+        while True:
+            item = inbox.get()
+            loop.call_soon_threadsafe(dispatch, item)
+            if item[0] == 'stop':
+                return
+
+    reader = threading.Thread(target=read_inbox, daemon=True)
+    reader.start()
+    loop.run_forever()
+
+
+class Worker:
+    """ Host side handle of a worker process """
+
+    def __init__(self, outbox):
+        self.inbox = multiprocessing.Queue()
+        self.process = multiprocessing.Process(target=worker_main, args=(self.inbox, outbox), daemon=True)
+        self.process.start()
+        self.games = set()
+
+    def stop(self):
+        self.inbox.put(('stop',))
+
+
+# ======== Host process ========
+
+class GmHost(Protocol):
+
+    def __init__(self, factory):
+        self.factory = factory
+        self.frames = framing.FrameDecoder(factory.max_frame, factory.length_prefixed)
+        self.writer = None
+
+        # game id -> Worker, and player guid -> game id
+        self.games = {}
+        self.players = {}
+
+        self.reader = threading.Thread(target=self.read_outbox, daemon=True)
+
+    def connectionMade(self):
+        # Lines from all the games are batched into one write per reactor iteration
+        self.writer = framing.FrameWriter(self.transport, self.factory.clock.callLater,
+                                          length_prefixed=self.factory.length_prefixed)
+        self.reader.start()
+        if self.factory.adopt > 0:
+            self.write_line(m.Standby(capacity=self.factory.game_count + self.factory.adopt).to_json())
+        # Register the first batch of games
+        for _ in range(self.factory.game_count):
+            self.request_game()
+        if self.factory.drain_after is not None:
+            self.factory.clock.callLater(self.factory.drain_after, self.drain)
+
+    def request_game(self):
+        self.write_line(m.SetUpGame(slots=self.factory.slots).to_json())
+
+    def write_line(self, line):
+        self.writer.write(line.encode())
+
+    # Forwards what the workers send to the server, runs in its own thread until the connection is lost
+    def read_outbox(self):
+        while True:
+            item = self.factory.outbox.get()
+            if item[0] == 'stop':
+                return
+            reactor.callFromThread(self.handle_worker_item, item)
+
+    def handle_worker_item(self, item):
+        if item[0] == 'msg':
+            self.write_line(item[2])
+        elif item[0] == 'done':
+            self.end_game(item[1])
+        elif item[0] == 'state':
+            self.send_state(item[1], item[2])
+        elif item[0] == 'adopted':
+            self.adopted(item[1], item[2])
+        elif item[0] == 'denied':
+            self.forget_game(item[1])
+            self.write_line(self.with_game(m.ConfirmAdoptGame(result='denied'), item[1]).to_json())
+
+    def with_game(self, msg, game_id):
+        msg.gameId = game_id
+        return msg
+
+    def forget_game(self, game_id):
+        worker = self.games.pop(game_id, None)
+        if worker is None:
+            return False
+        worker.games.discard(game_id)
+        self.players = {guid: gid for guid, gid in self.players.items() if gid != game_id}
+        return True
+
+    def end_game(self, game_id):
+        if not self.forget_game(game_id):
+            return
+        print(f'> gm host: Game {game_id} is over, {len(self.games)} running')
+        self.replace_game()
+
+    # Keep the host busy
+    def replace_game(self):
+        if self.factory.draining:
+            if not self.games:
+                print('> gm host: Drained, shutting down')
+                self.writer.flush()
+                self.transport.loseConnection()
+            return
+        if len(self.games) < self.factory.game_count:
+            self.request_game()
+
+    # ======== Migration ========
+
+    # Moves all the games of the host to other gms, new games are not taken anymore
+    def drain(self):
+        print(f'> gm host: Draining {len(self.games)} games')
+        self.factory.draining = True
+        for game_id in self.games:
+            self.write_line(self.with_game(m.MigrateGame(), game_id).to_json())
+        self.replace_game()
+
+    def freeze(self, game_id):
+        worker = self.games.get(game_id)
+        if worker is None:
+            print(f'> gm host: No game {game_id} to freeze')
+            self.write_line(self.with_game(m.GameState(result='denied'), game_id).to_json())
+            return
+        worker.inbox.put(('freeze', game_id))
+
+    def send_state(self, game_id, state):
+        self.forget_game(game_id)
+        msg = self.with_game(m.GameState(result='OK', state=base64.b64encode(state).decode()), game_id)
+        self.write_line(msg.to_json())
+        print(f'> gm host: Game {game_id} moved away ({len(state)} bytes), {len(self.games)} running')
+        self.replace_game()
+
+    def adopt(self, game_id, state):
+        worker = min(self.factory.workers, key=lambda w: len(w.games))
+        worker.games.add(game_id)
+        self.games[game_id] = worker
+        worker.inbox.put(('adopt', game_id, state))
+
+    def adopted(self, game_id, guids):
+        for guid in guids:
+            self.players[guid] = game_id
+        self.write_line(self.with_game(m.ConfirmAdoptGame(result='OK'), game_id).to_json())
+        print(f'> gm host: Adopted game {game_id}, {len(self.games)} running')
+
+    # The games of the host keep no checkpoint, nothing is left of a game it froze. A game it adopted after the server
+    #   gave up on it goes on elsewhere
+    def drop(self, game_id, result):
+        worker = self.games.get(game_id)
+        if worker is None or result != 'OK':
+            return
+        self.forget_game(game_id)
+        worker.inbox.put(('drop', game_id))
+        print(f'> gm host: Game {game_id} runs on another gm, dropped, {len(self.games)} running')
+        self.replace_game()
+
+    def start_game(self, game_id):
+        # Place on the least loaded worker
+        worker = min(self.factory.workers, key=lambda w: len(w.games))
+        worker.games.add(game_id)
+        self.games[game_id] = worker
+        worker.inbox.put(('new', game_id))
+        print(f'> gm host: Started game {game_id}, {len(self.games)} running')
+
+    def dataReceived(self, data):
+        try:
+            lines = self.frames.feed(data)
+        except ValueError as err:
+            print(f'> gm host: {err}, closing the connection')
+            self.writer.flush()
+            self.transport.loseConnection()
+            return
+        for line in lines:
+            self.lineReceived(line)
+
+    def lineReceived(self, line):
+        # A malformed line is skipped, the other games of the host go on
+        try:
+            parsed_json = json.loads(line)
+        except ValueError as err:
+            print(f'> gm host: Could not translate line \n \"{err}\"')
+            return
+        if type(parsed_json) is not dict:
+            print(f'> gm host: Not a message \"{line}\"')
+            return
+        route = rt.route_of(parsed_json)
+
+        # Reply to a game registration
+        if route == m.ConfirmSetUpGame.route:
+            if parsed_json.get('result') != 'OK':
+                print('> gm host: Could not start game')
+                return
+            self.start_game(parsed_json['gameId'])
+            return
+        if route == m.MigrateGame.route:
+            self.freeze(parsed_json['gameId'])
+            return
+        if route == m.AdoptGame.route:
+            self.adopt(parsed_json['gameId'], parsed_json['state'])
+            return
+        if route == m.CancelMigration.route:
+            # The freeze is queued on the worker already, the server takes the state when it comes
+            print(f'> gm host: Game {parsed_json["gameId"]} is being frozen, not kept')
+            return
+        if route == m.ConfirmAdoptGame.route:
+            self.drop(parsed_json['gameId'], parsed_json['result'])
+            return
+
+        # Joins carry the game id, everything else is routed by player
+        guid = parsed_json.get('userGuid')
+        game_id = parsed_json.get('gameId')
+        if route == m.JoinGame.route and game_id is not None and guid is not None:
+            self.players[guid] = game_id
+        if game_id is None:
+            game_id = self.players.get(guid)
+
+        worker = self.games.get(game_id)
+        if worker is None:
+            print(f'> gm host: No game for \"{line}\"')
+            return
+        worker.inbox.put(('msg', game_id, line))
+
+    def connectionLost(self, reason):
+        self.writer.discard()
+        print(f'> gm host: Sent {self.writer.stats}')
+        self.factory.outbox.put(('stop',))
+        for worker in self.factory.workers:
+            worker.stop()
+
+
+class GmHostFactory(ClientFactory):
+
+    def __init__(self, worker_count, game_count, adopt=0, drain_after=None, max_frame=framing.MAX_LENGTH,
+                 length_prefixed=False, clock=reactor):
+        self.done = Deferred()
+        # Schedules the batched writes and the drain, the reactor or a task.Clock in the tests
+        self.clock = clock
+        # Largest frame taken from the server, in bytes
+        self.max_frame = max_frame
+        # Frames prefixed with their length instead of delimited (see common/framing.py)
+        self.length_prefixed = length_prefixed
+        self.game_count = game_count
+        # Games moved from other gms the host takes on top of its own
+        self.adopt = adopt
+        # Seconds after which all games are moved to other gms, None to keep them
+        self.drain_after = drain_after
+        self.draining = False
+
+        settings = s.Settings()
+        self.slots = settings.player_count_per_team * 2
+
+        self.outbox = multiprocessing.Queue()
+        self.workers = [Worker(self.outbox) for _ in range(worker_count)]
+
+    def buildProtocol(self, addr):
+        return GmHost(self)
+
+    def clientConnectionFailed(self, connector, reason):
+        self.done.errback(reason)
+
+    def clientConnectionLost(self, connector, reason):
+        self.done.callback(None)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-a', '--address', help='IPv4/v6 address or host name', default='localhost')
+    parser.add_argument(
+        '-p', '--port', help='Server port number', type=int, default=9997)
+    parser.add_argument(
+        '-w', '--workers', help='Number of worker processes', type=int, default=multiprocessing.cpu_count())
+    parser.add_argument(
+        '-n', '--games', help='Number of games kept running (finished games are replaced)', type=int, default=10)
+    parser.add_argument(
+        '--adopt', help='Number of running games moved from other gms to take on top of --games', type=int, default=0)
+    parser.add_argument(
+        '--drain-after', help='Move all games to other gms after this many seconds, then shut down', type=float)
+    parser.add_argument(
+        '--max-frame', help='Largest frame taken from the server, in bytes', type=int, default=framing.MAX_LENGTH)
+    parser.add_argument(
+        '--length-prefixed', help='Prefix frames with their length instead of delimiting them', action='store_true')
+
+    args = parser.parse_args()
+
+    # Workers are started before the reactor runs
+    factory = GmHostFactory(args.workers, args.games, args.adopt, args.drain_after, args.max_frame,
+                            args.length_prefixed)
+
+    def run(reactor):
+        reactor.connectTCP(args.address, args.port, factory)
+        return factory.done
+
+    task.react(run)
+
+
+if __name__ == '__main__':
+    main()
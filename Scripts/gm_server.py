@@ -1,53 +1,171 @@
-from twisted.internet import task
+from twisted.internet import task, reactor
 from twisted.internet.defer import Deferred
-from twisted.internet.protocol import ClientFactory
-from twisted.protocols.basic import LineReceiver
+from twisted.internet.protocol import ClientFactory, Protocol
+from twisted.web import resource, server as web
 import argparse
 import asyncio
+import base64
+import collections
+import threading
+import time
 
 import external as ext
+import gui_stream as gs
+import common.binary as b
+import common.checkpoint as ck
+import common.framing as framing
 import common.messages as m
+import common.settings as s
+import common.tracing as tr
 
 
-class GM_Server(LineReceiver):
+class GM_Server(Protocol):
 
     def __init__(self):
         self.gm = None
+        # Game frozen for another gm, kept until the server says where it went (see freeze)
+        self.frozen = None
+        # Whether the gm's thread started freezing the game, or the server took the freeze request back
+        self.freeze_lock = threading.Lock()
+        self.freezing = False
+        self.freeze_cancelled = False
         self.gui = EchoClientFactory.gui
-        self.delimiter = b'\x17'
+        self.frames = framing.FrameDecoder(EchoClientFactory.max_frame, EchoClientFactory.length_prefixed)
+        # Binary frames are asked for in the setup message, and sent once the server answers in binary
+        self.binary = False
+        self.writer = None
+
+        # Messages from the gm worker thread, written by the reactor thread in one batch,
+        #   traced ones as (line, trace, time queued) (see common/tracing.py)
+        self.outgoing = collections.deque()
+        self.tracer = EchoClientFactory.tracer
+        self.send_wakeup_pending = False
+
+        # Gui frames are coalesced and sent at most gui_fps times per second
+        self.gui_stream = gs.GuiStream()
+        self.gui_frame_time = 1 / EchoClientFactory.gui_fps
+        self.gui_last_frame = 0
+        self.gui_call = None
+        self.gui_wakeup_pending = False
+
+    def encode(self, msg: m.Message):
+        if self.binary:
+            return b.stuff(msg.to_binary())
+        return msg.to_json().encode()
 
     def write_msg(self, msg: m.Message):
-        line = msg.to_json().encode() + self.delimiter
+        line = self.encode(msg)
         print(f"> gm server: Sending \"{line}\"")
-        self.transport.write(line)
+        self.writer.write(line)
 
     def write_msg_no_print(self, msg: m.Message):
-        line = msg.to_json().encode() + self.delimiter
-        self.transport.write(line)
+        self.writer.write(self.encode(msg))
 
+    # Called from the gm worker thread
     def pass_to_server(self, arg1):
-        self.write_msg(arg1)
+        start = time.perf_counter()
+        line = self.encode(arg1)
+        print(f"> gm server: Sending \"{line}\"")
+        if self.tracer is not None and arg1.traceId is not None:
+            self.outgoing.append((line, arg1.traceId, start))
+        else:
+            self.outgoing.append(line)
+        if not self.send_wakeup_pending:
+            self.send_wakeup_pending = True
+            reactor.callFromThread(self.send_outgoing)
+
+    def send_outgoing(self):
+        # Cleared before taking the messages, so a message added meanwhile wakes the reactor again
+        self.send_wakeup_pending = False
+        while self.outgoing:
+            line = self.outgoing.popleft()
+            if type(line) is tuple:
+                line, trace, start = line
+                self.writer.write(line)
+                self.tracer.span(trace, 'gm send', start, time.perf_counter(), 'reactor')
+                continue
+            self.writer.write(line)
 
+    # Called from the gm worker thread with a board snapshot
     def pass_to_gui(self, arg1):
-        msg = m.GuiMessage(arg1)
-        self.write_msg_no_print(msg)
+        self.gui_stream.push(arg1)
+        if not self.gui_wakeup_pending:
+            self.gui_wakeup_pending = True
+            reactor.callFromThread(self.schedule_gui_frame)
 
-    # Ignore gui messages, if the gui flag was not set
-    def ignore_gui(self, arg1):
-        pass
+    def schedule_gui_frame(self):
+        self.gui_wakeup_pending = False
+        if self.gui_call is not None:
+            return
+        delay = max(0, self.gui_last_frame + self.gui_frame_time - time.monotonic())
+        self.gui_call = reactor.callLater(delay, self.send_gui_frame)
+
+    def send_gui_frame(self):
+        self.gui_call = None
+        self.gui_last_frame = time.monotonic()
+        msg = self.gui_stream.next_frame()
+        if msg is not None:
+            self.write_msg_no_print(msg)
 
     def connectionMade(self):
+        EchoClientFactory.connection = self
+        self.writer = framing.FrameWriter(self.transport, reactor.callLater,
+                                          length_prefixed=EchoClientFactory.length_prefixed)
+        if EchoClientFactory.standby:
+            # Waits for a game moved from another gm
+            msg = m.Standby(capacity=1)
+            if EchoClientFactory.binary:
+                msg.encoding = 'binary'
+            self.write_msg(msg)
+            return
         # Send game start message to server
-        self.write_msg(m.SetUpGame())
+        settings = s.Settings()
+        msg = m.SetUpGame(slots=settings.player_count_per_team * 2)
+        if EchoClientFactory.resume is not None:
+            # Registered again under the same id, the server sends the players of the game back to it
+            msg.gameId = EchoClientFactory.resume['game']
+        if EchoClientFactory.binary:
+            msg.encoding = 'binary'
+        self.write_msg(msg)
 
     def game_over(self):
         print('> gm server: Game over, shutting down')
+        self.close()
+
+    def close(self):
+        # Frames still batched are written first
+        self.writer.flush()
         self.transport.loseConnection()
 
+    def connectionLost(self, reason):
+        self.writer.discard()
+        if self.frozen is not None:
+            # The state of the frozen game is written before shutting down, to resume the game from
+            self.frozen.end_freeze(adopted=False)
+        print(f'> gm server: Sent {self.writer.stats}')
+        dump_stats()
+        if self.tracer is not None:
+            self.tracer.close()
+
+    def dataReceived(self, data):
+        try:
+            lines = self.frames.feed(data)
+        except ValueError as err:
+            print(f'> gm server: {err}, closing the connection')
+            self.close()
+            return
+        for line in lines:
+            self.lineReceived(line)
+
     def lineReceived(self, line):
+        start = time.perf_counter()
         print(f"> gm server: Got \"{line}\"")
-        # Translate json to msg
-        msg, err = m.Message.from_json_gm(line)
+        # Translate json (or binary) to msg
+        if b.is_binary(line):
+            self.binary = True
+            msg, err = m.Message.from_binary_gm(b.unstuff(line))
+        else:
+            msg, err = m.Message.from_json_gm(line)
 
         # If the message could not be translated
         if err is not None:
@@ -59,33 +177,207 @@ class GM_Server(LineReceiver):
             # If game is not accepted
             if msg.result == 'denied':
                 print('> gm server: Could not start game')
-                self.transport.loseConnection()
+                self.close()
                 self.gm = None
                 return
             # If new game is accepted
             else:
                 # Start game
-                print('> gm server: Started new game')
+                start = time.perf_counter()
                 self.gm = ext.GmExternal(
-                    self.pass_to_server, self.pass_to_gui if self.gui else self.ignore_gui)
+                    self.pass_to_server, self.pass_to_gui if self.gui else None,
+                    seed=EchoClientFactory.seed, journal=EchoClientFactory.journal,
+                    checkpoint=EchoClientFactory.checkpoint, checkpoint_interval=EchoClientFactory.checkpoint_interval,
+                    game_id=msg.gameId, resume=EchoClientFactory.resume, tracer=self.tracer)
+                if EchoClientFactory.resume is not None:
+                    print(f'> gm server: Resumed game {msg.gameId} in {(time.perf_counter() - start) * 1000:.1f} ms')
+                else:
+                    print('> gm server: Started new game')
+                if EchoClientFactory.migrate_after is not None:
+                    reactor.callLater(EchoClientFactory.migrate_after, self.ask_migration, msg.gameId)
+
+        elif type(msg) is m.MigrateGame:
+            # Frozen on the gm's thread, after the messages received before this one
+            with self.freeze_lock:
+                self.freezing = False
+                self.freeze_cancelled = False
+            self.gm.clock.call_soon(self.freeze, msg.gameId)
+
+        elif type(msg) is m.CancelMigration:
+            self.cancel_freeze(msg.gameId)
+
+        elif type(msg) is m.AdoptGame:
+            self.adopt(msg)
+
+        elif type(msg) is m.ConfirmAdoptGame:
+            self.end_freeze(msg)
 
         # For general game messages
         else:
+            if self.gm is None:
+                print(f'> gm server: No game for {type(msg).__name__}')
+                return
             # Send to gm to deal with it
             self.gm.send_message(msg)
+            if self.tracer is not None and msg.traceId is not None:
+                self.tracer.span(msg.traceId, 'gm receive', start, time.perf_counter(), 'reactor', self.gm.game_id,
+                                 action=type(msg).__name__)
+            return
+
+
+    def ask_migration(self, game_id):
+        if self.gm is None or self.gm.gm.game_over:
+            return
+        print(f'> gm server: Moving game {game_id} to another gm')
+        msg = m.MigrateGame()
+        msg.gameId = game_id
+        self.write_msg(msg)
+
+    # Called on the gm worker thread
+    def freeze(self, game_id):
+        with self.freeze_lock:
+            if self.freezing or self.freeze_cancelled:
+                return
+            self.freezing = True
+        start = time.perf_counter()
+        state = self.gm.freeze()
+        reactor.callFromThread(self.send_state, game_id, state, time.perf_counter() - start)
+
+    def send_state(self, game_id, state, freeze_time):
+        # Messages the game sent before it was frozen go first
+        self.send_outgoing()
+        msg = m.GameState(result='OK', state=base64.b64encode(state).decode())
+        msg.gameId = game_id
+        self.write_msg_no_print(msg)
+        print(f'> gm server: Froze game {game_id} in {freeze_time * 1000:.1f} ms ({len(state)} bytes), '
+              f'waiting for it to be adopted')
+        self.frozen = self.gm
+        self.gm = None
+
+    # The server did not get the state in time, the game goes on here unless the gm's thread is freezing it already
+    def cancel_freeze(self, game_id):
+        with self.freeze_lock:
+            if self.freezing:
+                print(f'> gm server: Game {game_id} is frozen already, its state goes on to the server')
+                return
+            self.freeze_cancelled = True
+        print(f'> gm server: Keeping game {game_id}')
+        msg = m.GameState(result='denied')
+        msg.gameId = game_id
+        self.write_msg(msg)
+
+    def end_freeze(self, msg):
+        if self.frozen is None:
+            if self.gm is not None and msg.result == 'OK' and msg.gameId == self.gm.game_id:
+                # Adopted too late, the game goes on elsewhere
+                print(f'> gm server: Game {msg.gameId} runs on another gm, shutting down')
+                self.gm.clock.call_soon(self.drop_game)
+            return
+        if msg.result == 'OK':
+            print(f'> gm server: Game {msg.gameId} runs on another gm, shutting down')
+        else:
+            print(f'> gm server: Game {msg.gameId} was not adopted, its checkpoint is kept to resume it, shutting down')
+        self.frozen.end_freeze(adopted=msg.result == 'OK')
+        self.frozen = None
+        self.close()
+
+    # Called on the gm worker thread
+    def drop_game(self):
+        self.gm.freeze()
+        self.gm.end_freeze(adopted=True)
+        reactor.callFromThread(self.close)
+
+    def adopt(self, msg):
+        reply = m.ConfirmAdoptGame(result='denied')
+        reply.gameId = msg.gameId
+        if self.gm is not None:
+            print('> gm server: Already running a game')
+            self.write_msg(reply)
+            return
+        start = time.perf_counter()
+        try:
+            state = ck.loads(base64.b64decode(msg.state))
+        except ValueError as err:
+            print(f'> gm server: Could not adopt game {msg.gameId}: {err}')
+            self.write_msg(reply)
             return
+        if self.frozen is not None:
+            # Handed back, no other gm took the game: its checkpoint is written again by the adopted game
+            self.frozen.end_freeze(adopted=True)
+            self.frozen = None
+        self.gm = ext.GmExternal(
+            self.pass_to_server, self.pass_to_gui if self.gui else None,
+            journal=EchoClientFactory.journal,
+            checkpoint=EchoClientFactory.checkpoint, checkpoint_interval=EchoClientFactory.checkpoint_interval,
+            game_id=msg.gameId, resume=state, tracer=self.tracer)
+        reply.result = 'OK'
+        self.write_msg(reply)
+        print(f'> gm server: Adopted game {msg.gameId} in {(time.perf_counter() - start) * 1000:.1f} ms')
 
-    def rawDataReceived(self, data):  # not important, just needs to be implemented
-        pass
+
+class MetricsPage(resource.Resource):
+    """ Metrics of the game in the Prometheus text format (see common/metrics.py) """
+
+    isLeaf = True
+
+    def render_GET(self, request):
+        request.setHeader(b'content-type', b'text/plain; version=0.0.4')
+        connection = EchoClientFactory.connection
+        if connection is None or connection.gm is None:
+            return b'# no game\n'
+        return connection.gm.metrics_text(f'game="{connection.gm.game_id}"').encode()
+
+
+def dump_stats():
+    connection = EchoClientFactory.connection
+    if connection is None or connection.gm is None:
+        return
+    print('> gm server: Stats, times in ms (p50/p99/max):')
+    for line in connection.gm.metrics_summary():
+        print(f'> gm server: Stats: {line}')
 
 
 # Default (almost) client factory from the twisted python documentation
 class EchoClientFactory(ClientFactory):
     gui = False
+    gui_fps = 10
+    binary = False
+    seed = None
+    journal = None
+    checkpoint = None
+    checkpoint_interval = 5.0
+    resume = None
+    standby = False
+    migrate_after = None
+    tracer = None
+    max_frame = framing.MAX_LENGTH
+    length_prefixed = False
+    # Connection to the server, for the metrics
+    connection = None
 
-    def __init__(self, gui=False):
+    def __init__(self, gui=False, gui_fps=10, binary=False, seed=None, journal=None,
+                 checkpoint=None, checkpoint_interval=5.0, resume=None, standby=False, migrate_after=None, tracer=None,
+                 max_frame=framing.MAX_LENGTH, length_prefixed=False):
         self.done = Deferred()
         EchoClientFactory.gui = gui
+        EchoClientFactory.gui_fps = gui_fps
+        EchoClientFactory.binary = binary
+        EchoClientFactory.seed = seed
+        EchoClientFactory.journal = journal
+        EchoClientFactory.checkpoint = checkpoint
+        EchoClientFactory.checkpoint_interval = checkpoint_interval
+        # Loaded checkpoint of the game to continue, None to start a new game
+        EchoClientFactory.resume = resume
+        # Wait for a game moved from another gm instead of setting up a new one
+        EchoClientFactory.standby = standby
+        # Seconds after which the game is moved to a standby gm, None to keep it
+        EchoClientFactory.migrate_after = migrate_after
+        # Records the spans of traced messages (see common/tracing.py), None to not trace
+        EchoClientFactory.tracer = tracer
+        # Largest frame taken from the server, in bytes
+        EchoClientFactory.max_frame = max_frame
+        # Frames prefixed with their length instead of delimited (see common/framing.py)
+        EchoClientFactory.length_prefixed = length_prefixed
         EchoClientFactory.protocol = GM_Server
 
     def clientConnectionFailed(self, connector, reason):
@@ -103,15 +395,63 @@ def main():
         '-p', '--port', help='Server port number', type=int, default=9997)
     parser.add_argument(
         '-g', '--gui', help='Trigger sending gui messages to the gui client',  action='store_true')
+    parser.add_argument(
+        '--gui-fps', help='Maximum number of gui frames sent per second', type=float, default=10)
+    parser.add_argument(
+        '--binary', help='Ask the server for the compact binary wire format instead of json', action='store_true')
+    parser.add_argument(
+        '--seed', help='Seed of the game, picked at random if not given', type=int)
+    parser.add_argument(
+        '--journal', help='Record the messages of the game in this file, to replay it with replay.py')
+    parser.add_argument(
+        '--checkpoint', help='Write checkpoints of the game to this file, to resume it if the gm dies')
+    parser.add_argument(
+        '--checkpoint-interval', help='Seconds between checkpoints', type=float, default=5.0)
+    parser.add_argument(
+        '--resume', help='Continue the game of this checkpoint, checkpoints are then written to it unless --checkpoint is given')
+    parser.add_argument(
+        '--standby', help='Take over a running game moved from another gm instead of starting one', action='store_true')
+    parser.add_argument(
+        '--migrate-after', help='Move the game to a standby gm after this many seconds', type=float)
+    parser.add_argument(
+        '--stats-interval', help='Seconds between two dumps of the latency stats, 0 to not dump them', type=float, default=30)
+    parser.add_argument(
+        '--metrics-port', help='Serve the metrics of the game on this local port (http://localhost:<port>/metrics)', type=int)
+    parser.add_argument(
+        '--max-frame', help='Largest frame taken from the server, in bytes', type=int, default=framing.MAX_LENGTH)
+    parser.add_argument(
+        '--length-prefixed', help='Prefix frames with their length instead of delimiting them', action='store_true')
+    parser.add_argument(
+        '--trace', help='Write the spans of traced messages to this directory, see trace.py')
 
     args = parser.parse_args()
     port = args.port
     address = args.address
     gui = args.gui
+    gui_fps = args.gui_fps
+    binary = args.binary
+
+    resume = None
+    checkpoint = args.checkpoint
+    if args.resume is not None:
+        resume = ck.load(args.resume)
+        if resume['over']:
+            print(f'> gm server: The game of {args.resume} is over')
+            return
+        checkpoint = checkpoint or args.resume
 
     def run(reactor):
-        factory = EchoClientFactory(gui)
+        factory = EchoClientFactory(gui, gui_fps, binary, args.seed, args.journal,
+                                    checkpoint, args.checkpoint_interval, resume, args.standby, args.migrate_after,
+                                    tr.Tracer(args.trace, 'gm') if args.trace is not None else None, args.max_frame,
+                                    args.length_prefixed)
         reactor.connectTCP(address, port, factory)
+        if args.stats_interval > 0:
+            task.LoopingCall(dump_stats).start(args.stats_interval, now=False)
+        if args.metrics_port is not None:
+            root = resource.Resource()
+            root.putChild(b'metrics', MetricsPage())
+            reactor.listenTCP(args.metrics_port, web.Site(root), interface='127.0.0.1')
         return factory.done
 
     task.react(run)
@@ -0,0 +1,50 @@
+import common.messages as m
+
+# Producer side of the gui channel.
+# Board snapshots are pushed as they come, frames are pulled at the (capped) frame rate:
+#   the first frame is the whole board (keyframe), after that only the cells that changed since
+#   the previous frame (delta). Snapshots pushed in between frames are coalesced into one.
+
+
+class GuiStream:
+
+    def __init__(self, keyframe_interval: int = 100):
+        # A full board is sent every keyframe_interval frames, so a gui that (re)connects catches up
+        self.keyframe_interval = keyframe_interval
+
+        self.latest = None
+        self.sent = None
+        self.frames_since_keyframe = 0
+
+    # Stores the newest snapshot, older unsent ones are simply dropped
+    def push(self, snapshot):
+        self.latest = snapshot
+
+    # Returns the message to send for the newest snapshot, None if nothing changed
+    def next_frame(self):
+        latest = self.latest
+        sent = self.sent
+        if latest is None or latest is sent:
+            return None
+
+        self.sent = latest
+
+        if sent is None or self.frames_since_keyframe >= self.keyframe_interval \
+                or sent.board_width != latest.board_width or sent.board_height != latest.board_height:
+            self.frames_since_keyframe = 0
+            return m.GuiMessage(latest)
+
+        cells = []
+        for y, (old_row, new_row) in enumerate(zip(sent.rows, latest.rows)):
+            # Unchanged rows are shared between snapshots
+            if old_row is new_row:
+                continue
+            for x, (old, new) in enumerate(zip(old_row, new_row)):
+                if old != new:
+                    cells.append([x, y, new])
+
+        if not cells:
+            return None
+
+        self.frames_since_keyframe += 1
+        return m.GuiDelta(cells)
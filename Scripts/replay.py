@@ -0,0 +1,133 @@
+import argparse
+import contextlib
+import json
+import os
+import time
+
+import external as ext
+import common.clock as c
+import common.journal as j
+import common.messages as m
+import common.settings as s
+
+# Plays a journaled game again (see common/journal.py), for reproducing a game and benchmarking the gm on real traces.
+# The gm gets the journaled seed and settings, and the journaled messages and new pieces at their times, in virtual
+#   time so the game runs as fast as the gm allows. The outcome (winner and number of messages sent) is checked
+#   against the one in the journal.
+# Games journaled in virtual time (simulation.py) replay exactly. Games journaled in real time replay the same
+#   unless an action finished later than its delay by enough to swap its order with a new piece.
+
+
+class ReplayResult:
+    """ Outcome of a replayed game, and of the journaled one """
+
+    def __init__(self, winner, sent, expected, messages, wall_time):
+        self.winner = winner
+        # Messages sent by the gm
+        self.sent = sent
+        # End event of the journal, None if the journaled game did not end
+        self.expected = expected
+        # Messages sent to the gm
+        self.messages = messages
+        self.wall_time = wall_time
+
+    def matches(self):
+        return self.expected is not None \
+            and (self.winner, self.sent) == (self.expected['end'], self.expected['sent'])
+
+    def __str__(self):
+        if self.expected is None:
+            check = 'journaled game did not end'
+        elif self.matches():
+            check = 'same as journaled'
+        else:
+            check = f'DIFFERENT from journaled (winner: {self.expected["end"]}, sent: {self.expected["sent"]})'
+        return f'winner: {self.winner}, sent: {self.sent}, {check}, ' \
+               f'{self.messages} messages in {self.wall_time:.3f}s ({self.messages / self.wall_time:.0f}/s)'
+
+
+class Replay:
+
+    # log_dir: directory of the logs of the replayed games, the gm's default if None
+    def __init__(self, path, log_dir=None):
+        self.header, events = j.read(path)
+        self.log_dir = log_dir
+
+        # Messages are parsed once, not on every run
+        self.events = []
+        self.expected = None
+        for event in events:
+            if 'msg' in event:
+                msg, err = m.Message.from_json_gm(json.dumps(event['msg']))
+                if err is not None:
+                    raise ValueError(err)
+                self.events.append((event['t'], msg))
+            elif 'piece' in event:
+                self.events.append((event['t'], None))
+            elif 'end' in event:
+                self.expected = event
+
+    # Runs the game once, returns its ReplayResult
+    def run(self):
+        settings = s.Settings()
+        settings.update(self.header['settings'])
+        clock = c.VirtualClock()
+        outcome = {'winner': None, 'sent': 0}
+
+        def server_callback(msg):
+            outcome['sent'] += 1
+            if type(msg) is m.GameOver:
+                outcome['winner'] = msg.result
+                clock.stop()
+
+        gm = ext.GmExternal(server_callback, clock=clock, seed=self.header['seed'], settings=settings,
+                            log_dir=self.log_dir)
+        # New pieces come from the journal instead of the timer
+        gm.gm.bus.unsubscribe('start-pieces', gm.start_pieces)
+
+        def add_piece():
+            if not gm.gm.game_over:
+                gm.gm.add_new_piece()
+
+        for t, msg in self.events:
+            if msg is None:
+                clock.call_later(t, add_piece)
+            else:
+                clock.call_later(t, gm.send_message, msg)
+
+        start = time.perf_counter()
+        clock.run()
+        wall_time = time.perf_counter() - start
+        messages = sum(1 for _, msg in self.events if msg is not None)
+        return ReplayResult(outcome['winner'], outcome['sent'], self.expected, messages, wall_time)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('journal', help='Journal of the game to replay')
+    parser.add_argument(
+        '-n', '--runs', help='Number of times to replay the game', type=int, default=1)
+    parser.add_argument(
+        '-v', '--verbose', help='Keep the output of the gm', action='store_true')
+
+    args = parser.parse_args()
+    replay = Replay(args.journal)
+
+    results = []
+    for i in range(args.runs):
+        if args.verbose:
+            result = replay.run()
+        else:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = replay.run()
+        results.append(result)
+        print(f'> replay: run {i + 1}: {result}')
+
+    best = min(r.wall_time for r in results)
+    print(f'> replay: best {best:.3f}s, {results[0].messages / best:.0f} messages/s')
+    if not all(r.matches() for r in results):
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
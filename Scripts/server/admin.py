@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import socket
+import sys
+
+from twisted.internet import protocol
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import common.framing as framing
+
+# Admin port of the server, on its own port and local only (server.py --admin-port).
+# Requests and replies are json frames, like the messages of the game:
+#   {"action": "stats"}                     counters of the relay, its connections and its games (see stats.py),
+#                                           "gameId": <id> for one game only
+#   {"action": "migrate", "gameId": <id>}   moves a running game to a standby game master (see migrate_game)
+# The reply has the action of the request and a result, "OK" or "denied" with an error.
+# Usage: python admin.py --port <admin port> stats [<game id>] | migrate <game id>
+
+
+class AdminProtocol(protocol.Protocol):
+
+    def connectionMade(self):
+        self.frames = framing.FrameDecoder()
+
+    def dataReceived(self, data):
+        try:
+            frames = self.frames.feed(data)
+        except ValueError as err:
+            print("ERROR: ADMIN:", err)
+            self.transport.loseConnection()
+            return
+        for frame in frames:
+            try:
+                request = json.loads(frame)
+            except ValueError:
+                request = {}
+            reply = self.handle(request)
+            self.transport.write(json.dumps(reply).encode() + framing.DELIMITER)
+
+    def handle(self, request):
+        if not isinstance(request, dict):
+            request = {}
+        action = request.get("action")
+        relay = self.factory.relay
+        reply = {"action": action, "result": "OK"}
+        if action == "stats":
+            reply.update(relay.stats_report(request.get("gameId")))
+        elif action == "migrate":
+            game = relay.games.get(request.get("gameId"))
+            if game is None or not relay.migrate_game(game):
+                reply.update(result="denied", error="no such game, or no game master to move it to")
+        else:
+            reply.update(result="denied", error=f"unknown action {action}")
+        return reply
+
+
+class AdminFactory(protocol.ServerFactory):
+    protocol = AdminProtocol
+
+    def __init__(self, relay):
+        # GameFactory of the server
+        self.relay = relay
+
+
+def request(port, message):
+    """ Sends one request to the admin port, returns the reply """
+    with socket.create_connection(("localhost", port)) as connection:
+        connection.sendall(json.dumps(message).encode() + framing.DELIMITER)
+        data = b""
+        while not data.endswith(framing.DELIMITER):
+            chunk = connection.recv(1 << 16)
+            if not chunk:
+                break
+            data += chunk
+    return json.loads(data.rstrip(framing.DELIMITER))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-p", "--port", help="Admin port of the server", type=int, default=9998)
+    parser.add_argument("action", choices=("stats", "migrate"))
+    parser.add_argument("game", nargs="?", help="Game id, required by migrate")
+    args = parser.parse_args()
+
+    message = {"action": args.action}
+    if args.game is not None:
+        message["gameId"] = args.game
+    print(json.dumps(request(args.port, message), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+from stats import GameCounters
+
+
+class Game:
+    """ A game hosted by the server: its game master connection and routing tables """
+
+    def __init__(self, id, game_master, slots=None):
+        self.id = id
+        self.game_master = game_master
+        # Number of players the game takes, None if the game master did not say
+        self.slots = slots
+        self.started = False
+
+        self.waitroom = {}  # guid -> Player, sent to gm but not yet confirmed
+        self.players = {}   # guid -> Player
+        # Guids of the players admitted to the game, they may join again (e.g. after losing their connection)
+        self.guids = set()
+        # Migration to another game master, while the game is moved
+        self.migration = None
+        self.counters = GameCounters()
+
+    def send(self, frame):
+        """ Sends a frame to the game master, or holds it while the game moves to another one """
+        if self.migration is not None:
+            self.migration.held.append(frame)
+        else:
+            self.game_master.message(frame)
+
+    def is_open(self):
+        """ Whether the game can take another player """
+        if self.started:
+            return False
+        return self.slots is None or len(self.players) + len(self.waitroom) < self.slots
+
+
+class Migration:
+    """ A game being moved to another game master, the frames sent to the game meanwhile are held in order """
+
+    def __init__(self, target, start):
+        self.target = target
+        # Time the game master was asked to freeze the game
+        self.start = start
+        self.held = []
+        # Whether the frozen game was handed to the target, its state (sent again if the target does not adopt it)
+        #   and the game masters that did not
+        self.adopting = False
+        self.state = None
+        self.tried = set()
+        # Whether the game master was told to keep the game, for not freezing it in time
+        self.cancelled = False
+        self.timeout = None
+
+    def cancel_timeout(self):
+        if self.timeout is not None and self.timeout.active():
+            self.timeout.cancel()
@@ -1,4 +1,38 @@
+import collections
+
+# Seconds after which a request is taken as never answered (the game master may drop a request, e.g. when its game
+#   is moved), so it is not paired with the result of a later one
+MAX_RESPONSE_TIME = 10.0
+
+
 class Player:
-    def __init__(self, address, guid):
+    def __init__(self, address, guid, join_message=None):
         self.address = address
         self.guid = guid
+        # Parsed connect message, kept to send it on to another game if the first one denies it
+        self.join_message = join_message
+        self.game = None
+        # action -> when the requests with that action waiting for their result were forwarded to the game master,
+        #   oldest first. A result has the action of its request
+        self.requests = {}
+
+    def requested(self, action, now):
+        requests = self.requests.get(action)
+        if requests is None:
+            requests = self.requests[action] = collections.deque()
+        while requests and now - requests[0] > MAX_RESPONSE_TIME:
+            requests.popleft()
+        requests.append(now)
+
+    def answered(self, action, now):
+        """ Returns the response time of the oldest request with this action still waiting, None if there is none """
+        requests = self.requests.get(action)
+        while requests:
+            response_time = now - requests.popleft()
+            if response_time <= MAX_RESPONSE_TIME:
+                return response_time
+        return None
+
+    def forget_requests(self):
+        """ Forgets the requests waiting for their result, for a game master that may not answer them """
+        self.requests = {}
@@ -2,139 +2,804 @@
 
 import getopt
 import json
+import os
 import sys
+import time
+import uuid
 
-from twisted.internet import reactor, protocol
+from twisted.internet import reactor, protocol, task
 
+# The message classes and routes are shared with the gm and the players
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import common.binary as binary
+import common.framing as framing
+import common.messages as m
+import common.routing as routing
+import common.tracing as tracing
+
+from admin import AdminFactory
+from game import Game, Migration
 from player import Player
+from spectators import SpectatorHub
+from stats import Counters, RelayStats
+
+
+class Frame:
+    """ A received message, written to each connection in the encoding that connection negotiated """
+
+    __slots__ = ('header', 'data', 'binary', '_parsed', 'transcoded')
+
+    def __init__(self, header, data=None, is_binary=False):
+        # Keys the server routes by (see routing.header_of), the whole message for frames built by the server
+        self.header = header
+        # Frame as received (stuffed if binary), None for frames built by the server
+        self.data = data
+        self.binary = is_binary
+        self._parsed = header if data is None else None
+        # encoding -> frame in the other encoding, converted once however many receivers need it
+        self.transcoded = None
+
+    @property
+    def parsed(self):
+        """ The whole message, parsed on first use: only for the messages the server rewrites or transcodes """
+        if self._parsed is None:
+            if self.binary:
+                self._parsed = binary.decode_dict(binary.unstuff(self.data))
+            else:
+                self._parsed = json.loads(self.data.decode())
+        return self._parsed
+
+    def encoded(self, to_binary):
+        if self.data is not None and to_binary == self.binary:
+            return self.data
+        if self.transcoded is None:
+            self.transcoded = {}
+        data = self.transcoded.get(to_binary)
+        if data is None:
+            if to_binary:
+                data = binary.stuff(binary.encode_dict(self.parsed))
+            else:
+                data = json.dumps(self.parsed).encode()
+            self.transcoded[to_binary] = data
+        return data
+
+
+# What is done when the send queue of a connection goes over its high watermark, by kind of connection:
+#   pause       stop reading from the connections sending to it, until its queue is back under the low watermark
+#   drop        skip frames, spectators only (they catch up from the next keyframe, see spectators.py)
+#   disconnect  drop the connection
+POLICIES = {"gm": "pause", "player": "disconnect", "spectator": "drop"}
 
 
 class GameProtocol(protocol.Protocol):
-    delimiter = b'\x17'
+    delimiter = framing.DELIMITER
 
     def connectionMade(self):
         print("Connected", self)
         self.factory.clients.append(self)
+        self.frames = framing.FrameDecoder(self.factory.max_frame)
+        self.writer = framing.FrameWriter(self.transport, self.factory.clock.callLater, stats=self.factory.write_stats,
+                                          high_watermark=self.factory.high_watermark,
+                                          low_watermark=self.factory.low_watermark)
+        self.writer.on_high = self.queue_full
+        self.writer.on_low = self.queue_drained
+        # Whether the framing of the client is known, it is told by the first bytes it sends
+        self.framing_known = False
+        # Connections paused because they send to this one while its queue is full
+        self.blocking = set()
+        # Number of connections that paused this one
+        self.blocked_by = 0
+        # Games hosted by this connection, if it is a game master
+        self.games = {}
+        # Number of games moved from other game masters this one offers to take (see migrate_game)
+        self.capacity = 0
+        # Guid of the player on this connection, if it is a player
+        self.guid = None
+        # Spectator of this connection, if it watches games
+        self.spectator = None
+        # Whether this connection asked for binary frames (see common/binary.py), json otherwise
+        self.binary = False
+        self.counters = Counters()
 
     def connectionLost(self, reason):
         print("Disconnected from", self, reason.value)
         self.factory.clients.remove(self)
+        self.writer.discard()
+        self.queue_drained()
+        for client in self.factory.clients:
+            client.blocking.discard(self)
+
+        self.factory.standby.discard(self)
+        for game in list(self.factory.games.values()):
+            if game.migration is not None and game.migration.target is self:
+                if game.migration.adopting:
+                    self.factory.migration_failed(game)
+                else:
+                    # Another one is picked when the game is frozen
+                    game.migration.target = None
+
+        for game in list(self.games.values()):
+            if game.started:
+                # A game master resuming the game from a checkpoint may register it again
+                print("Lost the game master of", game.id)
+                self.factory.orphan_game(game)
+            else:
+                print("UnregisterGame", game.id)
+                self.factory.remove_game(game)
+                # Its players wait for another game
+                for player in list(game.players.values()) + list(game.waitroom.values()):
+                    self.factory.join(player)
+
+        if self.guid is not None:
+            self.factory.remove_player(self.guid, self)
+
+        if self.spectator is not None:
+            self.factory.spectators.remove(self)
 
     def dataReceived(self, data):
         print("received", repr(data))
-        if data == GameProtocol.delimiter:
-            # for easier debugging
+        if not self.framing_known:
+            self.framing_known = True
+            if framing.is_length_prefixed(data):
+                print("Length prefixed frames", self)
+                self.frames.length_prefixed = self.writer.length_prefixed = True
+        try:
+            frames = self.frames.feed(data)
+        except ValueError as err:
+            print("ERROR:", err, self)
+            self.close()
             return
-        if data == b'gui':
-            self.factory.gui = self
+        # The connection frames are read from, paused if they fill a queue with the pause policy
+        self.factory.reading = self
+        for frame in frames:
+            if frame.startswith(b'gui'):
+                self.watch(frame)
+                continue
+            self.handle(self, frame)
+        self.factory.reading = None
+
+    def watch(self, handshake):
+        """ Makes this connection a spectator: "gui [binary] [<game id>]", all games if no id is given """
+        if self.spectator is not None:
+            print("ERROR: ALREADY WATCHING", self)
             return
-        for d in data.split(GameProtocol.delimiter):
-            if d != b'':
-                self.handle(self, d)
+        options = handshake.decode().split()[1:]
+        self.binary = "binary" in options
+        game_ids = [o for o in options if o != "binary"]
+        game_id = game_ids[0] if game_ids else None
+        print("Spectator", game_id, self)
+        self.spectator = self.factory.spectators.add(self, game_id)
 
-    def message(self, message):
-        self.transport.write(message + GameProtocol.delimiter)
+    def message(self, frame):
+        if self.writer.congested and self.policy() == "pause":
+            self.block(self.factory.reading)
+        data = frame.encoded(self.binary)
+        self.counters.sent(len(data))
+        self.factory.stats.total.sent(len(data))
+        if self.factory.routing_game is not None:
+            self.factory.routing_game.sent(len(data))
+        self.writer.write(data)
+
+    # ======== Send queue ========
+
+    def kind(self):
+        if self.spectator is not None:
+            return "spectator"
+        if self.is_game_master():
+            return "gm"
+        return "player"
+
+    def policy(self):
+        return self.factory.policies[self.kind()]
+
+    def queue_full(self):
+        policy = self.policy()
+        print("Send queue over", self.writer.high_watermark, "bytes:", policy, self)
+        if policy == "disconnect":
+            self.writer.discard()
+            self.transport.abortConnection()
+        elif policy == "pause":
+            self.block(self.factory.reading)
+        elif policy == "drop":
+            # Skipped frames are caught up from the next keyframe
+            self.writer.discard()
+            if self.spectator is not None:
+                self.spectator.behind = True
+
+    def queue_drained(self):
+        for source in self.blocking:
+            source.blocked_by -= 1
+            if source.blocked_by == 0:
+                source.transport.resumeProducing()
+        self.blocking = set()
+
+    def block(self, source):
+        """ Stops reading from a connection sending to this one, until this one's queue drains """
+        if source is None or source is self or source in self.blocking:
+            return
+        self.blocking.add(source)
+        source.blocked_by += 1
+        if source.blocked_by == 1:
+            print("Pausing", source, "while", self, "catches up")
+            source.transport.pauseProducing()
+
+    def close(self):
+        # Frames still batched are written first
+        self.writer.flush()
+        self.transport.loseConnection()
+
+    def is_game_master(self):
+        return len(self.games) > 0 or self.capacity > 0
+
+    def game_of(self, header):
+        """ Returns the game a message sent by this game master is about """
+        if "gameId" in header:
+            return self.games.get(header["gameId"])
+        if len(self.games) == 1:
+            return next(iter(self.games.values()))
+        return None
+
+    def game_id_of(self, header):
+        game = self.game_of(header)
+        return game.id if game is not None else header.get("gameId")
 
     def handle(self, addr, data):
         # print("received data:", addr, data)
-        parsed_json = json.loads(data)
-        if "action" not in parsed_json:
+        # Only the routing keys are read, the message is forwarded as received
+        start = time.perf_counter()
+        is_binary = binary.is_binary(data)
+        try:
+            header = routing.header_of(binary.unstuff(data) if is_binary else data)
+        except (ValueError, IndexError) as err:
+            print("ERROR: INVALID MESSAGE", err)
+            return
+        frame = Frame(header, data, is_binary)
+        if header is None:
+            # The prefix of the message did not hold all the routing keys
+            header = frame.parsed
+        if "action" not in header:
             print("ERROR: NO ACTION FIELD IN THE MESSAGE")
             return
-        action = parsed_json["action"]
-        print("action:", action)
+        parsed = time.perf_counter()
+        print("action:", header["action"])
+
+        # Frames sent while routing are counted for the game of this one
+        game = self.game_of(header) if self.games else self.factory.game_of_player(self.guid)
+        game_counters = game.counters if game is not None else None
+        self.factory.routing_game = game_counters
+        routed = time.perf_counter()
+        handler = GameProtocol.routes.handler_of(header)
+        handler(self, header, frame)
+        end = time.perf_counter()
+        self.factory.routing_game = None
+
+        stats = self.factory.stats
+        parse_time = parsed - start
+        route_time = end - routed
+        stats.parse.record(parse_time)
+        stats.route.record(route_time)
+        stats.total.received(len(data), parse_time, route_time)
+        self.counters.received(len(data), parse_time, route_time)
+        if game_counters is not None:
+            game_counters.received(len(data), parse_time, route_time)
+
+        trace = header.get("traceId")
+        if trace is not None and self.factory.tracer is not None:
+            self.factory.tracer.span(trace, "relay response" if "result" in header else "relay request", start, end,
+                                     game=game.id if game is not None else None, action=header["action"])
+
+    # ======== Route handlers, all take (frame header, received frame) ========
+
+    def gui_keyframe(self, header, frame):
+        self.factory.spectators.publish(self.game_id_of(header), frame, True)
 
-        if action == 'gui':
-            self.factory.gui.message(data)
+    def gui_delta(self, header, frame):
+        self.factory.spectators.publish(self.game_id_of(header), frame, False)
+
+    def setup_game(self, header, frame):
+        # The first message of a game master says which encoding it wants, the reply is already in it
+        self.binary = header.get("encoding") == "binary"
+        self.register_game(frame.parsed)
+
+    def begin_game(self, header, frame):
+        print("BeginGame")
+        game = self.game_of(header)
+        if game is not None:
+            game.started = True
+        # Note: no need to send to players in teamGuids, gm sends message for each one either way
+        self.to_player(header['userGuid'], frame)
+
+    def join_game(self, header, frame):
+        print("JoinGame", self)
+        if "userGuid" not in header:
+            print("ERROR: NO GUID GIVEN")
+            return
+        guid = header["userGuid"]
+        self.guid = guid
+        self.binary = header.get("encoding") == "binary"
+        self.factory.join(Player(self, guid, frame.parsed))
+
+    def confirm_join(self, header, frame):
+        if "userGuid" not in header:
+            print("ERROR: NO GUID GIVEN")
+            return
+        self.factory.join_result(self.game_of(header), header["userGuid"], header["result"], frame)
+
+    def game_over(self, header, frame):
+        print("GameOver", self)
+        game = self.game_of(header)
+        if game is None:
+            print("ERROR: UNKNOWN GAME")
+            return
+        # send message to all players and spectators, the frame is encoded once per encoding
+        for guid in game.players:
+            game.players[guid].address.message(frame)
+        self.factory.spectators.end(game.id, frame)
+        self.factory.remove_game(game)
+
+    def exchange_request(self, header, frame):
+        # AuthorizeKnowledgeExchange and KnowledgeExchangeData, addressed to receiverGuid
+        if "receiverGuid" not in header:
             return
-        if action == "start":
-            if not hasattr(self.factory, 'game_master'):
-                print("RegisterGame", addr)
-                self.factory.game_master = self
-                parsed_json["result"] = "OK"
-                self.message(json.dumps(parsed_json).encode())
+        if not self.is_game_master():
+            self.to_game_master(frame)
+        else:
+            self.to_player(header["receiverGuid"], frame)
+
+    def exchange_answer(self, header, frame):
+        # {Accept,Reject}KnowledgeExchange
+        if "userGuid" not in header:
+            return
+        if not self.is_game_master():
+            self.to_game_master(frame)
+        else:
+            self.to_player(header["userGuid"], frame)
+
+    def forward(self, header, frame):
+        # all other gameplay messages, each request of a player gets one result
+        if "userGuid" in header:
+            if "result" in header:
+                player = self.to_player(header["userGuid"], frame)
+                if player is not None:
+                    response_time = player.answered(header["action"], time.perf_counter())
+                    if response_time is not None:
+                        player.game.counters.response.record(response_time)
+                        self.factory.stats.response.record(response_time)
             else:
-                if "teamGuids" not in parsed_json:
-                    print("ERROR: GAME ALREADY REGISTERED")
-                    parsed_json["result"] = "denied"
-                    self.message(json.dumps(parsed_json).encode())
-                    return
-                print("BeginGame")
-                # Note: no need to send to players in teamGuids, gm sends message for each one either way
-                gid = parsed_json['userGuid']
-                self.factory.players[gid].address.message(data)
-
-        elif action == "connect":
-            print("JoinGame", addr)
-            if "userGuid" not in parsed_json:
-                print("ERROR: NO GUID GIVEN")
+                player = self.to_game_master(frame)
+                if player is not None:
+                    player.requested(header["action"], time.perf_counter())
+
+    def register_game(self, parsed_json):
+        """ Registers a new game hosted by this connection, the reply carries its id """
+        if len(self.factory.games) >= self.factory.max_games:
+            print("ERROR: TOO MANY GAMES")
+            parsed_json["result"] = "denied"
+            self.message(Frame(parsed_json))
+            return
+
+        game = Game(parsed_json.get("gameId") or uuid.uuid4().hex, self, parsed_json.get("slots"))
+        if game.id in self.factory.games:
+            print("ERROR: GAME ALREADY REGISTERED", game.id)
+            parsed_json["result"] = "denied"
+            self.message(Frame(parsed_json))
+            return
+        print("RegisterGame", game.id, self)
+        self.games[game.id] = game
+        self.factory.games[game.id] = game
+
+        parsed_json["result"] = "OK"
+        parsed_json["gameId"] = game.id
+        self.message(Frame(parsed_json))
+
+        orphan = self.factory.orphans.pop(game.id, None)
+        if orphan is not None:
+            self.factory.resume_game(game, orphan)
+
+        # Players may have been waiting for a game
+        self.factory.fill_lobby()
+
+    # Both return the player the frame is sent to or from, None if there is none
+    def to_player(self, guid, frame):
+        player = self.factory.players.get(guid)
+        if player is None:
+            print("ERROR: UNKNOWN PLAYER", guid)
+            return None
+        player.address.message(frame)
+        return player
+
+    def to_game_master(self, frame):
+        player = self.factory.players.get(self.guid)
+        if player is None:
+            print("ERROR: PLAYER NOT IN A GAME", self.guid)
+            return None
+        player.game.send(frame)
+        return player
+
+    def standby(self, header, frame):
+        print("Standby", frame.parsed["capacity"], self)
+        self.binary = header.get("encoding") == "binary"
+        self.capacity = frame.parsed["capacity"]
+        self.factory.standby.add(self)
+
+    def migrate(self, header, frame):
+        # A game master asking to move one of its games away
+        game = self.game_of(header)
+        if game is None:
+            print("ERROR: UNKNOWN GAME")
+            return
+        self.factory.migrate_game(game)
+
+    def migrate_state(self, header, frame):
+        game = self.game_of(header)
+        if game is None or game.migration is None or game.migration.adopting:
+            print("ERROR: UNEXPECTED GAME STATE", header.get("gameId"))
+            return
+        if header["result"] != "OK":
+            print("Game master did not freeze", game.id)
+            self.factory.end_migration(game)
+            return
+        self.factory.adopt_game(game, frame.parsed["state"])
+
+    def adopt_result(self, header, frame):
+        game = self.factory.games.get(header.get("gameId"))
+        if game is None or game.migration is None or game.migration.target is not self:
+            print("ERROR: UNEXPECTED ADOPTION", header.get("gameId"))
+            if header["result"] == "OK":
+                # Adopted too late, the game goes on elsewhere or is resumed from a checkpoint
+                self.message(Frame({"action": m.ConfirmAdoptGame.action, "result": "OK",
+                                    "gameId": header.get("gameId")}))
+            return
+        if header["result"] != "OK":
+            self.factory.migration_failed(game)
+            return
+        self.factory.migrated(game)
+
+    # Route -> handler, routes without an entry are forwarded by forward()
+    routes = routing.JsonTable({
+        m.GuiMessage: gui_keyframe,
+        m.GuiDelta: gui_delta,
+        m.SetUpGame: setup_game,
+        m.GameMessage: begin_game,
+        m.JoinGame: join_game,
+        m.ConfirmJoiningGame: confirm_join,
+        m.GameOver: game_over,
+        m.AuthorizeKnowledgeExchange: exchange_request,
+        m.KnowledgeExchangeData: exchange_request,
+        m.RejectKnowledgeExchange: exchange_answer,
+        m.AcceptKnowledgeExchange: exchange_answer,
+        m.Standby: standby,
+        m.MigrateGame: migrate,
+        m.GameState: migrate_state,
+        m.ConfirmAdoptGame: adopt_result,
+    }, forward)
+
+
+class GameFactory(protocol.ServerFactory):
+    """ Holds the routing tables of all hosted games """
+    protocol = GameProtocol
+
+    def __init__(self, max_games=1000, max_frame=framing.MAX_LENGTH, high_watermark=1 << 20, low_watermark=1 << 18,
+                 policies=None, resume_timeout=60.0, migrate_timeout=5.0, clock=reactor):
+        self.max_games = max_games
+        # Schedules the timers and batched writes, the reactor or a task.Clock in the tests
+        self.clock = clock
+        # Largest frame a client may send, in bytes
+        self.max_frame = max_frame
+        # Send queue of every connection, in bytes, and what is done when one fills (see POLICIES)
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark
+        self.policies = dict(POLICIES, **(policies or {}))
+        # Batched writes of all connections
+        self.write_stats = framing.WriteStats()
+        # Connection whose frames are being handled
+        self.reading = None
+        self.clients = []
+        self.spectators = SpectatorHub()
+
+        self.games = {}    # game id -> Game
+        self.players = {}  # guid -> Player, for players admitted to a game
+        self.lobby = []    # players waiting for a game with a free slot
+
+        # Running games whose game master was lost, kept for resume_timeout seconds for a new game master to
+        #   register them again (see gm_server.py --resume): game id -> Game, with the players to send back to it
+        self.orphans = {}
+        self.resume_timeout = resume_timeout
+        # guid -> game id, of the players admitted to running games, who go back to their game if they join again
+        self.reserved = {}
+
+        # Game master connections that take games moved from others (see migrate_game)
+        self.standby = set()
+        # Longest pause of a game being moved, in seconds, before the move is given up
+        self.migrate_timeout = migrate_timeout
+
+        # Traffic and latency counters (see stats.py), and those of the game whose frame is being routed
+        self.stats = RelayStats()
+        self.routing_game = None
+        # Records the spans of traced frames (see common/tracing.py), None to not trace
+        self.tracer = None
+
+    def join(self, player):
+        """ Sends a joining player to a game with a free slot, or keeps them in the lobby """
+        game_id = self.reserved.get(player.guid)
+        if game_id is not None:
+            orphan = self.orphans.get(game_id)
+            if orphan is not None:
+                print("Waiting for game", game_id, "to resume", player.guid)
+                player.game = orphan
+                orphan.players[player.guid] = player
+                return
+            game = self.games.get(game_id)
+            if game is not None:
+                # Joining again, the game master continues from where the player was
+                self.send_to_game(game, player)
                 return
-            guid = parsed_json["userGuid"]
-
-            if "result" not in parsed_json:
-                self.factory.game_master.message(data)
-                self.factory.waitroom[guid] = Player(addr, guid)
-
-            if "result" in parsed_json:
-                if parsed_json["result"] == "OK":
-                    self.factory.players[guid] = (self.factory.waitroom.pop(guid))
-                    self.factory.players[guid].address.message(data)
-
-                if parsed_json["result"] == "denied":
-                    self.factory.waitroom[guid].address.message(data)
-                    self.factory.waitroom[guid].address.transport.loseConnection()
-                    self.factory.waitroom.pop(guid)
-
-        elif action == "end":
-            print("GameOver", addr)
-            # send message to all players
-            for guid in self.factory.players:
-                self.factory.players[guid].address.message(data)
-
-        elif action == "exchange":
-            if "receiverGuid" in parsed_json:
-                print("AuthorizeKnowledgeExchange", addr)
-                if addr != self.factory.game_master:
-                    self.factory.game_master.message(data)
-                else:
-                    receiver_guid = parsed_json["receiverGuid"]
-                    self.factory.players[receiver_guid].address.message(data)
-            elif "result" and "userGuid" in parsed_json:
-                print("{Accept,Reject}KnowledgeExchange", addr)
-                if addr != self.factory.game_master:
-                    self.factory.game_master.message(data)
-                else:
-                    guid = parsed_json["userGuid"]
-                    self.factory.players[guid].address.message(data)
 
-        elif action == "send":
-            if "receiverGuid" in parsed_json:
-                if addr != self.factory.game_master:
-                    self.factory.game_master.message(data)
-                else:
-                    print("Data", addr)
-                    receiver_guid = parsed_json["receiverGuid"]
-                    self.factory.players[receiver_guid].address.message(data)
+        game = self.open_game()
+        if game is None:
+            print("Lobby", player.guid)
+            self.lobby.append(player)
+            return
+        self.send_to_game(game, player)
+
+    def send_to_game(self, game, player):
+        player.game = game
+        game.waitroom[player.guid] = player
+
+        # The game master may host several games, tell it which one the player goes to
+        parsed_json = dict(player.join_message)
+        parsed_json["gameId"] = game.id
+        game.send(Frame(parsed_json))
+
+    def join_result(self, game, guid, result, frame):
+        """ Handles the game master's answer to a join """
+        if game is None or guid not in game.waitroom:
+            print("ERROR: UNKNOWN JOIN", guid)
+            return
+        player = game.waitroom.pop(guid)
+
+        if result == "OK":
+            game.players[guid] = player
+            game.guids.add(guid)
+            self.players[guid] = player
+            self.reserved[guid] = game.id
+            player.address.message(frame)
+            return
+
+        # The game is full, try another one before giving up
+        game.slots = len(game.players) + len(game.waitroom)
+        if self.open_game() is not None:
+            self.join(player)
+            return
+
+        player.address.message(frame)
+        player.address.close()
+
+    def open_game(self):
+        """ Returns the fullest game that can still take a player, so games start as soon as possible """
+        best = None
+        for game in self.games.values():
+            if game.is_open() and (best is None or len(game.players) + len(game.waitroom) > len(best.players) + len(best.waitroom)):
+                best = game
+        return best
+
+    def fill_lobby(self):
+        waiting = self.lobby
+        self.lobby = []
+        for player in waiting:
+            self.join(player)
+
+    def remove_game(self, game):
+        self.games.pop(game.id, None)
+        self.spectators.end(game.id)
+        game.game_master.games.pop(game.id, None)
+        for guid in game.players:
+            self.players.pop(guid, None)
+        for guid in game.guids:
+            if self.reserved.get(guid) == game.id:
+                del self.reserved[guid]
+
+    def orphan_game(self, game):
+        """ Keeps a running game whose game master was lost, its players and spectators wait for it to resume """
+        if game.migration is not None:
+            # Frames held for the game are lost with it, its players are sent again when it resumes
+            game.migration.cancel_timeout()
+            game.migration = None
+        self.games.pop(game.id, None)
+        game.game_master.games.pop(game.id, None)
+        for guid, player in game.players.items():
+            self.players.pop(guid, None)
+            # The requests are lost with the game master
+            player.forget_requests()
+        # Players not confirmed yet join again with the others
+        game.players.update(game.waitroom)
+        game.waitroom = {}
+        self.orphans[game.id] = game
+        self.clock.callLater(self.resume_timeout, self.expire_orphan, game)
+
+    def expire_orphan(self, game):
+        if self.orphans.get(game.id) is not game:
+            return
+        print("Game", game.id, "was not resumed")
+        del self.orphans[game.id]
+        self.remove_game(game)
+
+    def resume_game(self, game, orphan):
+        """ Sends the players of a game registered again by a new game master back to it """
+        print("Resuming game", game.id, "with", len(orphan.players), "players")
+        game.started = True
+        game.guids = orphan.guids
+        for player in orphan.players.values():
+            self.send_to_game(game, player)
+
+    # ======== Migration ========
+    # A running game is moved to another game master without ending it: the game master is asked to freeze the
+    #   game (MigrateGame) and answers with its state (GameState), which a standby game master adopts (AdoptGame).
+    # From the freeze request on, the frames sent to the game are held by the server, then sent in order to the
+    #   new game master once it confirms. Frames sent before the request reach the old game master first, on the same
+    #   connection, and are in the state (as actions waiting for their delay), so none is lost or played twice.
+    # A game master that does not freeze the game within migrate_timeout is told to keep it (CancelMigration), the
+    #   frames are held until it answers: it keeps the game, or it had frozen it already and the move goes on.
+    # A game master that does not adopt the game within migrate_timeout, denies it or is lost is replaced by another
+    #   one, then by the old game master, which keeps the state until told another one runs the game
+    #   (ConfirmAdoptGame). If none adopts it, the game is orphaned, to be resumed from the old game master's
+    #   checkpoint.
+
+    def migrate_game(self, game):
+        """ Starts moving a game to the standby game master with the most room, returns whether it could """
+        if game.migration is not None or game.id not in self.games:
+            return False
+        target = self.migration_target(game.game_master)
+        if target is None:
+            print("ERROR: NO GAME MASTER TO MOVE", game.id, "TO")
+            return False
+        print("Migrating game", game.id, "to", target)
+        # Results of the requests sent before the freeze come from either game master, after the pause
+        for player in game.players.values():
+            player.forget_requests()
+        game.migration = Migration(target, time.perf_counter())
+        game.migration.timeout = self.clock.callLater(self.migrate_timeout, self.migration_timeout, game)
+        game.game_master.message(Frame({"action": m.MigrateGame.action, "gameId": game.id}))
+        return True
+
+    def migration_target(self, source, tried=()):
+        best = None
+        for gm in self.standby:
+            if gm is source or gm in tried or len(gm.games) >= gm.capacity:
+                continue
+            if best is None or gm.capacity - len(gm.games) > best.capacity - len(best.games):
+                best = gm
+        return best
+
+    def adopt_game(self, game, state):
+        """ Hands the state of a frozen game to its new game master """
+        migration = game.migration
+        migration.adopting = True
+        migration.state = state
+        # The old game master is done with the game, losing it now does not orphan the game
+        game.game_master.games.pop(game.id, None)
+        self.offer_game(game)
+
+    def offer_game(self, game):
+        """ Sends the state of a frozen game to its target, or to the next game master that may adopt it """
+        migration = game.migration
+        migration.cancel_timeout()
+        source = game.game_master
+        if migration.target is None:
+            migration.target = self.migration_target(source, migration.tried)
+        if migration.target is None and source in self.clients and source not in migration.tried:
+            # The old game master takes it back
+            migration.target = source
+        if migration.target is None:
+            print("ERROR: GAME", game.id, "WAS NOT ADOPTED")
+            if source in self.clients:
+                # It keeps the checkpoint of the game, to resume it from
+                source.message(Frame({"action": m.ConfirmAdoptGame.action, "result": "denied", "gameId": game.id}))
+            self.orphan_game(game)
+            return
+        migration.timeout = self.clock.callLater(self.migrate_timeout, self.migration_timeout, game)
+        migration.target.message(Frame({"action": m.AdoptGame.action, "gameId": game.id, "state": migration.state}))
 
+    def migrated(self, game):
+        migration = game.migration
+        game.migration = None
+        migration.cancel_timeout()
+        source = game.game_master
+        game.game_master = migration.target
+        migration.target.games[game.id] = game
+        if source is not migration.target and source in self.clients:
+            # The old game master drops the state it kept
+            source.message(Frame({"action": m.ConfirmAdoptGame.action, "result": "OK", "gameId": game.id}))
+        for frame in migration.held:
+            game.game_master.message(frame)
+        pause = (time.perf_counter() - migration.start) * 1000
+        print(f"Migrated game {game.id} in {pause:.1f} ms, {len(migration.held)} frames held")
+
+    def end_migration(self, game):
+        """ Gives up moving a game its game master still runs """
+        migration = game.migration
+        game.migration = None
+        migration.cancel_timeout()
+        for frame in migration.held:
+            game.game_master.message(frame)
+
+    def migration_failed(self, game):
+        """ The target did not adopt the frozen game, it is offered to the next game master """
+        migration = game.migration
+        print("ERROR: GAME", game.id, "WAS NOT ADOPTED BY", migration.target)
+        migration.tried.add(migration.target)
+        migration.target = None
+        self.offer_game(game)
+
+    def migration_timeout(self, game):
+        migration = game.migration
+        print("ERROR: MIGRATION OF", game.id, "TIMED OUT")
+        if migration.adopting:
+            self.migration_failed(game)
+        elif not migration.cancelled:
+            # Its state may be on the way already, the frames are held until the game master answers
+            migration.cancelled = True
+            migration.timeout = self.clock.callLater(self.migrate_timeout, self.migration_timeout, game)
+            game.game_master.message(Frame({"action": m.CancelMigration.action, "gameId": game.id}))
         else:
-            # all other gameplay messages
-            if "userGuid" in parsed_json:
-                if "result" in parsed_json:
-                    guid = parsed_json["userGuid"]
-                    self.factory.players[guid].address.message(data)
-                else:
-                    self.factory.game_master.message(data)
+            print("ERROR: GAME MASTER OF", game.id, "DOES NOT ANSWER")
+            self.orphan_game(game)
+
+    def game_of_player(self, guid):
+        player = self.players.get(guid)
+        return player.game if player is not None else None
+
+    def stats_report(self, game_id=None):
+        """ Counters of the relay, its connections and its games (all of them, or game_id only) """
+        games = [g for g in self.games.values() if game_id is None or g.id == game_id]
+        return {
+            "relay": self.stats.to_dict(),
+            "connections": [] if game_id is not None else [dict(
+                c.counters.to_dict(), peer=f"{c.transport.getPeer().host}:{c.transport.getPeer().port}",
+                kind=c.kind(), queue=c.writer.depth()) for c in self.clients],
+            "games": [dict(g.counters.to_dict(), id=g.id, started=g.started, players=len(g.players),
+                           gm=g.game_master.transport.getPeer().port) for g in games],
+        }
+
+    def queue_report(self, count=5):
+        """ Depth of the deepest send queues, in bytes """
+        deepest = sorted(self.clients, key=lambda c: (c.writer.depth(), c.writer.max_depth), reverse=True)[:count]
+        peers = [f"{c.kind()} {c.transport.getPeer().port}: {c.writer.depth()} (max {c.writer.max_depth})" for c in deepest]
+        return ", ".join(peers) if peers else "no connections"
+
+    def remove_player(self, guid, address):
+        """ Forgets the player of a lost connection, unless the player joined again on another connection """
+        player = self.players.get(guid)
+        if player is not None and player.address is address:
+            del self.players[guid]
+            player.game.players.pop(guid, None)
+        for game in list(self.games.values()) + list(self.orphans.values()):
+            for players in (game.waitroom, game.players):
+                if guid in players and players[guid].address is address:
+                    del players[guid]
+        self.lobby = [p for p in self.lobby if p.address is not address]
 
 
 if __name__ == '__main__':
 
     def usage():
-        print("usage:", sys.argv[0], "[--port=<port> | -p <port>]")
+        print("usage:", sys.argv[0], "[--port=<port> | -p <port>] [--max-games=<count>] [--max-frame=<bytes>]",
+              "[--high-watermark=<bytes>] [--low-watermark=<bytes>] [--policy=<gm|player|spectator>:<pause|drop|disconnect>]...",
+              "[--resume-timeout=<seconds>] [--migrate-timeout=<seconds>] [--admin-port=<port>]",
+              "[--trace=<directory>]")
 
     port = -1
+    max_games = 1000
+    max_frame = framing.MAX_LENGTH
+    watermarks = {"high": 1 << 20, "low": 1 << 18}
+    policies = {}
+    resume_timeout = 60.0
+    migrate_timeout = 5.0
+    admin_port = None
+    trace = None
 
     try:
-        opts, args = getopt.gnu_getopt(sys.argv[1:], "hp:", ["help", "port="])
+        opts, args = getopt.gnu_getopt(sys.argv[1:], "hp:", ["help", "port=", "max-games=", "max-frame=", "high-watermark=", "low-watermark=", "policy=", "resume-timeout=", "migrate-timeout=", "admin-port=", "trace="])
         for opt, value in opts:
             if opt in ("-h", "--help"):
                 usage()
@@ -146,6 +811,62 @@ if __name__ == '__main__':
                     print("ERROR: Given port number is not a digit")
                     usage()
                     sys.exit(2)
+            elif opt == "--max-games":
+                if str.isdigit(value):
+                    max_games = int(value)
+                else:
+                    print("ERROR: Given game count is not a digit")
+                    usage()
+                    sys.exit(2)
+            elif opt == "--max-frame":
+                if str.isdigit(value):
+                    max_frame = int(value)
+                else:
+                    print("ERROR: Given frame size is not a digit")
+                    usage()
+                    sys.exit(2)
+            elif opt in ("--high-watermark", "--low-watermark"):
+                if str.isdigit(value):
+                    watermarks[opt[2:-len("-watermark")]] = int(value)
+                else:
+                    print("ERROR: Given watermark is not a digit")
+                    usage()
+                    sys.exit(2)
+            elif opt == "--policy":
+                kind, _, policy = value.partition(":")
+                if kind not in POLICIES or policy not in ("pause", "drop", "disconnect") \
+                        or (policy == "drop" and kind != "spectator"):
+                    print("ERROR: Unknown policy", value, "(only spectators can drop frames)")
+                    usage()
+                    sys.exit(2)
+                policies[kind] = policy
+            elif opt == "--resume-timeout":
+                try:
+                    resume_timeout = float(value)
+                except ValueError:
+                    resume_timeout = -1
+                if resume_timeout < 0:
+                    print("ERROR: Given timeout is not a number of seconds")
+                    usage()
+                    sys.exit(2)
+            elif opt == "--migrate-timeout":
+                try:
+                    migrate_timeout = float(value)
+                except ValueError:
+                    migrate_timeout = -1
+                if migrate_timeout < 0:
+                    print("ERROR: Given timeout is not a number of seconds")
+                    usage()
+                    sys.exit(2)
+            elif opt == "--admin-port":
+                if str.isdigit(value):
+                    admin_port = int(value)
+                else:
+                    print("ERROR: Given port number is not a digit")
+                    usage()
+                    sys.exit(2)
+            elif opt == "--trace":
+                trace = value
     except getopt.GetoptError:
         usage()
         sys.exit(2)
@@ -154,11 +875,25 @@ if __name__ == '__main__':
         usage()
         sys.exit(2)
 
-    factory = protocol.ServerFactory()
-    factory.protocol = GameProtocol
-    factory.clients = []
-    factory.waitroom = {}
-    factory.players = {}
+    if watermarks["low"] > watermarks["high"]:
+        print("ERROR: The low watermark is above the high one")
+        sys.exit(2)
+
+    factory = GameFactory(max_games, max_frame, watermarks["high"], watermarks["low"], policies, resume_timeout,
+                          migrate_timeout)
+    if trace is not None:
+        factory.tracer = tracing.Tracer(trace, "relay")
+        reactor.addSystemEventTrigger("before", "shutdown", factory.tracer.close)
     print("Server starting on port", port)
     reactor.listenTCP(port, factory)
+    if admin_port is not None:
+        # Local only
+        print("Admin port", admin_port)
+        reactor.listenTCP(admin_port, AdminFactory(factory), interface="127.0.0.1")
+
+    def report():
+        print("Relay:", factory.stats)
+        print("Writes:", factory.write_stats)
+        print("Send queues:", factory.queue_report())
+    task.LoopingCall(report).start(30, now=False)
     reactor.run()
@@ -0,0 +1,116 @@
+import time
+
+# Spectators of the hosted games: guis and other observers, any number per game.
+# Gui frames of a game are published once to all its spectators: a frame is encoded once per encoding
+#   (json, binary) and the same bytes are written to every spectator using it.
+# The keyframe of each game and the deltas since are kept, so a spectator joining late starts from the
+#   current board. While the transport of a spectator that can't keep up is full (its send queue is paused,
+#   see common/framing.py) its frames are skipped, once it resumes it catches up from the kept keyframe,
+#   and if it stays paused for too long it is dropped. The game never waits for a spectator.
+
+# Deltas kept after a keyframe, a late spectator waits for the next keyframe when there are more
+MAX_HISTORY = 256
+
+
+class Spectator:
+    """ A connection watching a game (or every game, game_id None) """
+
+    def __init__(self, hub, connection, game_id):
+        self.hub = hub
+        self.connection = connection
+        self.game_id = game_id
+        # When a frame was first skipped because the connection's send queue is paused, None while it keeps up
+        self.paused_since = None
+        # Frames were skipped, the next frame sent has to be a keyframe
+        self.behind = False
+
+    # Called by the send queue of the connection when its transport takes frames again
+    def resumed(self):
+        self.paused_since = None
+        if self.behind:
+            self.hub.catch_up(self)
+
+
+class SpectatorHub:
+    """ Fans the gui frames of every game out to its spectators """
+
+    def __init__(self, max_stall=10.0):
+        # Seconds a spectator may stay paused before it is dropped
+        self.max_stall = max_stall
+        self.spectators = {}  # game id (None for all games) -> list of Spectator
+        self.history = {}     # game id -> [keyframe, deltas since], as frames
+
+    def add(self, connection, game_id=None):
+        """ Adds a spectator, it is sent the current board of the game right away """
+        spectator = Spectator(self, connection, game_id)
+        self.spectators.setdefault(game_id, []).append(spectator)
+        connection.writer.on_resume = spectator.resumed
+        spectator.behind = True
+        self.catch_up(spectator)
+        return spectator
+
+    def remove(self, connection):
+        for game_id, spectators in list(self.spectators.items()):
+            spectators = [s for s in spectators if s.connection is not connection]
+            if spectators:
+                self.spectators[game_id] = spectators
+            else:
+                del self.spectators[game_id]
+
+    def publish(self, game_id, frame, keyframe: bool):
+        """ Sends a gui frame of a game to its spectators """
+        if keyframe:
+            self.history[game_id] = [frame]
+        else:
+            history = self.history.get(game_id)
+            if history is not None:
+                if len(history) > MAX_HISTORY:
+                    del self.history[game_id]
+                else:
+                    history.append(frame)
+
+        now = None
+        for spectator in self._watching(game_id):
+            if spectator.connection.writer.paused:
+                # Downsampled to the keyframe it gets on resume, unless it has been stuck for too long
+                now = now or time.monotonic()
+                if spectator.paused_since is None:
+                    spectator.paused_since = now
+                if now - spectator.paused_since > self.max_stall:
+                    # Its buffered frames may never be read, so not waiting for them to be written
+                    print("Dropping slow spectator", spectator.connection)
+                    self.remove(spectator.connection)
+                    spectator.connection.transport.abortConnection()
+                else:
+                    spectator.behind = True
+                continue
+            if spectator.behind:
+                if not keyframe:
+                    continue
+                spectator.behind = False
+            spectator.connection.message(frame)
+
+    def end(self, game_id, frame=None):
+        """ Sends the game over frame (if any) of a game to its spectators and forgets the game """
+        self.history.pop(game_id, None)
+        if frame is not None:
+            for spectator in self._watching(game_id):
+                spectator.connection.message(frame)
+        for spectator in self.spectators.pop(game_id, ()):
+            spectator.connection.close()
+
+    def catch_up(self, spectator):
+        """ Sends the kept keyframe and deltas of the game(s) to a spectator that has none of them """
+        if spectator.game_id is None:
+            histories = list(self.history.values())
+        else:
+            histories = [self.history.get(spectator.game_id)]
+        for history in histories:
+            if history is None:
+                continue
+            for frame in history:
+                spectator.connection.message(frame)
+            spectator.behind = False
+
+    def _watching(self, game_id):
+        return self.spectators.get(game_id, []) + self.spectators.get(None, [])
@@ -0,0 +1,82 @@
+import common.metrics as mt
+
+# Traffic and latency counters of the relay, per connection, per game and for the whole relay.
+# For every frame received: its bytes, the time to read its routing keys (parse) and the time to route it, which
+#   includes queueing the frames it is forwarded as (route). For every frame queued: its bytes, counted for the
+#   receiving connection and for the game of the frame being routed. For the games: the time from a player's
+#   request being forwarded to the game master until its result is relayed back to the player (response),
+#   which tells whether the relay or the game master limits the throughput.
+# Times are kept as totals per connection and game, and in histograms (common/metrics.py) for the whole relay
+#   and for the responses of each game. Queried with the stats action of the admin port (see admin.py).
+
+
+class Counters:
+    """ Traffic of a connection or a game """
+
+    __slots__ = ('frames_in', 'frames_out', 'bytes_in', 'bytes_out', 'parse_time', 'route_time')
+
+    def __init__(self):
+        self.frames_in = 0
+        self.frames_out = 0
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.parse_time = 0.0
+        self.route_time = 0.0
+
+    def received(self, size, parse_time, route_time):
+        self.frames_in += 1
+        self.bytes_in += size
+        self.parse_time += parse_time
+        self.route_time += route_time
+
+    def sent(self, size):
+        self.frames_out += 1
+        self.bytes_out += size
+
+    def to_dict(self):
+        counters = {name: getattr(self, name) for name in Counters.__slots__}
+        counters['parse_time'] = round(self.parse_time, 6)
+        counters['route_time'] = round(self.route_time, 6)
+        return counters
+
+
+class GameCounters(Counters):
+    """ Traffic of a game, with the response time of its game master """
+
+    __slots__ = ('response',)
+
+    def __init__(self):
+        super().__init__()
+        self.response = mt.Histogram()
+
+    def to_dict(self):
+        counters = super().to_dict()
+        counters['response'] = histogram_dict(self.response)
+        return counters
+
+
+class RelayStats:
+    """ Counters of the whole relay """
+
+    def __init__(self):
+        self.total = Counters()
+        self.parse = mt.Histogram()
+        self.route = mt.Histogram()
+        self.response = mt.Histogram()
+
+    def to_dict(self):
+        return dict(self.total.to_dict(), parse=histogram_dict(self.parse), route=histogram_dict(self.route),
+                    response=histogram_dict(self.response))
+
+    def __str__(self):
+        total = self.total
+        return f'{total.frames_in} frames in, {total.frames_out} out, {total.bytes_in} bytes in, ' \
+               f'{total.bytes_out} out, parse p99 {self.parse.quantile(0.99) * 1e6:.0f} us, ' \
+               f'route p99 {self.route.quantile(0.99) * 1e6:.0f} us, ' \
+               f'gm response p50/p99 {self.response.quantile(0.5) * 1e3:.1f}/{self.response.quantile(0.99) * 1e3:.1f} ms'
+
+
+def histogram_dict(histogram):
+    """ Count and quantiles of a histogram, in seconds """
+    quantiles = {f'p{q * 100:g}': round(histogram.quantile(q), 6) for q in mt.QUANTILES}
+    return dict(count=histogram.count, mean=round(histogram.mean(), 6), max=round(histogram.max, 6), **quantiles)
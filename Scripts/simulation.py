@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import collections
+import contextlib
+import os
+import random
+import time
+import uuid
+
+import external as ext
+import common.clock as c
+import common.messages as m
+import common.settings as s
+import bot as b
+
+# Headless game runner, for measuring and tuning game logic throughput.
+# Connects a GmExternal directly to bot.Bot instances through their callbacks: no server,
+#   no sockets and no json. Games are run to completion one after the other, in virtual time
+#   (action delays are kept in order but not waited for) unless real time is asked for.
+
+
+class SimulationResult:
+    """ Outcome of a single simulated game """
+
+    def __init__(self, winner, actions: collections.Counter, wall_time: float):
+        # Winning team, None if the game did not finish in time
+        self.winner = winner
+        # Number of player actions sent to the gm, by message type
+        self.actions = actions
+        self.wall_time = wall_time
+
+    def action_count(self):
+        return sum(self.actions.values())
+
+    def __str__(self):
+        return f'winner: {self.winner}, actions: {self.action_count()} ({dict(self.actions)}), time: {self.wall_time:.3f}s'
+
+
+class Simulation:
+
+    def __init__(self, timeout: float = 600, real_time: bool = False, log_dir=None):
+        # Games still running after timeout (game time) seconds are stopped without a winner
+        self.timeout = timeout
+        self.real_time = real_time
+        # Directory of the logs of the games, the gm's default if None
+        self.log_dir = log_dir
+
+    # Runs one game with a full set of bots, returns its SimulationResult
+    # A seed makes the game and the bots play out the same every time, journal is the path to record the game in
+    def run(self, seed=None, journal=None):
+        if seed is not None:
+            # The bots draw from the global generator
+            random.seed(seed)
+        if self.real_time:
+            loop = asyncio.new_event_loop()
+            clock = c.LoopClock(loop)
+        else:
+            clock = c.VirtualClock()
+        settings = s.Settings()
+
+        bots = {}
+        actions = collections.Counter()
+        outcome = {'winner': None}
+
+        def server_callback(arg1):
+            if type(arg1) is m.GameOver:
+                outcome['winner'] = arg1.result
+                clock.stop()
+                return
+
+            bot = bots.get(getattr(arg1, 'id', None))
+            if bot is None:
+                return
+            if type(arg1) is m.ConfirmJoiningGame and arg1.result == 'denied':
+                bots.pop(bot.id)
+                return
+            bot.interpret_message(arg1)
+
+        gm = ext.GmExternal(server_callback, clock=clock, seed=seed, journal=journal, log_dir=self.log_dir)
+
+        def send_to_gm(msg):
+            actions[type(msg).__name__] += 1
+            gm.send_message(msg)
+
+        start = time.perf_counter()
+
+        for i in range(settings.player_count_per_team * 2):
+            id = uuid.uuid4()
+            team = 'red' if i % 2 == 0 else 'blue'
+            bots[id] = b.Bot(id=id, teamPref=team, callback=send_to_gm)
+            send_to_gm(m.JoinGame(id=id, preferred_team=team, type='player'))
+
+        if self.real_time:
+            loop.call_later(self.timeout, loop.stop)
+            loop.run_forever()
+            loop.close()
+        else:
+            clock.run(until=self.timeout)
+
+        return SimulationResult(outcome['winner'], actions, time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '-n', '--games', help='Number of games to run', type=int, default=1)
+    parser.add_argument(
+        '-t', '--timeout', help='Game time (seconds) after which a game is stopped', type=float, default=600)
+    parser.add_argument(
+        '-r', '--real-time', help='Wait out the action delays instead of using virtual time', action='store_true')
+    parser.add_argument(
+        '-v', '--verbose', help='Keep the output of the gm and bots', action='store_true')
+    parser.add_argument(
+        '-s', '--seed', help='Seed of the first game, the next games get the following ones', type=int)
+    parser.add_argument(
+        '-j', '--journal', help='Directory to record the journals of the games in (see replay.py)')
+
+    args = parser.parse_args()
+    simulation = Simulation(args.timeout, args.real_time)
+
+    results = []
+    start = time.perf_counter()
+    if args.journal is not None:
+        os.makedirs(args.journal, exist_ok=True)
+    for i in range(args.games):
+        seed = None if args.seed is None else args.seed + i
+        journal = None if args.journal is None else os.path.join(args.journal, f'game_{i + 1}.jsonl')
+        if args.verbose:
+            result = simulation.run(seed, journal)
+        else:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                result = simulation.run(seed, journal)
+        results.append(result)
+        print(f'> simulation: game {i + 1}: {result}')
+    elapsed = time.perf_counter() - start
+
+    wins = collections.Counter(r.winner for r in results)
+    actions = sum(r.action_count() for r in results)
+    print(f'> simulation: {len(results)} games in {elapsed:.2f}s, {len(results) / elapsed * 3600:.0f} games/hour')
+    print(f'> simulation: wins {dict(wins)}, {actions / elapsed:.0f} actions/s')
+
+
+if __name__ == '__main__':
+    main()
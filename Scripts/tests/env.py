@@ -1,5 +1,8 @@
+import atexit
+import shutil
 import sys
 import os
+import tempfile
 
 # Used as import in the testing files, to create the proper environment for them (python quirk)
 
@@ -10,4 +13,8 @@ sys.path.append(
             os.path.abspath(__file__)
         )
     )
-)
\ No newline at end of file
+)
+
+# Logs of the games played by the tests, kept out of the source tree
+LOG_DIR = tempfile.mkdtemp(prefix='gm-test-logs-')
+atexit.register(shutil.rmtree, LOG_DIR, True)
@@ -1,11 +1,14 @@
 import unittest
+import random
 
 import env
 
 import board as board
+import compact_board
 import common.settings as settings
 import common.square as square
 import common.player as player
+import common.piece as piece
 
 class BoardTest(unittest.TestCase):
 
@@ -33,6 +36,94 @@ class BoardTest(unittest.TestCase):
         self.assertEqual(piece_count,
                          self.settings.initial_piece_count)
 
+    def brute_force_distance(self, x, y):
+        dists = [abs(x - sq.x) + abs(y - sq.y) for sq in self.board.content if sq.piece is not None]
+        return min(dists) if dists else None
+
+    def test_piece_distance(self):
+        # Randomly add and remove pieces, distances should always match a full scan
+        for _ in range(200):
+            sq = random.choice(self.board.content)
+            sq.piece = None if sq.piece is not None else piece.Piece(is_sham=False)
+
+            for other in self.board.content:
+                self.assertEqual(self.board.piece_distance(other.x, other.y),
+                                 self.brute_force_distance(other.x, other.y))
+
+    def test_pieces_fill_task_area(self):
+        # More pieces than task squares fills the task area instead of looping forever
+        self.board.piece_count = len(self.board.task_area) + 5
+        self.board.random_select_pieces()
+
+        self.assertEqual(len(self.board.free_piece_cells), 0)
+        self.assertTrue(all(sq.piece is not None for sq in self.board.task_area))
+
+    def test_too_many_goal_fields(self):
+        self.board.goal_definition = len(self.board.goal_area_blue) + 1
+
+        with self.assertRaises(ValueError):
+            self.board.random_select_fields()
+
+    def test_free_player_square(self):
+        # Take all task squares but one
+        task = list(self.board.task_area)
+        for sq in task[1:]:
+            sq.player = player.GmPlayer(id=None, team='red')
+
+        self.assertEqual(self.board.random_free_player_square(), task[0])
+
+        task[0].player = player.GmPlayer(id=None, team='red')
+        self.assertIsNone(self.board.random_free_player_square())
+
+    def test_snapshot(self):
+        first = self.board.snapshot()
+
+        # Unchanged board gives the same snapshot
+        self.assertIs(self.board.snapshot(), first)
+
+        sq = self.board.get_square(0, 1)
+        sq.piece = piece.Piece(is_sham=True)
+        second = self.board.snapshot()
+
+        # Old snapshot is untouched, only the changed row is rendered again
+        self.assertEqual(second.get_cell(0, 1), 'S')
+        self.assertNotEqual(first.get_cell(0, 1), 'S')
+        self.assertIsNot(second.rows[1], first.rows[1])
+        self.assertIs(second.rows[0], first.rows[0])
+
+    def test_piece_distance_no_pieces(self):
+        for sq in self.board.content:
+            sq.piece = None
+
+        self.assertIsNone(self.board.piece_distance(0, 0))
+
+
+# Same checks, on the array backed board
+class CompactBoardTest(BoardTest):
+
+    def setUp(self):
+        self.settings = settings.Settings()
+        self.board = compact_board.CompactBoard(self.settings)
+        self.board.random_select_fields()
+        self.board.random_select_pieces()
+
+    def test_square_view(self):
+        sq = self.board.get_square(1, 2)
+        sq.discovered = True
+        sq.player = player.GmPlayer(id=None, team='red')
+
+        same = self.board.get_square(1, 2)
+        self.assertEqual(sq, same)
+        self.assertTrue(same.discovered)
+        self.assertEqual(same.get_type_msg(), 'player')
+        self.assertFalse(self.board.can_move(1, 2, 'blue'))
+
+    def test_goal_area_masks(self):
+        self.assertFalse(self.board.can_move(0, 0, 'red'))
+        self.assertTrue(self.board.can_move(0, 0, 'blue'))
+        self.assertTrue(self.board.in_goal_area(0, self.board.board_height - 1))
+        self.assertFalse(self.board.in_goal_area(0, self.board.goal_area_height))
+
 
 if __name__ == '__main__':
     unittest.main(exit=False)
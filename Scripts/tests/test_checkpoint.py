@@ -0,0 +1,137 @@
+import os.path as path
+import tempfile
+import unittest
+import uuid
+
+import env
+
+import external
+import common.checkpoint as ck
+import common.clock as clock
+import common.messages as m
+import common.settings as settings
+
+
+class CheckpointTest(unittest.TestCase):
+
+    def setUp(self):
+        self.sent = []
+        self.external = self.new_external(seed=5)
+        self.ids = [uuid.uuid4().hex for _ in range(6)]
+        for i, id in enumerate(self.ids):
+            self.external.send_message(m.JoinGame(id=id, preferred_team='red' if i % 2 else 'blue', type='player'))
+        for id in self.ids:
+            for direction in 'NNEWS':
+                self.external.send_message(m.Move(id=id, direction=direction))
+        self.external.clock.run(until=20)
+
+    def new_external(self, **kwargs):
+        return external.GmExternal(self.sent.append, clock=clock.VirtualClock(), log_dir=env.LOG_DIR, **kwargs)
+
+    def assert_same_game(self, first, second):
+        self.assertEqual(first.gm.board.snapshot().rows, second.gm.board.snapshot().rows)
+        self.assertEqual([(p.id, p.team, p.x, p.y, p.is_leader) for p in first.gm.players.values()],
+                         [(p.id, p.team, p.x, p.y, p.is_leader) for p in second.gm.players.values()])
+        self.assertEqual(first.gm.rng.getstate(), second.gm.rng.getstate())
+
+    def test_resume(self):
+        with tempfile.TemporaryDirectory() as directory:
+            checkpoint = path.join(directory, 'game.ck')
+            writer = ck.Writer(checkpoint)
+            writer.submit(ck.snapshot(self.external, 'game'))
+            writer.close()
+            writer.thread.join()
+            state = ck.load(checkpoint)
+
+        self.assertEqual(state['game'], 'game')
+        resumed = self.new_external(resume=state)
+        self.assert_same_game(self.external, resumed)
+        self.assertTrue(resumed.gm.started())
+
+        # Both games go on the same way
+        for ext in (self.external, resumed):
+            ext.gm.add_new_piece()
+            ext.send_message(m.Move(id=self.ids[0], direction='S'))
+            ext.clock.run(until=ext.clock.time() + 1)
+        self.assert_same_game(self.external, resumed)
+
+    def test_join_again(self):
+        self.sent.clear()
+        self.external.send_message(m.JoinGame(id=self.ids[0], preferred_team='red', type='player'))
+        self.external.clock.run(until=self.external.clock.time() + 1)
+
+        confirm, start = self.sent
+        self.assertEqual((type(confirm), confirm.result), (m.ConfirmJoiningGame, 'OK'))
+        player = self.external.gm.get_player(self.ids[0])
+        self.assertEqual((type(start), start.location), (m.GameMessage, {'x': player.x, 'y': player.y}))
+        self.assertEqual(len(self.external.gm.players), 6)
+
+    def test_freeze(self):
+        # Two copies of the game, one of them is moved to another gm
+        state = ck.capture(self.external)
+        kept = self.new_external(resume=ck.loads(state))
+        moved = self.new_external(resume=ck.loads(state))
+        for ext in (kept, moved):
+            ext.clock.run(until=25)
+            for id in self.ids:
+                ext.send_message(m.TestPiece(id=id))
+                ext.send_message(m.Move(id=id, direction='E'))
+            ext.clock.run(until=25.05)
+
+        # Handed over with the tests and the moves still waiting for their delay
+        state = moved.freeze()
+        self.assertEqual(len(ck.loads(state)['pending']), 12)
+        sent = []
+        adopted = external.GmExternal(sent.append, clock=clock.VirtualClock(), resume=ck.loads(state),
+                                       log_dir=env.LOG_DIR)
+
+        # The adopted game goes on like the one that was not moved, with the next new piece at the same time
+        self.sent.clear()
+        kept.clock.run(until=25.05 + 8)
+        adopted.clock.run(until=8)
+        self.assertEqual([(type(msg), msg.id) for msg in sent], [(type(msg), msg.id) for msg in self.sent])
+        self.assertEqual(len(sent), 12)
+        self.assert_same_game(kept, adopted)
+
+    def test_frozen_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            for adopted in (True, False):
+                checkpoint = path.join(directory, f'{adopted}.ck')
+                ext = self.new_external(resume=ck.loads(ck.capture(self.external)), checkpoint=checkpoint,
+                                        game_id='game')
+                ext.clock.run(until=25)
+                ext.send_message(m.Move(id=self.ids[0], direction='E'))
+                ext.clock.run(until=25.05)
+                state = ext.freeze()
+
+                # The frozen state is kept until the game runs on another gm, or to resume it from
+                ext.end_freeze(adopted)
+                self.assertEqual(path.exists(checkpoint), not adopted)
+            self.assertEqual(ck.load(checkpoint), ck.loads(state))
+            self.assertEqual(len(ck.load(checkpoint)['pending']), 1)
+
+    def test_compact_board(self):
+        compact = settings.Settings()
+        compact.compact_board = True
+        ext = self.new_external(seed=5, settings=compact)
+        for i, id in enumerate(self.ids):
+            ext.send_message(m.JoinGame(id=id, preferred_team='red' if i % 2 else 'blue', type='player'))
+        for id in self.ids:
+            ext.send_message(m.Move(id=id, direction='N'))
+        ext.clock.run(until=20)
+        for x in range(3):
+            ext.gm.board.get_square(x, 4).discovered = True
+
+        # Later changes of the board are not in the snapshot, it is packed from a copy
+        snapshot = ck.snapshot(ext, 'game')
+        state = ck.capture(ext, 'game')
+        ext.gm.add_new_piece()
+        self.assertEqual(ck.pack(snapshot), state)
+
+        resumed = self.new_external(resume=ck.loads(state), settings=settings.Settings())
+        self.assertTrue(resumed.gm.settings.compact_board)
+        self.assertEqual(ck.loads(state)['cells'], ck.loads(ck.capture(resumed))['cells'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+
+import env
+
+import common.clock as clock
+import common.delay as d
+import simulation
+
+
+class VirtualClockTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = clock.VirtualClock()
+        self.calls = []
+
+    def record(self, name):
+        self.calls.append((name, self.clock.time()))
+
+    def test_order_follows_delays(self):
+        self.clock.call_later(d.Delay.KNOWLEDGE, self.record, 'knowledge')
+        self.clock.call_later(d.Delay.MOVE, self.record, 'move')
+        self.clock.call_later(d.Delay.DISCOVER, self.record, 'discover')
+        self.clock.call_soon(self.record, 'soon')
+
+        self.clock.run()
+
+        self.assertEqual([c[0] for c in self.calls], ['soon', 'move', 'discover', 'knowledge'])
+        self.assertEqual(self.clock.time(), d.Delay.KNOWLEDGE)
+
+    def test_same_time_keeps_scheduling_order(self):
+        for i in range(5):
+            self.clock.call_later(1, self.record, i)
+
+        self.clock.run()
+
+        self.assertEqual([c[0] for c in self.calls], list(range(5)))
+
+    def test_nested_scheduling_is_relative(self):
+        self.clock.call_later(2, lambda: self.clock.call_later(1, self.record, 'inner'))
+
+        self.clock.run()
+
+        self.assertEqual(self.calls, [('inner', 3)])
+
+    def test_run_until_and_cancel(self):
+        self.clock.call_later(1, self.record, 'early')
+        self.clock.call_later(10, self.record, 'late')
+        self.clock.call_later(2, self.record, 'cancelled').cancel()
+
+        self.clock.run(until=5)
+
+        self.assertEqual(self.calls, [('early', 1)])
+        self.assertEqual(self.clock.pending(), 1)
+
+    def test_stop(self):
+        self.clock.call_later(1, self.clock.stop)
+        self.clock.call_later(2, self.record, 'after stop')
+
+        self.clock.run()
+
+        self.assertEqual(self.calls, [])
+
+
+class SimulationTest(unittest.TestCase):
+
+    def test_game_in_virtual_time(self):
+        result = simulation.Simulation(timeout=3600, log_dir=env.LOG_DIR).run()
+
+        self.assertGreater(result.action_count(), 0)
+        self.assertIn(result.winner, ['red', 'blue', None])
+
+
+if __name__ == '__main__':
+    unittest.main(exit=False)
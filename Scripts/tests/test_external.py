@@ -23,7 +23,7 @@ class ExternalTest(unittest.TestCase):
 
     def setUp(self):
         global current_msg
-        self.external = external.GmExternal(server, gui_callback)
+        self.external = external.GmExternal(server, gui_callback, log_dir=env.LOG_DIR)
 
     def test_register_exchange(self):
         # Add recipient to game
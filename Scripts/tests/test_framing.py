@@ -0,0 +1,142 @@
+import unittest
+
+import env
+
+import common.framing as framing
+
+
+class FramingTest(unittest.TestCase):
+
+    def setUp(self):
+        self.frames = [b'{"action": "move"}', b'\x01\x05 binary', b'x' * 100000, b'end']
+
+    def feed_in_chunks(self, decoder, stream, size):
+        received = []
+        for i in range(0, len(stream), size):
+            received += decoder.feed(stream[i:i + size])
+        return received
+
+    def test_fragmented(self):
+        for length_prefixed in (False, True):
+            stream = b''.join(framing.encode(f, length_prefixed) for f in self.frames)
+            for size in (1, 7, 4096, len(stream)):
+                decoder = framing.FrameDecoder(length_prefixed=length_prefixed)
+                self.assertEqual(self.feed_in_chunks(decoder, stream, size), self.frames)
+                self.assertEqual(decoder.pending(), 0)
+
+    def test_partial_frame_is_kept(self):
+        decoder = framing.FrameDecoder()
+        self.assertEqual(decoder.feed(b'\x17a\x17\x17b'), [b'a'])
+        self.assertEqual(decoder.pending(), 1)
+        self.assertEqual(decoder.feed(memoryview(b'c\x17')), [b'bc'])
+
+    def test_buffer_is_compacted(self):
+        decoder = framing.FrameDecoder()
+        for _ in range(100):
+            decoder.feed(b'y' * 5000 + b'\x17' + b'z' * 10)
+        self.assertLess(len(decoder.buffer), 200000)
+        self.assertEqual(decoder.feed(b'\x17'), [b'z' * 10])
+
+    def test_max_length(self):
+        decoder = framing.FrameDecoder(max_length=10)
+        self.assertEqual(decoder.feed(b'0123456789\x17'), [b'0123456789'])
+        with self.assertRaises(ValueError):
+            decoder.feed(b'0123456789a')
+
+        decoder = framing.FrameDecoder(max_length=10, length_prefixed=True)
+        with self.assertRaises(ValueError):
+            # Known from the prefix, before the frame is received
+            decoder.feed(framing.encode(b'0123456789a', True)[:6])
+
+    def test_writes_are_batched(self):
+        transport = FakeTransport()
+        calls = []
+        writer = framing.FrameWriter(transport, lambda delay, f: calls.append(f) or FakeCall(), max_pending=100)
+        for frame in self.frames[:2]:
+            writer.write(frame)
+        self.assertEqual(transport.writes, [])
+        calls.pop()()
+        self.assertEqual(transport.writes, [b'{"action": "move"}\x17\x01\x05 binary\x17'])
+        self.assertEqual(writer.stats.saved(), 1)
+
+        # Large batches are written without waiting
+        writer.write(b'x' * 200)
+        self.assertEqual(len(transport.writes), 2)
+        self.assertEqual((writer.stats.frames, writer.stats.writes), (3, 2))
+
+    def test_length_prefixed_writes(self):
+        transport = FakeTransport()
+        calls = []
+        writer = framing.FrameWriter(transport, lambda delay, f: calls.append(f) or FakeCall(), max_pending=100,
+                                     length_prefixed=True)
+        for frame in self.frames[:2]:
+            writer.write(frame)
+        calls.pop()()
+        self.assertEqual(transport.writes, [b''.join(framing.encode(f, True) for f in self.frames[:2])])
+        self.assertEqual(framing.FrameDecoder(length_prefixed=True).feed(transport.writes[0]), self.frames[:2])
+        self.assertEqual(writer.stats.bytes, len(transport.writes[0]))
+        self.assertEqual(writer.depth(), 0)
+
+    def test_framing_of_first_bytes(self):
+        for frame in self.frames + [b'gui binary']:
+            self.assertTrue(framing.is_length_prefixed(framing.encode(frame, True)))
+            self.assertFalse(framing.is_length_prefixed(framing.encode(frame)))
+
+    def test_queue_watermarks(self):
+        transport = FakeTransport(buffer_size=50)
+        writer = framing.FrameWriter(transport, lambda delay, f: FakeCall(), max_pending=20,
+                                     high_watermark=100, low_watermark=30)
+        events = []
+        writer.on_high = lambda: events.append('high')
+        writer.on_low = lambda: events.append('low')
+
+        # Frames wait in the queue while the transport is full
+        for _ in range(17):
+            writer.write(b'x' * 9)
+        self.assertTrue(writer.paused)
+        self.assertEqual(events, ['high'])
+        self.assertGreater(writer.depth(), 100)
+
+        # Resuming hands over frames until the transport is full again
+        transport.drain()
+        self.assertTrue(writer.paused)
+        self.assertEqual(events, ['high'])
+        while writer.depth() > 0:
+            transport.drain()
+        self.assertEqual(events, ['high', 'low'])
+        self.assertFalse(writer.congested)
+        self.assertEqual(writer.max_depth, 110)
+
+
+class FakeTransport:
+
+    def __init__(self, buffer_size=None):
+        self.writes = []
+        self.producer = None
+        # The producer is paused when more than this is written, like a full socket buffer
+        self.buffer_size = buffer_size
+
+    def registerProducer(self, producer, streaming):
+        self.producer = producer
+
+    def writeSequence(self, data):
+        self.writes.append(b''.join(data))
+        if self.buffer_size is not None and len(b''.join(self.writes)) > self.buffer_size:
+            self.producer.pauseProducing()
+
+    def drain(self):
+        self.writes = []
+        self.producer.resumeProducing()
+
+
+class FakeCall:
+
+    def active(self):
+        return True
+
+    def cancel(self):
+        pass
+
+
+if __name__ == '__main__':
+    unittest.main()
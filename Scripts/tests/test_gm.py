@@ -1,5 +1,4 @@
 import unittest
-import pubsub as ps
 import uuid
 
 import env
@@ -26,7 +25,7 @@ class GMTest(unittest.TestCase):
         self.settings = settings.Settings()
         self.gm = gm.GM(self.settings)
         self.current_msg = current_msg
-        ps.pub.subscribe(server, 'server')
+        self.gm.bus.subscribe('server', server)
 
     def fill_game(self):
         # Fill game with players
@@ -41,6 +40,15 @@ class GMTest(unittest.TestCase):
 
         self.assertEqual(m.Message, type(current_msg))
 
+    def test_sending_is_per_game(self):
+        other = gm.GM(self.settings)
+        received = []
+        other.bus.subscribe('server', received.append)
+
+        self.gm.send(m.Message())
+
+        self.assertEqual(received, [])
+
     def test_join_game(self):
         pl = player.GmPlayer(id=uuid.uuid4(), team='blue')
         msg = m.JoinGame(id=pl.id, preferred_team='red', type='player')
@@ -0,0 +1,138 @@
+import json
+import queue
+import unittest
+
+import env
+
+from twisted.internet import error, task
+from twisted.internet.testing import StringTransport
+from twisted.python import failure
+
+import gm_host
+import common.framing as framing
+import common.messages as m
+
+
+class StubWorker:
+    """ Stands in for a worker process, the items the host sends it are kept in its inbox """
+
+    def __init__(self):
+        self.inbox = queue.Queue()
+        self.games = set()
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+    def items(self):
+        """ Items put in the inbox since the last call """
+        items = []
+        while not self.inbox.empty():
+            items.append(self.inbox.get())
+        return items
+
+
+def with_game(msg, game_id):
+    msg.gameId = game_id
+    return msg
+
+
+class GmHostTest(unittest.TestCase):
+
+    def setUp(self):
+        self.clock = task.Clock()
+        # No worker process is started, the stubs take their place
+        self.factory = gm_host.GmHostFactory(0, 2, clock=self.clock)
+        self.workers = self.factory.workers = [StubWorker(), StubWorker()]
+        self.host = self.factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.host.makeConnection(self.transport)
+
+    def tearDown(self):
+        self.host.connectionLost(failure.Failure(error.ConnectionDone()))
+
+    def send(self, msg):
+        data = msg if isinstance(msg, bytes) else msg.to_json().encode()
+        self.host.dataReceived(data + framing.DELIMITER)
+
+    def sent(self):
+        """ Frames written to the server since the last call, once the batched writes are flushed """
+        self.clock.advance(0)
+        data = self.transport.value()
+        self.transport.clear()
+        return [json.loads(frame) for frame in data.split(framing.DELIMITER) if frame]
+
+    def start_games(self, *game_ids):
+        """ Answers the registrations of the host with the given game ids """
+        self.sent()
+        for game_id in game_ids:
+            self.send(with_game(m.ConfirmSetUpGame('OK'), game_id))
+
+    def test_registers_games(self):
+        self.assertEqual(self.sent(), [{'action': 'start', 'slots': self.factory.slots}] * 2)
+
+    def test_least_loaded_worker(self):
+        self.workers[0].games.add('busy')
+        self.start_games('a', 'b', 'c')
+        self.assertEqual(self.workers[0].items(), [('new', 'b')])
+        self.assertEqual(self.workers[1].items(), [('new', 'a'), ('new', 'c')])
+        self.assertEqual(self.workers[0].games, {'busy', 'b'})
+        self.assertEqual(self.workers[1].games, {'a', 'c'})
+
+    def test_routed_by_game_then_player(self):
+        self.start_games('a', 'b')
+        for worker in self.workers:
+            worker.items()
+
+        join = with_game(m.JoinGame(id='p1', preferred_team='red', type='player'), 'b').to_json().encode()
+        self.send(join)
+        move = m.Move(id='p1', direction='N').to_json().encode()
+        self.send(move)
+        self.assertEqual(self.workers[1].items(), [('msg', 'b', join), ('msg', 'b', move)])
+
+        # Unknown games and players are dropped
+        self.send(with_game(m.JoinGame(id='p2', preferred_team='red', type='player'), 'x'))
+        self.send(m.Move(id='p3', direction='N'))
+        self.assertEqual(self.workers[0].items() + self.workers[1].items(), [])
+
+    def test_malformed_lines_skipped(self):
+        self.start_games('a')
+        self.workers[0].items()
+        self.send(b'{"action": ')
+        self.send(b'[]')
+        self.assertFalse(self.transport.disconnecting)
+
+        join = with_game(m.JoinGame(id='p1', preferred_team='red', type='player'), 'a').to_json().encode()
+        self.send(join)
+        self.assertEqual(self.workers[0].items(), [('msg', 'a', join)])
+
+    def test_finished_game_replaced(self):
+        self.start_games('a', 'b')
+        self.send(with_game(m.JoinGame(id='p1', preferred_team='red', type='player'), 'a'))
+
+        self.host.handle_worker_item(('done', 'a'))
+        self.assertEqual(self.sent(), [{'action': 'start', 'slots': self.factory.slots}])
+        self.assertEqual(list(self.host.games), ['b'])
+        self.assertEqual(self.host.players, {})
+        self.assertEqual(self.workers[0].games, set())
+
+    def test_drain(self):
+        self.start_games('a', 'b')
+        self.host.drain()
+        self.assertEqual(self.sent(), [{'action': 'migrate', 'gameId': 'a'}, {'action': 'migrate', 'gameId': 'b'}])
+        for game_id in ('a', 'b'):
+            self.send(with_game(m.MigrateGame(), game_id))
+        self.assertEqual(self.workers[0].items(), [('new', 'a'), ('freeze', 'a')])
+
+        # No new game is requested, the host shuts down with its last game gone
+        self.host.handle_worker_item(('state', 'a', b'state'))
+        self.assertEqual([(frame['action'], frame['result'], frame['gameId']) for frame in self.sent()],
+                         [('migrate', 'OK', 'a')])
+        self.assertFalse(self.transport.disconnecting)
+        self.host.handle_worker_item(('state', 'b', b'state'))
+        self.assertEqual(len(self.sent()), 1)
+        self.assertTrue(self.transport.disconnecting)
+
+
+if __name__ == '__main__':
+    unittest.main()
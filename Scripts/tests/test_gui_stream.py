@@ -0,0 +1,61 @@
+import unittest
+
+import env
+
+import board
+import gui_stream
+import common.settings as settings
+import common.messages as m
+import common.piece as piece
+
+
+class GuiStreamTest(unittest.TestCase):
+
+    def setUp(self):
+        self.board = board.Board(settings.Settings())
+        self.stream = gui_stream.GuiStream(keyframe_interval=3)
+
+    def test_first_frame_is_keyframe(self):
+        self.stream.push(self.board.snapshot())
+        frame = self.stream.next_frame()
+
+        self.assertEqual(type(frame), m.GuiMessage)
+        self.assertEqual(len(frame.board), self.board.board_height)
+
+    def test_no_frame_without_changes(self):
+        self.stream.push(self.board.snapshot())
+        self.stream.next_frame()
+
+        self.assertIsNone(self.stream.next_frame())
+        self.stream.push(self.board.snapshot())
+        self.assertIsNone(self.stream.next_frame())
+
+    def test_changes_are_coalesced(self):
+        self.stream.push(self.board.snapshot())
+        self.stream.next_frame()
+
+        # Several changes between two frames end up in a single delta
+        self.board.get_square(1, 1).piece = piece.Piece(is_sham=False)
+        self.stream.push(self.board.snapshot())
+        self.board.get_square(2, 3).piece = piece.Piece(is_sham=True)
+        self.stream.push(self.board.snapshot())
+
+        frame = self.stream.next_frame()
+        self.assertEqual(type(frame), m.GuiDelta)
+        self.assertEqual(frame.cells, [[1, 1, 'P'], [2, 3, 'S']])
+
+    def test_periodic_keyframe(self):
+        self.stream.push(self.board.snapshot())
+        self.stream.next_frame()
+
+        types = []
+        for x in range(4):
+            self.board.get_square(x, 2).piece = piece.Piece(is_sham=False)
+            self.stream.push(self.board.snapshot())
+            types.append(type(self.stream.next_frame()))
+
+        self.assertEqual(types, [m.GuiDelta, m.GuiDelta, m.GuiDelta, m.GuiMessage])
+
+
+if __name__ == '__main__':
+    unittest.main(exit=False)
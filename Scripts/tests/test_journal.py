@@ -0,0 +1,38 @@
+import contextlib
+import io
+import os.path as path
+import tempfile
+import unittest
+
+import env
+
+import common.settings as s
+import gm as g
+import replay
+import simulation
+
+
+class JournalTest(unittest.TestCase):
+
+    def test_seeded_games_are_the_same(self):
+        settings = s.Settings()
+        first, second = g.GM(settings, 42), g.GM(settings, 42)
+        self.assertEqual(first.id, second.id)
+        self.assertEqual(first.board.snapshot().rows, second.board.snapshot().rows)
+        self.assertEqual([sq.id for sq in first.board.content], [sq.id for sq in second.board.content])
+        self.assertNotEqual(first.id, g.GM(settings, 43).id)
+
+    def test_replay(self):
+        with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(io.StringIO()):
+            journal = path.join(directory, 'game.jsonl')
+            played = simulation.Simulation(log_dir=env.LOG_DIR).run(seed=7, journal=journal)
+            result = replay.Replay(journal, env.LOG_DIR).run()
+
+        self.assertIsNotNone(played.winner)
+        self.assertTrue(result.matches())
+        self.assertEqual(result.winner, played.winner)
+        self.assertEqual(result.messages, played.action_count())
+
+
+if __name__ == '__main__':
+    unittest.main()
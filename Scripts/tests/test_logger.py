@@ -0,0 +1,60 @@
+import csv
+import glob
+import os.path as path
+import tempfile
+import time
+import unittest
+import uuid
+
+import env
+
+import common.logger as logger
+import common.messages as m
+
+
+class LoggerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+    def read(self, file_path):
+        with open(file_path, newline='') as log_file:
+            return list(csv.reader(log_file))
+
+    def test_rows_are_streamed(self):
+        log = logger.Logger('game', self.directory.name)
+        guid = uuid.uuid4()
+        for _ in range(3):
+            log.log(m.Move(guid, 'N'), None)
+        log.save_log()
+
+        rows = self.read(log.log_path)
+        self.assertEqual(rows[0], logger.Logger.columns)
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[1][0], 'Move')
+        self.assertEqual(rows[1][2:], ['game', str(guid), 'Unknown', 'Unknown'])
+
+        # Rows logged after the game was saved don't reopen the log
+        log.log(m.Move(guid, 'N'), None)
+        log.save_log()
+        self.assertEqual(len(self.read(log.log_path)), 4)
+
+    def test_rotation(self):
+        log = logger.Logger('game', self.directory.name, max_bytes=200)
+        for _ in range(50):
+            log.log(m.Move(uuid.uuid4(), 'N'), None)
+            # Files are rotated between batches, letting the writer take each row in its own batch
+            time.sleep(0.002)
+        log.save_log()
+
+        files = glob.glob(path.join(self.directory.name, '*.csv'))
+        self.assertGreater(len(files), 1)
+        rows = [self.read(f) for f in files]
+        for r in rows:
+            self.assertEqual(r[0], logger.Logger.columns)
+        self.assertEqual(sum(len(r) - 1 for r in rows), 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
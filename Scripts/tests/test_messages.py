@@ -0,0 +1,104 @@
+import json
+import unittest
+import uuid
+
+import env
+
+import common.binary as b
+import common.messages as m
+
+
+class MessagesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.id = uuid.UUID('00000000000000000000000000000005')
+        self.other = uuid.UUID('00000000000000000000000000000007')
+
+    def test_wire_format(self):
+        self.assertEqual(m.Move(self.id, 'N').to_json(),
+                         '{"action": "move", "direction": "N", "userGuid": "00000000000000000000000000000005"}')
+        self.assertEqual(m.JoinGame(self.id, 'red', 'player').to_json(),
+                         '{"action": "connect", "userGuid": "00000000000000000000000000000005", "preferredTeam": "red", "type": "player"}')
+        self.assertEqual(m.GameMessage(self.id, 'blue', 'member', 2, [self.id, self.other], {'x': 1, 'y': 2}, {'width': 3}).to_json(),
+                         '{"action": "start", "team": "blue", "role": "member", "userGuid": "00000000000000000000000000000005", '
+                         '"teamSize": 2, "teamGuids": ["00000000000000000000000000000005", "00000000000000000000000000000007"], '
+                         '"location": {"x": 1, "y": 2}, "board": {"width": 3}}')
+        self.assertEqual(m.MoveData(self.id, 'OK').to_json(),
+                         '{"action": "move", "result": "OK", "userGuid": "00000000000000000000000000000005", "manhattanDistance": null}')
+        self.assertEqual(m.Message().to_json(), '{}')
+
+    def test_envelope(self):
+        msg = m.PickUpData(self.id, 'OK')
+        msg.gameId = 'abc'
+        self.assertEqual(msg.to_json(),
+                         '{"action": "pickup", "gameId": "abc", "result": "OK", "userGuid": "00000000000000000000000000000005"}')
+
+        decoded, err = m.Message.from_json_player(msg.to_json())
+        self.assertIsNone(err)
+        self.assertEqual(decoded.gameId, 'abc')
+
+    def test_values_are_not_renamed(self):
+        # Renames only apply to keys of the message itself
+        msg = m.KnowledgeExchangeData(self.id, self.other, {'to': 'id', 'id': 1})
+        self.assertIn('"fields": {"to": "id", "id": 1}', msg.to_json())
+
+    def test_round_trip(self):
+        to_gm = [m.JoinGame(self.id, 'red', 'player'), m.Move(self.id, 'S'), m.Discover({'x': 0, 'y': 1}, self.id),
+                 m.RejectKnowledgeExchange(self.id, 'single'), m.AcceptKnowledgeExchange(self.id),
+                 m.AuthorizeKnowledgeExchange(self.id, self.other), m.KnowledgeExchangeData(self.id, self.other, {})]
+        to_player = [m.ConfirmJoiningGame(self.id, 'OK', 'player'), m.DiscoverData(self.id, 'OK', {'x': 0, 'y': 1}, []),
+                     m.PlaceData(self.id, 'OK', 'Correct'), m.GameOver('red')]
+
+        for decode, msgs in ((m.Message.from_json_gm, to_gm), (m.Message.from_json_player, to_player)):
+            for msg in msgs:
+                decoded, err = decode(msg.to_json())
+                self.assertIsNone(err)
+                self.assertIs(type(decoded), type(msg))
+                self.assertEqual(decoded.to_json(), msg.to_json())
+
+    def test_decoded_fields(self):
+        msg, _ = m.Message.from_json_gm(m.Move(self.id, 'E').to_json())
+        self.assertEqual(msg.dir, 'E')
+        self.assertEqual(msg.id, self.id.hex)
+        self.assertIsNone(msg.gameId)
+
+        msg, _ = m.Message.from_json_server('{"action": "start"}')
+        self.assertIsNone(msg.slots)
+
+    def test_missing_field(self):
+        msg, err = m.Message.from_json_gm('{"action": "move", "userGuid": "abc"}')
+        self.assertIsNone(msg)
+        self.assertIsNotNone(err)
+
+    def test_binary_round_trip(self):
+        fields = [{'x': x, 'y': 1, 'value': {'manhattanDistance': x, 'contains': 'empty', 'userGuid': None}} for x in range(3)]
+        msgs = [m.Move(self.id, 'S'), m.DiscoverData(self.id, 'OK', {'x': 0, 'y': 1}, fields),
+                m.KnowledgeExchangeData(self.id, self.other, {'to': 'id', 'id': -300, 'f': 1.5, 'ok': True}),
+                m.Message.from_json_server('{"action": "gui", "board": [["", "RP"], ["G", "B|S"]]}')[0], m.GuiDelta([[0, 1, 'R'], [1000, 2, 'unknown']])]
+        for msg in msgs:
+            msg.gameId = 'abc'
+            data = msg.to_binary()
+            self.assertLess(len(data), len(msg.to_json()))
+            # Same message, and the relay sees the same dict as from json
+            self.assertEqual(b.decode(data).to_json(), msg.to_json())
+            self.assertEqual(b.decode_dict(data), json.loads(msg.to_json()))
+            self.assertEqual(b.encode_dict(json.loads(msg.to_json())), data)
+
+    def test_binary_framing(self):
+        msg = m.GuiDelta([[0x17, 0x1b, 'R']])
+        frame = b.stuff(msg.to_binary())
+        self.assertNotIn(b'\x17', frame)
+        self.assertTrue(b.is_binary(frame))
+        self.assertFalse(b.is_binary(msg.to_json().encode()))
+        decoded, err = m.Message.from_binary_server(b.unstuff(frame))
+        self.assertIsNone(err)
+        self.assertEqual(decoded.cells, [[0x17, 0x1b, 'R']])
+
+        # Messages the receiver does not expect are errors, as with json
+        decoded, err = m.Message.from_binary_gm(b.unstuff(frame))
+        self.assertIsNone(decoded)
+        self.assertIsNotNone(err)
+
+
+if __name__ == '__main__':
+    unittest.main()
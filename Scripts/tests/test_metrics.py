@@ -0,0 +1,52 @@
+import unittest
+import uuid
+
+import env
+
+import external
+import common.clock as clock
+import common.delay as d
+import common.messages as m
+import common.metrics as mt
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_quantiles(self):
+        histogram = mt.Histogram()
+        for us in range(1, 100001):
+            histogram.record(us / 1e6)
+        for q in mt.QUANTILES:
+            self.assertAlmostEqual(histogram.quantile(q), q / 10, delta=q / 10 / 64)
+        self.assertEqual(histogram.max, 0.1)
+        # Early timers do not break the histogram
+        histogram.record(-0.001)
+        self.assertEqual(histogram.count, 100001)
+
+    def test_gm_actions(self):
+        ext = external.GmExternal(lambda msg: None, clock=clock.VirtualClock(), seed=3, log_dir=env.LOG_DIR)
+        ids = [uuid.uuid4().hex for _ in range(6)]
+        for i, id in enumerate(ids):
+            ext.send_message(m.JoinGame(id=id, preferred_team='red' if i % 2 else 'blue', type='player'))
+        for id in ids:
+            ext.send_message(m.Move(id=id, direction='N'))
+        ext.clock.run(until=d.Delay.MOVE / 2)
+        self.assertEqual(ext.metrics.action(m.Move).run.count, 0)
+        self.assertIn('gm_pending_actions{game="g"} 6', ext.metrics_text('game="g"'))
+
+        ext.clock.run(until=1)
+        stats = ext.metrics.action(m.Move)
+        self.assertEqual((stats.queue.count, stats.drift.count, stats.run.count), (6, 6, 6))
+        # On time in virtual time
+        self.assertEqual(stats.drift.max, 0)
+        self.assertEqual(ext.metrics.received, 12)
+        self.assertGreaterEqual(ext.metrics.sent, 12)
+
+        text = ext.metrics_text()
+        self.assertIn('gm_action_seconds_count{action="Move",stage="run"} 6', text)
+        self.assertIn('gm_messages_total{direction="in"} 12', text)
+        self.assertTrue(ext.metrics_summary()[-1].startswith('loop lag'))
+
+
+if __name__ == '__main__':
+    unittest.main()
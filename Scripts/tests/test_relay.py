@@ -0,0 +1,416 @@
+import importlib.util
+import json
+import os
+import sys
+import unittest
+
+import env
+
+from twisted.internet import task
+from twisted.internet.testing import StringTransport
+from twisted.python import failure
+
+import common.framing as framing
+import common.messages as m
+
+# server.py imports its modules from its own directory, which is only on the path while it loads, so the server
+#   package of the other tests is not shadowed by server.py
+SERVER_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'server')
+sys.path.insert(0, SERVER_DIR)
+try:
+    _spec = importlib.util.spec_from_file_location('relay', os.path.join(SERVER_DIR, 'server.py'))
+    relay = importlib.util.module_from_spec(_spec)
+    _spec.loader.exec_module(relay)
+finally:
+    sys.path.remove(SERVER_DIR)
+
+
+def with_game(msg, game_id):
+    return dict(json.loads(msg.to_json()), gameId=game_id)
+
+
+class Client:
+    """ A connection to the relay over a fake transport, reads the json frames the relay sent it """
+
+    def __init__(self, factory, clock):
+        self.clock = clock
+        self.protocol = factory.buildProtocol(None)
+        self.transport = StringTransport()
+        self.protocol.makeConnection(self.transport)
+
+    def send(self, message):
+        data = message if isinstance(message, dict) else json.loads(message.to_json())
+        self.protocol.dataReceived(json.dumps(data).encode() + framing.DELIMITER)
+
+    def received(self):
+        """ Frames written since the last call, once the batched writes are flushed """
+        self.clock.advance(0)
+        data = self.transport.value()
+        self.transport.clear()
+        return [json.loads(frame) for frame in data.split(framing.DELIMITER) if frame]
+
+    def drop(self):
+        self.protocol.connectionLost(failure.Failure(ConnectionError('dropped')))
+
+
+class RelayCase(unittest.TestCase):
+    """ A relay with clients over fake transports, and a game of two players to play on it """
+
+    def setUp(self):
+        self.clock = task.Clock()
+        self.factory = relay.GameFactory(resume_timeout=60.0, migrate_timeout=5.0, clock=self.clock)
+
+    def connect(self):
+        return Client(self.factory, self.clock)
+
+    def register(self, gm, game_id=None, slots=2):
+        """ Registers a game, returns its id and the frames sent to the game master after the reply """
+        setup = {'action': 'start', 'slots': slots}
+        if game_id is not None:
+            setup['gameId'] = game_id
+        gm.send(setup)
+        reply, *frames = gm.received()
+        self.assertEqual(reply['result'], 'OK')
+        return reply['gameId'], frames
+
+    def join(self, guid):
+        """ Connects a player and has it join, returns its client """
+        player = self.connect()
+        player.send(m.JoinGame(id=guid, preferred_team='red', type='player'))
+        return player
+
+    def assert_joins(self, gm, guid, game_id):
+        """ Checks gm was sent the join of one player, to the given game """
+        self.assertEqual([(join['userGuid'], join['gameId']) for join in gm.received()], [(guid, game_id)])
+
+    def start_game(self, gm, guids=('p1', 'p2')):
+        """ Registers a game and has two players join it and start playing, returns its id and the players """
+        game_id, _ = self.register(gm)
+        players = {}
+        for guid in guids:
+            players[guid] = self.join(guid)
+            self.assert_joins(gm, guid, game_id)
+            gm.send(with_game(m.ConfirmJoiningGame(guid, 'OK', 'player'), game_id))
+            self.assertEqual(players[guid].received()[0]['result'], 'OK')
+        for guid in players:
+            gm.send(with_game(m.GameMessage(guid, 'red', 'member', 2, list(players), {'x': 0, 'y': 0}, {}), game_id))
+            self.assertEqual(players[guid].received()[0]['teamGuids'], list(players))
+        return game_id, players
+
+
+class RoutingTest(RelayCase):
+
+    def test_games_of_several_game_masters(self):
+        first, second = self.connect(), self.connect()
+        first_id, _ = self.register(first)
+        second_id, _ = self.register(second)
+        self.assertNotEqual(first_id, second_id)
+        self.assertEqual(set(self.factory.games), {first_id, second_id})
+        self.assertEqual(list(first.protocol.games), [first_id])
+        self.assertEqual(list(second.protocol.games), [second_id])
+
+    def test_join_fullest_open_game(self):
+        first, second = self.connect(), self.connect()
+        first_id, _ = self.register(first)
+        second_id, _ = self.register(second, slots=3)
+        self.join('p1')
+        self.assert_joins(first, 'p1', first_id)
+        # The game with a player waiting for confirmation is the fullest
+        self.join('p2')
+        self.assert_joins(first, 'p2', first_id)
+        self.join('p3')
+        self.assert_joins(second, 'p3', second_id)
+        self.assertEqual(first.received(), [])
+
+    def test_lobby_until_game_registers(self):
+        gm = self.connect()
+        self.start_game(gm)
+        waiting = self.join('p3')
+        self.assertEqual(gm.received(), [])
+        self.assertEqual([player.guid for player in self.factory.lobby], ['p3'])
+
+        other = self.connect()
+        game_id, joins = self.register(other)
+        self.assertEqual([(join['userGuid'], join['gameId']) for join in joins], [('p3', game_id)])
+        self.assertEqual(self.factory.lobby, [])
+        other.send(with_game(m.ConfirmJoiningGame('p3', 'OK', 'player'), game_id))
+        self.assertEqual(waiting.received()[0]['result'], 'OK')
+
+    def test_denied_join_tries_other_game(self):
+        first, second = self.connect(), self.connect()
+        first_id, _ = self.register(first)
+        second_id, _ = self.register(second)
+        player = self.join('p1')
+        self.assert_joins(first, 'p1', first_id)
+
+        # The denial is only passed on once no other game takes the player
+        first.send(with_game(m.ConfirmJoiningGame('p1', 'denied', 'player'), first_id))
+        self.assert_joins(second, 'p1', second_id)
+        self.assertEqual(player.received(), [])
+        second.send(with_game(m.ConfirmJoiningGame('p1', 'denied', 'player'), second_id))
+        self.assertEqual([reply['result'] for reply in player.received()], ['denied'])
+        self.assertTrue(player.transport.disconnecting)
+        self.assertNotIn('p1', self.factory.players)
+
+    def test_routed_by_guid_across_games(self):
+        first, second = self.connect(), self.connect()
+        first_id, first_players = self.start_game(first)
+        second_id, second_players = self.start_game(second, ('p3', 'p4'))
+
+        first_players['p2'].send(m.Move(id='p2', direction='N'))
+        second_players['p3'].send(m.Move(id='p3', direction='S'))
+        self.assertEqual([(frame['userGuid'], frame['direction']) for frame in first.received()], [('p2', 'N')])
+        self.assertEqual([(frame['userGuid'], frame['direction']) for frame in second.received()], [('p3', 'S')])
+
+        second.send(with_game(m.MoveData('p3', 'OK', 4), second_id))
+        first.send(with_game(m.MoveData('p2', 'OK', 2), first_id))
+        self.assertEqual([frame['manhattanDistance'] for frame in second_players['p3'].received()], [4])
+        self.assertEqual([frame['manhattanDistance'] for frame in first_players['p2'].received()], [2])
+        for player in (first_players['p1'], second_players['p4']):
+            self.assertEqual(player.received(), [])
+
+    def test_length_prefixed_client(self):
+        # Each client is answered in the framing of the first frame it sent
+        gm = self.connect()
+        gm.protocol.dataReceived(framing.encode(json.dumps({'action': 'start', 'slots': 2}).encode(), True))
+        self.clock.advance(0)
+        decoder = framing.FrameDecoder(length_prefixed=True)
+        reply, = [json.loads(frame) for frame in decoder.feed(gm.transport.value())]
+        gm.transport.clear()
+        self.assertEqual(reply['result'], 'OK')
+
+        player = self.join('p1')
+        self.clock.advance(0)
+        joins = [json.loads(frame) for frame in decoder.feed(gm.transport.value())]
+        self.assertEqual([(join['userGuid'], join['gameId']) for join in joins], [('p1', reply['gameId'])])
+        confirm = with_game(m.ConfirmJoiningGame('p1', 'OK', 'player'), reply['gameId'])
+        gm.protocol.dataReceived(framing.encode(json.dumps(confirm).encode(), True))
+        self.assertEqual(player.received()[0]['result'], 'OK')
+
+    def test_lost_gm_sends_players_to_lobby(self):
+        gm = self.connect()
+        game_id, _ = self.register(gm, slots=3)
+        self.join('p1')
+        self.join('p2')
+        gm.received()
+        gm.send(with_game(m.ConfirmJoiningGame('p1', 'OK', 'player'), game_id))
+
+        # Neither the admitted player nor the one waiting for confirmation is lost with the game
+        gm.drop()
+        self.assertEqual(self.factory.games, {})
+        self.assertEqual(self.factory.orphans, {})
+        self.assertEqual(sorted(player.guid for player in self.factory.lobby), ['p1', 'p2'])
+        self.assertEqual(self.factory.players, {})
+
+        other = self.connect()
+        other_id, joins = self.register(other)
+        self.assertEqual(sorted((join['userGuid'], join['gameId']) for join in joins),
+                         [('p1', other_id), ('p2', other_id)])
+
+
+class OrphanTest(RelayCase):
+
+    def test_lost_gm_orphans_started_game(self):
+        gm = self.connect()
+        game_id, players = self.start_game(gm)
+        self.assertTrue(self.factory.games[game_id].started)
+
+        gm.drop()
+        self.assertNotIn(game_id, self.factory.games)
+        self.assertEqual(set(self.factory.orphans[game_id].players), set(players))
+        self.assertEqual(self.factory.players, {})
+
+    def test_lost_gm_of_game_not_started(self):
+        gm = self.connect()
+        game_id, _ = self.register(gm)
+        gm.drop()
+        self.assertNotIn(game_id, self.factory.games)
+        self.assertEqual(self.factory.orphans, {})
+
+    def test_registered_again_sends_players_back(self):
+        gm = self.connect()
+        game_id, players = self.start_game(gm)
+        gm.drop()
+
+        resumed = self.connect()
+        resumed_id, joins = self.register(resumed, game_id)
+        self.assertEqual(resumed_id, game_id)
+        self.assertEqual(sorted(join['userGuid'] for join in joins), sorted(players))
+        self.assertTrue(all(join['gameId'] == game_id for join in joins))
+        self.assertNotIn(game_id, self.factory.orphans)
+        self.assertTrue(self.factory.games[game_id].started)
+
+        # The players are back in the game once the game master confirms them
+        for guid in players:
+            resumed.send(with_game(m.ConfirmJoiningGame(guid, 'OK', 'player'), game_id))
+            self.assertEqual(players[guid].received()[0]['result'], 'OK')
+        self.assertEqual(set(self.factory.players), set(players))
+        players['p1'].send(m.Move(id='p1', direction='N'))
+        self.assertEqual(resumed.received()[0]['userGuid'], 'p1')
+
+    def test_reserved_guid_rejoins_orphan(self):
+        gm = self.connect()
+        game_id, players = self.start_game(gm)
+        gm.drop()
+        players['p1'].drop()
+        self.assertNotIn('p1', self.factory.orphans[game_id].players)
+
+        # The player joins again on a new connection before the game resumes, and waits for it
+        rejoined = self.connect()
+        rejoined.send(m.JoinGame(id='p1', preferred_team='red', type='player'))
+        self.assertIs(self.factory.orphans[game_id].players['p1'].address, rejoined.protocol)
+        self.assertEqual(self.factory.lobby, [])
+
+        resumed = self.connect()
+        _, joins = self.register(resumed, game_id)
+        self.assertEqual(sorted(join['userGuid'] for join in joins), ['p1', 'p2'])
+
+    def test_reserved_guid_rejoins_running_game(self):
+        gm = self.connect()
+        game_id, players = self.start_game(gm)
+        players['p1'].drop()
+
+        # A started game takes no new player, but one admitted to it goes back to it
+        rejoined = self.connect()
+        rejoined.send(m.JoinGame(id='p1', preferred_team='red', type='player'))
+        self.assertEqual([(join['userGuid'], join['gameId']) for join in gm.received()], [('p1', game_id)])
+        stranger = self.connect()
+        stranger.send(m.JoinGame(id='p3', preferred_team='red', type='player'))
+        self.assertEqual(gm.received(), [])
+        self.assertEqual([player.guid for player in self.factory.lobby], ['p3'])
+
+    def test_expire_orphan(self):
+        gm = self.connect()
+        game_id, players = self.start_game(gm)
+        gm.drop()
+
+        self.clock.advance(self.factory.resume_timeout)
+        self.assertEqual(self.factory.orphans, {})
+        self.assertEqual(self.factory.reserved, {})
+        # The game is over for its players, they join as new ones
+        players['p1'].send(m.JoinGame(id='p1', preferred_team='red', type='player'))
+        self.assertEqual([player.guid for player in self.factory.lobby], ['p1'])
+
+    def test_resumed_orphan_does_not_expire(self):
+        gm = self.connect()
+        game_id, players = self.start_game(gm)
+        gm.drop()
+        resumed = self.connect()
+        self.register(resumed, game_id)
+
+        self.clock.advance(self.factory.resume_timeout)
+        self.assertIn(game_id, self.factory.games)
+        self.assertEqual(self.factory.reserved, {'p1': game_id, 'p2': game_id})
+
+
+class MigrationTest(RelayCase):
+
+    def setUp(self):
+        super().setUp()
+        self.gm = self.connect()
+        self.game_id, self.players = self.start_game(self.gm)
+        self.game = self.factory.games[self.game_id]
+
+    def standby(self, capacity=1):
+        gm = self.connect()
+        gm.send(m.Standby(capacity=capacity))
+        return gm
+
+    def freeze(self):
+        """ Has the game master ask to move its game, and the players send moves meanwhile, which are held """
+        self.gm.send(with_game(m.MigrateGame(), self.game_id))
+        self.assertEqual(self.gm.received(), [{'action': 'migrate', 'gameId': self.game_id}])
+        for guid, direction in (('p1', 'N'), ('p2', 'S'), ('p1', 'E')):
+            self.players[guid].send(m.Move(id=guid, direction=direction))
+        self.assertEqual(self.gm.received(), [])
+
+    def assert_adopt(self, gm, state='state'):
+        self.assertEqual(gm.received(), [{'action': 'adopt', 'gameId': self.game_id, 'state': state}])
+
+    def assert_held(self, gm):
+        """ Checks the moves held during the pause reach gm, in order """
+        self.assertEqual([(frame['userGuid'], frame['direction']) for frame in gm.received()],
+                         [('p1', 'N'), ('p2', 'S'), ('p1', 'E')])
+        self.assertIsNone(self.game.migration)
+        self.assertIs(self.game.game_master, gm.protocol)
+
+    def test_held_frames_follow_adoption(self):
+        target = self.standby()
+        self.freeze()
+        self.gm.send(with_game(m.GameState('OK', 'state'), self.game_id))
+        self.assert_adopt(target)
+        self.assertEqual(self.gm.received(), [])
+
+        target.send(with_game(m.ConfirmAdoptGame('OK'), self.game_id))
+        self.assert_held(target)
+        # The old game master drops the state it kept
+        self.assertEqual(self.gm.received(), [{'action': 'adopt', 'result': 'OK', 'gameId': self.game_id}])
+        self.players['p2'].send(m.Move(id='p2', direction='W'))
+        self.assertEqual(target.received()[0]['direction'], 'W')
+        self.assertEqual(self.gm.received(), [])
+
+    def test_freeze_timeout_game_kept(self):
+        self.standby()
+        self.freeze()
+        self.clock.advance(self.factory.migrate_timeout)
+        self.assertEqual(self.gm.received(), [{'action': 'unfreeze', 'gameId': self.game_id}])
+        # Frames are still held, the game master may have frozen the game already
+        self.assertEqual(len(self.game.migration.held), 3)
+
+        self.gm.send(with_game(m.GameState('denied'), self.game_id))
+        self.assert_held(self.gm)
+
+    def test_freeze_timeout_late_state(self):
+        target = self.standby()
+        self.freeze()
+        self.clock.advance(self.factory.migrate_timeout)
+        self.gm.received()
+
+        self.gm.send(with_game(m.GameState('OK', 'state'), self.game_id))
+        self.assert_adopt(target)
+        target.send(with_game(m.ConfirmAdoptGame('OK'), self.game_id))
+        self.assert_held(target)
+
+    def test_freeze_not_answered(self):
+        self.standby()
+        self.freeze()
+        self.clock.advance(self.factory.migrate_timeout)
+        self.clock.advance(self.factory.migrate_timeout)
+        self.assertIn(self.game_id, self.factory.orphans)
+        self.assertNotIn(self.game_id, self.factory.games)
+
+    def test_target_lost_while_adopting(self):
+        first = self.standby(capacity=2)
+        second = self.standby()
+        self.freeze()
+        self.gm.send(with_game(m.GameState('OK', 'state'), self.game_id))
+        self.assert_adopt(first)
+
+        # The state is sent on to the next standby game master, then back to the old one
+        first.drop()
+        self.assert_adopt(second)
+        second.send(with_game(m.ConfirmAdoptGame('denied'), self.game_id))
+        self.assert_adopt(self.gm)
+        self.gm.send(with_game(m.ConfirmAdoptGame('OK'), self.game_id))
+        self.assert_held(self.gm)
+        self.assertEqual(self.gm.protocol.games, {self.game_id: self.game})
+
+    def test_not_adopted(self):
+        target = self.standby()
+        self.freeze()
+        self.gm.send(with_game(m.GameState('OK', 'state'), self.game_id))
+        self.assert_adopt(target)
+        self.clock.advance(self.factory.migrate_timeout)
+        self.assert_adopt(self.gm)
+        self.gm.send(with_game(m.ConfirmAdoptGame('denied'), self.game_id))
+
+        # The old game master keeps its checkpoint, the game waits to be resumed from it
+        self.assertEqual(self.gm.received(), [{'action': 'adopt', 'result': 'denied', 'gameId': self.game_id}])
+        self.assertIn(self.game_id, self.factory.orphans)
+        # The target that timed out adopts it too late, and drops it
+        target.send(with_game(m.ConfirmAdoptGame('OK'), self.game_id))
+        self.assertEqual(target.received(), [{'action': 'adopt', 'result': 'OK', 'gameId': self.game_id}])
+
+
+if __name__ == '__main__':
+    unittest.main()
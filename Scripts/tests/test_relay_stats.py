@@ -0,0 +1,66 @@
+import json
+import unittest
+
+import env
+
+from twisted.internet.testing import StringTransport
+
+import common.framing as framing
+from server.admin import AdminFactory
+from server.player import MAX_RESPONSE_TIME, Player
+from server.stats import GameCounters, RelayStats
+
+
+class RelayStatsTest(unittest.TestCase):
+
+    def test_counters(self):
+        counters = GameCounters()
+        counters.received(100, 0.00002, 0.00001)
+        counters.received(50, 0.00002, 0.00001)
+        counters.sent(120)
+        for ms in range(1, 101):
+            counters.response.record(ms / 1000)
+
+        report = counters.to_dict()
+        self.assertEqual((report['frames_in'], report['bytes_in'], report['frames_out'], report['bytes_out']),
+                         (2, 150, 1, 120))
+        self.assertAlmostEqual(report['parse_time'], 0.00004)
+        self.assertEqual(report['response']['count'], 100)
+        self.assertAlmostEqual(report['response']['p50'], 0.05, delta=0.05 / 64)
+        self.assertEqual(report['response']['max'], 0.1)
+
+    def test_report_is_json(self):
+        stats = RelayStats()
+        stats.total.received(10, 0.001, 0.002)
+        stats.parse.record(0.001)
+        report = json.loads(json.dumps(stats.to_dict()))
+        self.assertEqual(report['parse']['count'], 1)
+        self.assertEqual(report['response']['p99'], 0)
+        self.assertIn('1 frames in', str(stats))
+
+    def test_response_pairs_with_its_request(self):
+        player = Player(None, 'guid')
+        player.requested('move', 0.0)
+        player.requested('discover', 0.1)
+        # The move is never answered, the next one is not paired with it
+        player.requested('move', 0.2 + MAX_RESPONSE_TIME)
+        self.assertAlmostEqual(player.answered('discover', 0.5), 0.4)
+        self.assertAlmostEqual(player.answered('move', 0.5 + MAX_RESPONSE_TIME), 0.3)
+        self.assertIsNone(player.answered('move', 0.6 + MAX_RESPONSE_TIME))
+
+        player.requested('move', 20.0)
+        player.forget_requests()
+        self.assertIsNone(player.answered('move', 20.1))
+
+    def test_admin_denies_malformed_requests(self):
+        admin = AdminFactory(None).buildProtocol(None)
+        transport = StringTransport()
+        admin.makeConnection(transport)
+        admin.dataReceived(b'{"action": ' + framing.DELIMITER + b'[]' + framing.DELIMITER + b'1' + framing.DELIMITER)
+        self.assertFalse(transport.disconnecting)
+        replies = [json.loads(frame) for frame in transport.value().split(framing.DELIMITER) if frame]
+        self.assertEqual([(reply['action'], reply['result']) for reply in replies], [(None, 'denied')] * 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,67 @@
+import unittest
+import json
+import uuid
+
+import env
+
+import common.binary as b
+import common.messages as m
+import common.routing as rt
+
+
+class RoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        id = uuid.uuid4()
+        self.msgs = [
+            m.SetUpGame(16), m.ConfirmSetUpGame('OK'), m.GameMessage(id, 'red', 'leader', 4, [id], {'x': 0, 'y': 0}, {}),
+            m.JoinGame(id, 'red', 'player'), m.ConfirmJoiningGame(id, 'OK', 'player'),
+            m.Move(id, 'N'), m.MoveData(id, 'OK', 2), m.GameOver('red'),
+            m.AuthorizeKnowledgeExchange(id, id), m.RejectKnowledgeExchange(id, 'single'), m.AcceptKnowledgeExchange(id),
+            m.KnowledgeExchangeData(id, id, {}), m.GuiDelta([])]
+
+    def test_routes_are_unique(self):
+        for cls in rt.ROUTES.values():
+            self.assertIs(rt.ROUTES[cls.route], cls)
+
+    def test_json_route_matches_class(self):
+        for msg in self.msgs:
+            self.assertEqual(rt.route_of(json.loads(msg.to_json())), msg.route)
+
+    def test_json_table(self):
+        routes = rt.JsonTable({m.Move: 'move', m.MoveData: 'move data', m.GameMessage: 'game'}, 'default')
+        for msg, handler in ((m.Move(uuid.uuid4(), 'N'), 'move'), (m.MoveData(uuid.uuid4(), 'OK'), 'move data'),
+                             (self.msgs[2], 'game'), (self.msgs[0], 'default'), (m.PickUp(uuid.uuid4()), 'default')):
+            self.assertEqual(routes.handler_of(json.loads(msg.to_json())), handler)
+        self.assertEqual(routes.handler_of({'action': 'unknown'}), 'default')
+
+    def test_header(self):
+        id = uuid.uuid4()
+        fields = [{'x': 1, 'y': 2, 'value': {'userGuid': id.hex}}]
+        msgs = self.msgs + [m.DiscoverData(id, 'OK', {'x': 1, 'y': 2}, fields), m.Discover({'x': 1, 'y': 2}, id)]
+        for msg in msgs:
+            msg.gameId = 'g'
+            parsed = json.loads(msg.to_json())
+            for header in (rt.header_of(msg.to_json().encode()), rt.header_of(msg.to_binary())):
+                if header is None:
+                    # Discover has its guid after a nested value
+                    self.assertIs(type(msg), m.Discover)
+                    continue
+                self.assertEqual(rt.route_of(header), msg.route)
+                self.assertEqual(header.keys(), parsed.keys() & header.keys())
+                for key in rt.ROUTING_KEYS | {'action', 'gameId'}:
+                    self.assertEqual(header.get(key), parsed.get(key))
+
+    def test_header_needs_parse(self):
+        # Escapes, and keys in an order the codec does not write
+        self.assertIsNone(rt.header_of(b'{"action": "send", "userGuid": "a\\"b", "fields": {}}'))
+        self.assertIsNone(rt.header_of(b'{"action": "state", "result": "OK", "location": {}, "userGuid": "a"}'))
+        self.assertEqual(rt.header_of(b'{"action":"state","userGuid":"a","result":"OK","location":{"x":1}}'),
+                         {'action': 'state', 'userGuid': 'a', 'result': 'OK', 'location': None})
+        # Flat messages are parsed whole
+        self.assertEqual(rt.header_of(b'{"action": "move", "userGuid": "a\\"b", "result": "OK"}'),
+                         {'action': 'move', 'userGuid': 'a"b', 'result': 'OK'})
+
+
+if __name__ == '__main__':
+    unittest.main()
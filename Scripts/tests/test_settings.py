@@ -1,3 +1,6 @@
+import json
+import os
+import tempfile
 import unittest
 
 import env
@@ -17,6 +20,21 @@ class SettingsTest(unittest.TestCase):
         for _attr, value in s.__dict__.items():
             self.assertNotEqual(value, None)
 
+    def test_file_without_compact_board(self):
+        s = settings.Settings()
+        data = {k: v for k, v in vars(s).items() if k not in ('file_path', 'compact_board')}
+        with tempfile.TemporaryDirectory() as directory:
+            file_path = os.path.join(directory, 'settings.json')
+            with open(file_path, 'w') as settings_file:
+                json.dump(data, settings_file)
+            default_path = settings.Settings.settings_file_path
+            # An absolute path is used as is
+            settings.Settings.settings_file_path = file_path
+            try:
+                self.assertFalse(settings.Settings().compact_board)
+            finally:
+                settings.Settings.settings_file_path = default_path
+
 
 if __name__ == '__main__':
     unittest.main(exit=False)
\ No newline at end of file
@@ -0,0 +1,33 @@
+import contextlib
+import io
+import unittest
+
+import env
+
+import common.settings as s
+import simulation
+
+
+class SimulationTest(unittest.TestCase):
+
+    def run_game(self, **options):
+        with contextlib.redirect_stdout(io.StringIO()):
+            return simulation.Simulation(log_dir=env.LOG_DIR, **options).run(seed=1)
+
+    def test_seeded_runs_are_the_same(self):
+        first, second = self.run_game(), self.run_game()
+        for result in (first, second):
+            self.assertIn(result.winner, ('red', 'blue'))
+            self.assertEqual(result.actions['JoinGame'], s.Settings().player_count_per_team * 2)
+        self.assertEqual(first.winner, second.winner)
+        self.assertEqual(first.actions, second.actions)
+
+    def test_timeout(self):
+        # Stopped before any piece could be placed
+        result = self.run_game(timeout=1)
+        self.assertIsNone(result.winner)
+        self.assertEqual(result.actions['PlacePiece'], 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,100 @@
+import unittest
+
+import env
+
+from server.spectators import SpectatorHub
+
+
+class FakeTransport:
+
+    def __init__(self):
+        self.aborted = False
+
+    def abortConnection(self):
+        self.aborted = True
+
+
+class FakeWriter:
+
+    def __init__(self):
+        self.paused = False
+        self.on_resume = None
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.on_resume()
+
+
+class FakeConnection:
+
+    def __init__(self):
+        self.transport = FakeTransport()
+        self.writer = FakeWriter()
+        self.frames = []
+        self.closed = False
+
+    def message(self, frame):
+        self.frames.append(frame)
+
+    def close(self):
+        self.closed = True
+
+
+class SpectatorsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.hub = SpectatorHub(max_stall=60)
+        self.early = FakeConnection()
+        self.hub.add(self.early, 'g')
+
+    def test_frames_are_shared(self):
+        other = FakeConnection()
+        self.hub.add(other, None)
+        self.hub.publish('g', 'key', True)
+        self.hub.publish('g', 'delta', False)
+        self.hub.publish('h', 'other game', True)
+        self.assertEqual(self.early.frames, ['key', 'delta'])
+        self.assertEqual(other.frames, ['key', 'delta', 'other game'])
+
+    def test_late_spectator_gets_keyframe(self):
+        self.hub.publish('g', 'key', True)
+        self.hub.publish('g', 'delta', False)
+        late = FakeConnection()
+        self.hub.add(late, 'g')
+        self.assertEqual(late.frames, ['key', 'delta'])
+
+        # Without a keyframe yet, deltas are skipped until there is one
+        late = FakeConnection()
+        self.hub.add(late, 'h')
+        self.hub.publish('h', 'delta', False)
+        self.hub.publish('h', 'key', True)
+        self.assertEqual(late.frames, ['key'])
+
+    def test_slow_spectator_is_downsampled(self):
+        self.hub.publish('g', 'key 1', True)
+        self.early.writer.pause()
+        self.hub.publish('g', 'delta 1', False)
+        self.hub.publish('g', 'key 2', True)
+        self.hub.publish('g', 'delta 2', False)
+        self.early.writer.resume()
+        self.assertEqual(self.early.frames, ['key 1', 'key 2', 'delta 2'])
+
+        self.hub.max_stall = -1
+        self.early.writer.pause()
+        self.hub.publish('g', 'delta 3', False)
+        self.assertTrue(self.early.transport.aborted)
+        self.assertEqual(self.hub.spectators, {})
+
+    def test_end(self):
+        self.hub.publish('g', 'key', True)
+        self.hub.end('g', 'end')
+        self.assertEqual(self.early.frames, ['key', 'end'])
+        self.assertTrue(self.early.closed)
+        self.assertEqual(self.hub.history, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
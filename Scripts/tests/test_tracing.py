@@ -0,0 +1,59 @@
+import glob
+import os
+import tempfile
+import unittest
+import uuid
+
+import env
+
+import external
+import common.binary as b
+import common.clock as clock
+import common.delay as d
+import common.messages as m
+import common.routing as rt
+import common.tracing as tr
+
+
+class TracingTest(unittest.TestCase):
+
+    def test_envelope(self):
+        msg = m.Move(id=uuid.uuid4().hex, direction='N')
+        self.assertNotIn('traceId', msg.to_json())
+        msg.traceId = tr.new_id()
+        for header in (rt.header_of(msg.to_json().encode()), rt.header_of(msg.to_binary())):
+            self.assertEqual(header['traceId'], msg.traceId)
+        self.assertEqual(m.Message.from_json_gm(msg.to_json())[0].traceId, msg.traceId)
+        self.assertEqual(b.decode(msg.to_binary()).traceId, msg.traceId)
+
+    def test_gm_spans(self):
+        with tempfile.TemporaryDirectory() as directory:
+            tracer = tr.Tracer(directory, 'gm')
+            sent = []
+            ext = external.GmExternal(sent.append, clock=clock.VirtualClock(), seed=3, game_id='g', tracer=tracer,
+                                      log_dir=env.LOG_DIR)
+            ids = [uuid.uuid4().hex for _ in range(2)]
+            for i, id in enumerate(ids):
+                ext.send_message(m.JoinGame(id=id, preferred_team='red' if i % 2 else 'blue', type='player'))
+            move = m.Move(id=ids[0], direction='N')
+            move.traceId = tr.new_id()
+            ext.send_message(move)
+            ext.clock.run(until=1)
+            tracer.close()
+
+            # The result of the traced request, and only it, carries its trace
+            traced = [msg for msg in sent if msg.traceId is not None]
+            self.assertEqual([(type(msg), msg.traceId) for msg in traced], [(m.MoveData, move.traceId)])
+
+            games = tr.read(glob.glob(os.path.join(directory, '*.jsonl')))
+            self.assertEqual(list(games), ['g'])
+            # The delay ends when the action runs, in virtual time it starts before the message was queued
+            spans = {span['name']: span for span in games['g']}
+            self.assertEqual(set(spans), {'gm queue', 'gm delay', 'gm run'})
+            self.assertAlmostEqual(spans['gm delay']['dur'], d.Delay.MOVE * 1e6, delta=1)
+            self.assertEqual(spans['gm run']['args']['action'], 'Move')
+
+            self.assertEqual(tr.hop_stats(games['g'])['gm run'].count, 1)
+            events = tr.chrome_trace(games['g'])['traceEvents']
+            self.assertEqual([e['ph'] for e in events if e['name'] == 'request'], ['s', 't', 'f'])
+            self.assertEqual(sum(e['ph'] == 'X' for e in events), 3)
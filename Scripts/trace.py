@@ -0,0 +1,42 @@
+import argparse
+import glob
+import json
+import os
+
+import common.tracing as tr
+
+# Turns the spans written by the traced processes (--trace <dir>, see common/tracing.py) into a Chrome trace event
+#   file per game, <game id>.trace.json, to be opened in chrome://tracing or Perfetto, and prints the quantiles of
+#   every hop of the requests and of the gaps between two hops, to find which one adds the tail latency.
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('directory', help='Directory the traced processes wrote their spans to')
+    parser.add_argument(
+        '-o', '--output', help='Directory to write the trace event files to, the trace directory by default')
+
+    args = parser.parse_args()
+    output = args.output or args.directory
+    os.makedirs(output, exist_ok=True)
+
+    games = tr.read(sorted(glob.glob(os.path.join(args.directory, '*.jsonl'))))
+    if not games:
+        print(f'> trace: no spans in {args.directory}')
+        return
+    for game, spans in games.items():
+        path = os.path.join(output, f'{game or "unknown"}.trace.json')
+        with open(path, 'w') as trace_file:
+            json.dump(tr.chrome_trace(spans), trace_file)
+        traces = len({span['trace'] for span in spans})
+        print(f'> trace: game {game}: {traces} requests, {len(spans)} spans, written to {path}')
+
+        print(f'> trace:   {"hop, times in ms":<40} {"count":>7} {"p50":>8} {"p90":>8} {"p99":>8} {"max":>8}')
+        stats = tr.hop_stats(spans)
+        for name, histogram in sorted(stats.items(), key=lambda item: -item[1].quantile(0.99)):
+            quantiles = ' '.join(f'{histogram.quantile(q) * 1e3:8.2f}' for q in (0.5, 0.9, 0.99))
+            print(f'> trace:   {name:<40} {histogram.count:>7} {quantiles} {histogram.max * 1e3:8.2f}')
+
+
+if __name__ == '__main__':
+    main()